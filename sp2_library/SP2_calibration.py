@@ -9,6 +9,7 @@ import math
 import mysql.connector
 from datetime import datetime
 import calendar
+import multiprocessing
 import scipy.optimize
 import SP2_utilities
 
@@ -67,18 +68,7 @@ def makeVariableDict(variable_list):
 
 
 
-def writeFitToDatabase(calibration_ID,popt,perr,cnx,cursor):
-
-	popt_dict = makeVariableDict(popt)
-	pcov_dict = makeVariableDict(perr)
-
-	if len(popt) == 2:
-		calibration_function = 'linear'
-	if len(popt) == 3:
-		calibration_function = 'quadratic'
-
-
-	cursor.execute('''
+fit_update_statement = '''
 		UPDATE 
 			sp2_calibrations
 		SET
@@ -91,8 +81,30 @@ def writeFitToDatabase(calibration_ID,popt,perr,cnx,cursor):
 			calibration_function = %s
 		WHERE
 			id = %s
-		''',
-		(popt_dict[0],popt_dict[1],popt_dict[2],pcov_dict[0],pcov_dict[1],pcov_dict[2],calibration_function,calibration_ID))
+		'''
+
+
+def _makeFitUpdateValues(calibration_ID,popt,perr):
+	"""
+	get the values for fit_update_statement from a fit, errors that are not finite (eg. from a fit with no degrees of freedom) are written as NULL
+	"""
+	popt_dict = makeVariableDict(popt)
+	pcov_dict = makeVariableDict(perr)
+	for i in pcov_dict:
+		if pcov_dict[i] is not None and not np.isfinite(pcov_dict[i]):
+			pcov_dict[i] = None
+
+	if len(popt) == 2:
+		calibration_function = 'linear'
+	if len(popt) == 3:
+		calibration_function = 'quadratic'
+
+	return (popt_dict[0],popt_dict[1],popt_dict[2],pcov_dict[0],pcov_dict[1],pcov_dict[2],calibration_function,calibration_ID)
+
+
+def writeFitToDatabase(calibration_ID,popt,perr,cnx,cursor):
+
+	cursor.execute(fit_update_statement,_makeFitUpdateValues(calibration_ID,popt,perr))
 	cnx.commit()
 
 def calcRSquared(xdata,ydata,popt,fit_function):
@@ -110,3 +122,165 @@ def calcRSquared(xdata,ydata,popt,fit_function):
 	return r_squared
 
 
+#Batch calibration methods
+
+def getCalibrationPointsForIDs(calibration_IDs,cnx,cursor):
+	"""
+	Retrieve the calibration points for many calibrations in one query.
+	Returns a NumPy structured array with calibration_ID, mobility_diameter and incand_pk_ht columns, sorted by calibration_ID (None values become NaNs).
+	"""
+	calibration_IDs = [int(calibration_ID) for calibration_ID in calibration_IDs]
+	point_dtype = [('calibration_ID','i8'),('mobility_diameter','f8'),('incand_pk_ht','f8')]
+	if calibration_IDs == []:
+		return np.array([],dtype=point_dtype)
+
+	cursor.execute('''
+		SELECT 
+			calibration_ID,
+			mobility_diameter,
+			incand_pk_ht
+		FROM
+			sp2_calibration_points  
+		WHERE
+			calibration_ID IN (''' + ','.join(['%s']*len(calibration_IDs)) + ''')
+			AND id > %s
+		ORDER BY calibration_ID
+		''',
+		tuple(calibration_IDs)+(0,))
+
+	return np.array(cursor.fetchall(),dtype=point_dtype)
+
+
+def groupCalibrationPoints(calibration_points):
+	"""
+	Split the calibration points from getCalibrationPointsForIDs by calibration_ID and convert the mobility diameters to rBC masses (see getPeakHeightAndMassLists).
+	Points with a missing diameter or peak height are dropped.
+
+	Returns
+	-------
+	dictionary of (incand_pk_hts, rBC_masses) numpy arrays keyed by calibration_ID
+	"""
+	calibration_points = calibration_points[~np.isnan(calibration_points['mobility_diameter']) & ~np.isnan(calibration_points['incand_pk_ht'])]
+	calibration_points = calibration_points[np.argsort(calibration_points['calibration_ID'],kind='mergesort')]
+
+	calibration_IDs,first_points = np.unique(calibration_points['calibration_ID'],return_index=True)
+	incand_pk_hts = np.split(calibration_points['incand_pk_ht'],first_points[1:])
+	rBC_masses = np.split(SP2_utilities.calcGyselMass(calibration_points['mobility_diameter']),first_points[1:])
+
+	calibration_groups = {}
+	for calibration_ID,group_pk_hts,group_masses in zip(calibration_IDs.tolist(),incand_pk_hts,rBC_masses):
+		calibration_groups[calibration_ID] = (group_pk_hts,group_masses)
+
+	return calibration_groups
+
+
+def _fitCalibrationGroup(task):
+	"""
+	fit one calibration, this runs in the worker processes of fitCalibrationGroups
+	"""
+	calibration_ID,fit_function,incand_pk_hts,rBC_masses,initial_values = task
+	popt,perr = SP2_utilities.fitFunction(fit_function,incand_pk_hts,rBC_masses,**initial_values)
+	return calibration_ID,popt,perr
+
+
+def fitCalibrationGroups(calibration_groups,fit_function,processes=1,**initial_values):
+	"""
+	Fit the rBC mass as a function of incandescence peak height for each calibration (see SP2_utilities.fitFunction).
+
+	Parameters
+	----------
+	calibration_groups : dictionary
+		(incand_pk_hts, rBC_masses) keyed by calibration_ID, as returned by groupCalibrationPoints
+	fit_function : function
+		Calibration function, eg. SP2_utilities.linear or SP2_utilities.quadratic.  This must be a module level function if processes is not 1.
+	processes : int
+		Number of worker processes.  With 1 the fits are done in this process, if None one process per CPU is used.
+	initial_values : 
+		p0 for the fits, as for SP2_utilities.fitFunction
+
+	Returns
+	-------
+	dictionary of (popt, perr) keyed by calibration_ID, these are NaNs for fits that failed
+	"""
+	tasks = [(calibration_ID,fit_function,incand_pk_hts,rBC_masses,initial_values) for calibration_ID,(incand_pk_hts,rBC_masses) in sorted(calibration_groups.items())]
+
+	if processes == 1:
+		fit_results = map(_fitCalibrationGroup,tasks)
+	else:
+		pool = multiprocessing.Pool(processes)
+		try:
+			fit_results = pool.map(_fitCalibrationGroup,tasks)
+			pool.close()
+		except:
+			pool.terminate()
+			raise
+		finally:
+			pool.join()
+
+	calibration_fits = {}
+	for calibration_ID,popt,perr in fit_results:
+		calibration_fits[calibration_ID] = (popt,perr)
+
+	return calibration_fits
+
+
+def writeFitsToDatabase(calibration_fits,cnx,cursor):
+	"""
+	Write the results of many calibration fits (as returned by fitCalibrationGroups) to the database in a single transaction.  
+	Fits that failed (NaN coefficients) are not written, and errors that are not finite are written as NULL.  If any update fails, none are written.
+
+	Returns
+	-------
+	list of the calibration_IDs that were updated
+	list of the calibration_IDs that were skipped because their fit failed
+	"""
+	update_values = []
+	skipped_IDs = []
+	for calibration_ID,(popt,perr) in sorted(calibration_fits.items()):
+		if np.any(np.isnan(np.asarray(popt,dtype=np.float64))):
+			skipped_IDs.append(calibration_ID)
+			continue
+		update_values.append(_makeFitUpdateValues(calibration_ID,popt,perr))
+
+	if update_values == []:
+		return [],skipped_IDs
+
+	try:
+		cursor.executemany(fit_update_statement,update_values)
+		cnx.commit()
+	except:
+		cnx.rollback()
+		raise
+
+	return [values[-1] for values in update_values],skipped_IDs
+
+
+def refitCalibrations(calibration_IDs,fit_function,cnx,cursor,processes=1,**initial_values):
+	"""
+	Refit many calibrations and write the results to the database, using one query for the calibration points and one transaction for the updates.
+	The IDs of calibrations whose fit failed are printed, these are not updated.
+	This gives the same fits as getCalibrationPoints, getPeakHeightAndMassLists, SP2_utilities.fitFunction and writeFitToDatabase applied to each calibration in turn.
+
+	Parameters
+	----------
+	calibration_IDs : list of ints
+		IDs of the calibrations to refit, calibrations without any points are skipped
+	fit_function : function
+		Calibration function, eg. SP2_utilities.linear or SP2_utilities.quadratic
+	processes : int
+		Number of worker processes for the fits (see fitCalibrationGroups)
+	initial_values : 
+		p0 for the fits, as for SP2_utilities.fitFunction
+
+	Returns
+	-------
+	dictionary of (popt, perr) keyed by calibration_ID
+	"""
+	calibration_points = getCalibrationPointsForIDs(calibration_IDs,cnx,cursor)
+	calibration_groups = groupCalibrationPoints(calibration_points)
+	calibration_fits = fitCalibrationGroups(calibration_groups,fit_function,processes,**initial_values)
+	updated_IDs,skipped_IDs = writeFitsToDatabase(calibration_fits,cnx,cursor)
+	if skipped_IDs != []:
+		print 'fits failed for calibrations', skipped_IDs, 'these were not updated'
+
+	return calibration_fits
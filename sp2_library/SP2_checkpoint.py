@@ -0,0 +1,151 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+import os
+import json
+
+"""
+This module has a checkpoint file for resuming the ingest of .sp2b files after an interruption
+"""
+
+
+class IngestCheckpoint(object):
+
+	"""
+
+	This class records the progress of writing particles from .sp2b files, so an interrupted ingest can be resumed from the last committed write instead of from the start of each file.
+	The checkpoint is saved after each commit, so resuming is at-least-once: if the ingest stops between a commit and the checkpoint save, the rows from that commit 
+	(up to 2000 rows, or one sink write) are written again.
+	For each particle type (eg. 'incand' or 'nonincand') and file it keeps the file_index of the last particle committed, the UNIX_UTC_ts_int_end of that particle (used to chain UNIX_UTC_ts_int_start),
+	the particle count, and whether the file is complete.  The checkpoint is a JSON file that is rewritten after every update.
+
+	Pass it to the SP2_raw_data writers as parameters['checkpoint'] and they will update it after each commit, skip complete files, and resume partly written files.
+
+	"""
+
+	def __init__(self, checkpoint_path):
+
+		"""
+		Parameters
+		----------
+		checkpoint_path : string
+			Path of the checkpoint file.  If it exists, the progress recorded in it is loaded.
+		"""
+
+		self.checkpoint_path = checkpoint_path
+		self.file_states = {}
+		self.last_files = {}
+
+		if os.path.exists(checkpoint_path):
+			with open(checkpoint_path,'r') as checkpoint_file:
+				checkpoint_data = json.load(checkpoint_file)
+			self.file_states = checkpoint_data['file_states']
+			self.last_files = checkpoint_data['last_files']
+
+
+	def getFileState(self, particle_type, file_name):
+		"""
+		Get the progress recorded for a file, as a dictionary with the keys file_index, prev_particle_ts, count and complete, or None if nothing has been written from this file
+		"""
+		return self.file_states.get(particle_type,{}).get(file_name)
+
+
+	def isComplete(self, particle_type, file_name):
+		"""
+		Check if all the particles of a type have been written from a file
+		"""
+		file_state = self.getFileState(particle_type,file_name)
+		return file_state is not None and file_state['complete']
+
+
+	def getLastState(self, particle_type):
+		"""
+		Get the prev_particle_ts and count after the most recently updated file, eg. to continue the timestamp chaining when a new run starts.  Returns None if nothing has been written.
+		"""
+		if particle_type not in self.last_files:
+			return None
+		file_state = self.getFileState(particle_type,self.last_files[particle_type])
+		return file_state['prev_particle_ts'],file_state['count']
+
+
+	def getResumePoint(self, particle_type, file_name, prev_particle_ts, count):
+		"""
+		Get the record to start writing a file from, and the prev_particle_ts and count to start with.
+
+		Parameters
+		----------
+		particle_type : string
+			Particle type (eg. 'incand')
+		file_name : string
+			.sp2b file name
+		prev_particle_ts : float
+			Timestamp of the previous particle, used if the file has not been started
+		count : int
+			Particle count, used if the file has not been started
+
+		Returns
+		-------
+		start_file_index, prev_particle_ts, count
+		"""
+		file_state = self.getFileState(particle_type,file_name)
+		if file_state is None:
+			return 0,prev_particle_ts,count
+
+		return file_state['file_index']+1,file_state['prev_particle_ts'],file_state['count']
+
+
+	def update(self, particle_type, file_name, file_index, prev_particle_ts, count, complete=False):
+		"""
+		Record the progress for a file and save the checkpoint.  This should only be called once the particles up to file_index have been committed.
+
+		Parameters
+		----------
+		particle_type : string
+			Particle type (eg. 'incand')
+		file_name : string
+			.sp2b file name
+		file_index : int
+			Index of the last record written from the file
+		prev_particle_ts : float
+			UNIX_UTC_ts_int_end of the last particle written
+		count : int
+			Particle count after the last particle written
+		complete : bool
+			True if all the particles in the file have been written
+		"""
+		self.file_states.setdefault(particle_type,{})[file_name] = {
+			'file_index':int(file_index),
+			'prev_particle_ts':prev_particle_ts,
+			'count':int(count),
+			'complete':complete,
+			}
+		self.last_files[particle_type] = file_name
+		self.save()
+
+
+	def save(self):
+		"""
+		Write the checkpoint file.  A temporary file is written and synced to disk first, then moved over the checkpoint in one step, 
+		so an interruption (or a power loss) leaves either the old or the new checkpoint and never a partial one.
+		"""
+		temporary_path = self.checkpoint_path + '.tmp'
+		with open(temporary_path,'w') as checkpoint_file:
+			json.dump({'file_states':self.file_states,'last_files':self.last_files},checkpoint_file)
+			checkpoint_file.flush()
+			os.fsync(checkpoint_file.fileno())
+
+		_replaceFile(temporary_path,self.checkpoint_path)
+
+
+def _replaceFile(source_path, destination_path):
+	"""
+	move a file over another in one step.  os.rename does this on POSIX, but on Windows it can't replace an existing file, so MoveFileEx is used instead.
+	"""
+	if os.name != 'nt':
+		os.rename(source_path,destination_path)
+		return
+
+	import ctypes
+	MOVEFILE_REPLACE_EXISTING = 0x1
+	MOVEFILE_WRITE_THROUGH = 0x8
+	if not ctypes.windll.kernel32.MoveFileExW(unicode(source_path),unicode(destination_path),MOVEFILE_REPLACE_EXISTING|MOVEFILE_WRITE_THROUGH):
+		raise ctypes.WinError()
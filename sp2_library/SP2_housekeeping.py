@@ -44,8 +44,11 @@ def defineHKInsertStatement(hk_table):
 	return add_interval
 
 
-def HKfileToDatabase(hk_file,add_interval,parameters,last_ts,cnx,cursor):
-	
+def HKfileToDatabase(hk_file,add_interval,parameters,last_ts,cnx,cursor,sink=None):
+	"""
+	Parse a housekeeping file and insert its rows into the database.  Rows not yet inserted are returned along with the last timestamp.
+	If a sink is given (eg. a mysql_db_connection.BulkLoader) all rows from the file are written to it in one call at the end, and an empty list is returned.
+	"""
 	multiple_records = []
 	prev_UNIX_time_stamp_UTC = last_ts
 	i=1
@@ -82,11 +85,15 @@ def HKfileToDatabase(hk_file,add_interval,parameters,last_ts,cnx,cursor):
 		i+= 1
 
 		#bulk insert to db table
-		if i%1000 == 0:
+		if i%1000 == 0 and sink is None:
 			cursor.executemany(add_interval, multiple_records)
 			cnx.commit()
 			multiple_records = []
 
+	if sink is not None:
+		sink.write(multiple_records)
+		multiple_records = []
+
 	try:
 		last_ts = UNIX_time_stamp_UTC_end
 	except:
@@ -97,8 +104,78 @@ def HKfileToDatabase(hk_file,add_interval,parameters,last_ts,cnx,cursor):
 
 
 def addHKKeysToRawDataTable(parameters,cnx,cursor):
+	"""
+	Set the hk_id key of each particle in the raw data table to the housekeeping interval containing its end time (hk start <= particle end < hk end).
+	This is done with a single UPDATE ... JOIN over all of the housekeeping intervals that start within the time block, followed by a single commit.
+	"""
+	#particles can only match an interval that starts at or after UNIX_start, so the extra bound on sp.UNIX_UTC_ts_int_end lets the server use a range scan on the raw data table
+	cursor.execute(('''
+		UPDATE ''' + parameters['raw_data_table'] + ''' sp
+			JOIN ''' + parameters['hk_table'] + ''' hk 
+				ON sp.UNIX_UTC_ts_int_end >= hk.UNIX_UTC_ts_int_start
+				AND sp.UNIX_UTC_ts_int_end < hk.UNIX_UTC_ts_int_end
+		SET 
+			sp.hk_id = hk.id 
+		WHERE 
+			hk.UNIX_UTC_ts_int_start >= %s 
+			AND hk.UNIX_UTC_ts_int_start < %s
+			AND hk.instr_ID = %s
+			AND sp.instr_ID = %s
+			AND sp.UNIX_UTC_ts_int_end >= %s'''),
+		(parameters['UNIX_start'],parameters['UNIX_end'],parameters['instr_ID'],parameters['instr_ID'],parameters['UNIX_start']))
+	cnx.commit()
+
+	print cursor.rowcount, 'particle rows updated'
+
+
+class HKIntervalIndex(object):
+
+	"""
+
+	A sorted index of housekeeping intervals.  It is used to set the hk_id of particles as they are written by the SP2_raw_data writers 
+	(by adding it to their parameters as 'hk_index'), instead of updating the raw data table afterwards with addHKKeysToRawDataTable.
+
+	"""
+
+	def __init__(self, hk_ids, interval_starts, interval_ends):
+		"""
+		Parameters
+		----------
+		hk_ids : list
+			Housekeeping table ids
+		interval_starts : list of floats
+			UNIX_UTC_ts_int_start of each housekeeping interval
+		interval_ends : list of floats
+			UNIX_UTC_ts_int_end of each housekeeping interval
+		"""
+		interval_starts = np.asarray(interval_starts,dtype=np.float64)
+		time_order = np.argsort(interval_starts,kind='mergesort')
+
+		self.hk_ids = np.asarray(hk_ids,dtype=object)[time_order]
+		self.interval_starts = interval_starts[time_order]
+		self.interval_ends = np.asarray(interval_ends,dtype=np.float64)[time_order]
+
+
+	def getHKIDs(self, timestamps):
+		"""
+		Get the hk_id of the interval containing each timestamp (hk start <= timestamp < hk end), or None if there is no such interval.
+		This is the same matching as addHKKeysToRawDataTable.
+		"""
+		if len(self.hk_ids) == 0:
+			return [None]*len(timestamps)
 
-	#select hk data from the hk table for a given time block
+		interval_index = SP2_utilities.findIntervals(self.interval_starts,self.interval_ends,timestamps)
+		hk_ids = self.hk_ids[np.where(interval_index >= 0,interval_index,0)]
+		hk_ids[interval_index < 0] = None
+
+		return hk_ids.tolist()
+
+
+def getHKIntervalIndex(parameters,cursor):
+	"""
+	Get an HKIntervalIndex of the housekeeping intervals that start within a time block.  
+	The parameters are the same as for addHKKeysToRawDataTable (hk_table, UNIX_start, UNIX_end, instr_ID).
+	"""
 	cursor.execute('''
 		SELECT 
 			id, 
@@ -108,41 +185,9 @@ def addHKKeysToRawDataTable(parameters,cnx,cursor):
 		WHERE 
 			UNIX_UTC_ts_int_start >= %s 
 			AND UNIX_UTC_ts_int_start < %s
-			AND instr_ID = %s''',
+			AND instr_ID = %s
+		ORDER BY UNIX_UTC_ts_int_start''',
 		(parameters['UNIX_start'],parameters['UNIX_end'],parameters['instr_ID']))
 	hk_data = cursor.fetchall()
 
-
-	#loop through the hk data and add keys to the raw data table
-	print len(hk_data), 'starting loop'
-	i=0
-	for data_point in hk_data:
-		id = data_point[0]
-		hk_start_time = data_point[1]
-		hk_end_time = data_point[2] 
-		
-		cursor.execute(('''
-			UPDATE ''' + parameters['raw_data_table']+ ''' 
-			SET 
-				hk_id = %s 
-			WHERE 
-				UNIX_UTC_ts_int_end >= %s 
-				AND UNIX_UTC_ts_int_end < %s
-				AND instr_ID = %s'''),
-			(id,hk_start_time,hk_end_time,parameters['instr_ID']))	
-		cnx.commit()
-		
-		i+=1
-		if (i % 5000) == 0:
-			print 'fraction done: ', round(i*1./len(hk_data),2)
-			
-	
-
-
-
-
-
-
-	
-		
-
+	return HKIntervalIndex([row[0] for row in hk_data],[row[1] for row in hk_data],[row[2] for row in hk_data])
@@ -0,0 +1,590 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+import numpy as np
+
+
+def peakInfo(waveforms,baseline_points=10):
+	"""
+	Get the baseline, baseline noise threshold, maximum value, and position of the maximum for every record and every channel at once.
+
+	Parameters
+	----------
+	waveforms : numpy array
+		Signals with shape (number of records, number of samples, number of channels), eg. the 'waveforms' field of the records returned by SP2_raw_data.decodeRecords
+	baseline_points : int
+		Number of samples at the start of each record used to determine the baseline
+
+	Returns
+	-------
+	baseline, baseline_noise_thresh, peak_max, peak_max_pos : numpy arrays with shape (number of records, number of channels).
+	The baseline is the mean of the first baseline_points samples and the noise threshold is 3 standard deviations of those samples.
+	The maximum value is given relative to the baseline.
+	"""
+	#one conversion to native byte order so the reductions below run on contiguous data
+	waveforms = np.ascontiguousarray(waveforms,dtype=np.int16)
+
+	baseline_samples = waveforms[:,0:baseline_points,:].astype(np.float64)
+	baseline = np.mean(baseline_samples,axis=1)
+	baseline_noise_thresh = 3*np.std(baseline_samples,axis=1)
+
+	peak_max_pos = np.argmax(waveforms,axis=1)
+	raw_max = waveforms[np.arange(waveforms.shape[0])[:,np.newaxis],peak_max_pos,np.arange(waveforms.shape[2])]
+	peak_max = raw_max - baseline
+
+	return baseline, baseline_noise_thresh, peak_max, peak_max_pos
+
+
+def zeroCrossing(split_data,evap_threshold):
+	"""
+	Get the scattering split detector zero-crossing of many particles at once (see ParticleRecord.zeroCrossing).
+	For each record the order of the split detector maximum and minimum gives the slope at the zero-crossing, the first sample between them on the far side of the baseline is found, 
+	and the zero-crossing is interpolated from it and the preceding sample in the same way as ParticleRecord.zeroCrossingPosSlope and ParticleRecord.zeroCrossingNegSlope.
+
+	Parameters
+	----------
+	split_data : numpy array
+		Split detector signals with shape (number of records, number of samples)
+	evap_threshold : float
+		Minumum difference between split detector baseline and peak values.  
+		If the peak values are lower than this threshold the particle likely evaporated before reaching the split detector gap.
+
+	Returns
+	-------
+	split_baseline, zero_crossing : numpy arrays with one value per record.  
+	The zero-crossings have the same sentinel values as the ParticleRecord methods: -2 if the peaks are below evap_threshold, and -1 if there is no crossing between the maximum and minimum.
+	-3 is given when there is no sample before the maximum (or minimum) to search, where ParticleRecord.zeroCrossingPosSlope raises an exception.
+	"""
+	split_data = np.asarray(split_data,dtype=np.float64)
+	number_of_records,number_of_samples = split_data.shape
+	records = np.arange(number_of_records)
+	samples = np.arange(number_of_samples)[np.newaxis,:]
+
+	split_baseline = np.mean(split_data[:,0:10],axis=1)
+	split_max_index = np.argmax(split_data,axis=1)
+	split_min_index = np.argmin(split_data,axis=1)
+	pos_slope = split_max_index >= split_min_index
+
+	#positive slope: the minimum is searched for before the maximum, negative slope: the maximum is searched for before the minimum
+	min_before_max = np.argmin(np.where(samples < split_max_index[:,np.newaxis],split_data,np.inf),axis=1)
+	max_before_min = np.argmax(np.where(samples < split_min_index[:,np.newaxis],split_data,-np.inf),axis=1)
+	split_min_index = np.where(pos_slope,min_before_max,split_min_index)
+	split_max_index = np.where(pos_slope,split_max_index,max_before_min)
+	split_min_value = split_data[records,split_min_index]
+	split_max_value = split_data[records,split_max_index]
+
+	#first sample from the first peak to the second peak (inclusive) that is on the far side of the baseline
+	search_start = np.where(pos_slope,split_min_index,split_max_index)
+	search_end = np.where(pos_slope,split_max_index,split_min_index)
+	crossed = np.where(pos_slope[:,np.newaxis],split_data >= split_baseline[:,np.newaxis],split_data <= split_baseline[:,np.newaxis])
+	crossed &= (samples >= search_start[:,np.newaxis]) & (samples <= search_end[:,np.newaxis])
+	index = np.argmax(crossed,axis=1)
+	found = np.any(crossed,axis=1) & (index > search_start)
+
+	#interpolate between the crossing sample and the sample before it
+	value_current = split_data[records,index]
+	value_previous = split_data[records,np.maximum(index-1,0)]
+	value_zero_cross_pos = np.where(pos_slope,value_current,value_previous)
+	value_zero_cross_neg = np.where(pos_slope,value_previous,value_current)
+	index_zero_cross_pos = np.where(pos_slope,index,index-1)
+	index_zero_cross_neg = np.where(pos_slope,index-1,index)
+
+	zero_crossing = np.full(number_of_records,-1.)
+	zero_crossing[found] = index[found]+((value_zero_cross_pos[found]-split_baseline[found])*(index_zero_cross_pos[found]-index_zero_cross_neg[found]))/(value_zero_cross_pos[found]-value_zero_cross_neg[found])
+
+	#avoid particles evaporating before the notch position can be properly determined (details in Taylor et al. 10.5194/amtd-7-5491-2014)
+	evaporated = ~(((split_baseline-split_min_value) >= evap_threshold) & ((split_max_value-split_baseline) >= evap_threshold))
+	zero_crossing[evaporated] = -2
+	zero_crossing[pos_slope & (search_end == 0)] = -3
+
+	return split_baseline, zero_crossing
+
+
+def _roundHalfAwayFromZero(values):
+	"""
+	round to the nearest integer with halves rounded away from zero, as the built-in round function does in Python 2
+	"""
+	truncated = np.trunc(values)
+	return truncated + np.sign(values)*(np.abs(values-truncated) >= 0.5)
+
+
+def leoGaussFit(scat_data,zero_crossings,zeroX_to_LEO_limit,calib_zeroX_to_peak,calib_gauss_width):
+	"""
+	Fit a Gaussian function to the leading edge of the high gain scattering signal of many particles at once (see ParticleRecord.leoGaussFit).
+	The center and width of the Gaussian are fixed, so the amplitude and baseline are the solution of a linear least squares problem.  
+	The 2x2 normal equations of every particle are built and solved together, with the points past each particle's leading edge limit masked out.
+
+	Parameters
+	----------
+	scat_data : numpy array
+		High gain scattering signals with shape (number of records, number of samples)
+	zero_crossings : numpy array
+		Split detector zero-crossing of each record (see ParticleRecord.zeroCrossing), negative values mean no zero-crossing was found
+	zeroX_to_LEO_limit : float 
+		Distance from the split detector zero-crossing at which the laser intensity reaches the leading edge maximum
+	calib_zeroX_to_peak : float
+		Distance from the split detector zero-crossing to the peak laser intensity
+	calib_gauss_width : float
+		Gauss width of the laser beam
+
+	Returns
+	-------
+	LF_scattering_amp, LF_baseline, LF_max_index, beam_center_pos : numpy arrays with one value per record, with the same values as ParticleRecord.leoGaussFit.
+	Records without a zero-crossing get -2 for the amplitude, baseline and beam center and NaN for LF_max_index.  
+	Records with fewer than two points on the leading edge can't be fit and get -1 for the amplitude and baseline.
+	"""
+	scat_data = np.asarray(scat_data,dtype=np.float64)
+	zero_crossings = np.asarray(zero_crossings,dtype=np.float64)
+	number_of_records,number_of_samples = scat_data.shape
+
+	LF_scattering_amp = np.full(number_of_records,-2.)
+	LF_baseline = np.full(number_of_records,-2.)
+	LF_max_index = np.full(number_of_records,np.nan)
+	beam_center_pos = np.full(number_of_records,-2.)
+
+	has_zero_crossing = zero_crossings >= 0
+	LF_max_index[has_zero_crossing] = _roundHalfAwayFromZero(zero_crossings[has_zero_crossing]-zeroX_to_LEO_limit)
+	beam_center_pos[has_zero_crossing] = zero_crossings[has_zero_crossing]-calib_zeroX_to_peak
+
+	#the leading edge is x_vals[0:LF_max_index], with Python's slicing rules for negative or large indexes
+	slice_end = LF_max_index[has_zero_crossing]
+	slice_end = np.where(slice_end < 0,np.maximum(slice_end+number_of_samples,0),np.minimum(slice_end,number_of_samples))
+	x_vals = np.arange(number_of_samples,dtype=np.float64)
+	on_leading_edge = x_vals[np.newaxis,:] < slice_end[:,np.newaxis]
+
+	#fixed Gaussian shape for each record, the model is y = b + a*gauss
+	gauss = np.exp((-(x_vals[np.newaxis,:]-beam_center_pos[has_zero_crossing][:,np.newaxis])**2)/(2*calib_gauss_width**2))
+	gauss = np.where(on_leading_edge,gauss,0.)
+	y_vals = np.where(on_leading_edge,scat_data[has_zero_crossing],0.)
+
+	#normal equations [[sum(g*g), sum(g)], [sum(g), n]] [a, b] = [sum(g*y), sum(y)]
+	sum_gg = np.sum(gauss*gauss,axis=1)
+	sum_g = np.sum(gauss,axis=1)
+	sum_1 = np.sum(on_leading_edge,axis=1).astype(np.float64)
+	sum_gy = np.sum(gauss*y_vals,axis=1)
+	sum_y = np.sum(y_vals,axis=1)
+	determinant = sum_gg*sum_1-sum_g*sum_g
+
+	with np.errstate(divide='ignore',invalid='ignore'):
+		amp = (sum_1*sum_gy-sum_g*sum_y)/determinant
+		#if the Gaussian is flat over the leading edge the amplitude can't be determined, curve_fit leaves it at its initial value of 1
+		singular = ~(np.abs(determinant) > 1e-12*sum_gg*sum_1)
+		amp[singular] = 1.
+		baseline = (sum_y-amp*sum_g)/sum_1
+
+	#curve_fit needs at least as many points as parameters
+	too_few_points = sum_1 < 2
+	amp[too_few_points] = -1.
+	baseline[too_few_points] = -1.
+
+	LF_scattering_amp[has_zero_crossing] = amp
+	LF_baseline[has_zero_crossing] = baseline
+
+	return LF_scattering_amp, LF_baseline, LF_max_index, beam_center_pos
+
+
+def leoGaussCurves(LF_scattering_amp,LF_baseline,beam_center_pos,calib_gauss_width,number_of_samples):
+	"""
+	Evaluate the leading edge Gaussian fits over the whole record (the LF_results of ParticleRecord.leoGaussFit) for many records at once.
+	Returns an array with shape (number of records, number of samples).  The rows for records without a zero-crossing have no meaning (ParticleRecord.leoGaussFit leaves LF_results empty for these).
+	"""
+	LF_scattering_amp = np.asarray(LF_scattering_amp,dtype=np.float64)
+	x_vals = np.arange(number_of_samples,dtype=np.float64)
+	gauss = np.exp((-(x_vals[np.newaxis,:]-np.asarray(beam_center_pos,dtype=np.float64)[:,np.newaxis])**2)/(2*calib_gauss_width**2))
+
+	return np.asarray(LF_baseline,dtype=np.float64)[:,np.newaxis]+LF_scattering_amp[:,np.newaxis]*gauss
+
+
+def gaussGuess(signals,baseline,peak_max,peak_max_pos,default_width=10.):
+	"""
+	Get initial values for a Gaussian fit (amplitude, center and width) from a three point log-parabola around the maximum of each signal.
+	The logarithm of a Gaussian is a parabola, so the parabola through the logarithms of the baseline-subtracted maximum and its two neighbours gives the Gaussian in closed form.
+	Signals where this isn't possible (the maximum is at an end of the record, or a neighbour is at or below the baseline) get the maximum, its position and default_width.
+
+	Parameters
+	----------
+	signals : numpy array
+		Signals with shape (number of records, number of samples)
+	baseline : numpy array
+		Baseline of each signal
+	peak_max : numpy array
+		Maximum value of each signal, relative to the baseline
+	peak_max_pos : numpy array
+		Position of the maximum of each signal
+	default_width : float
+		Width used when the log-parabola can't be calculated
+
+	Returns
+	-------
+	guess_a, guess_u, guess_sig : numpy arrays with one value per record
+	"""
+	signals = np.asarray(signals,dtype=np.float64)
+	baseline = np.asarray(baseline,dtype=np.float64)
+	number_of_records,number_of_samples = signals.shape
+	records = np.arange(number_of_records)
+
+	guess_a = np.asarray(peak_max,dtype=np.float64).copy()
+	guess_u = np.asarray(peak_max_pos,dtype=np.float64).copy()
+	guess_sig = np.full(number_of_records,float(default_width))
+
+	center = np.clip(peak_max_pos,1,number_of_samples-2)
+	y_prev = signals[records,center-1]-baseline
+	y_max = signals[records,center]-baseline
+	y_next = signals[records,center+1]-baseline
+
+	with np.errstate(divide='ignore',invalid='ignore'):
+		log_prev = np.log(y_prev)
+		log_max = np.log(y_max)
+		log_next = np.log(y_next)
+		curvature = log_prev-2*log_max+log_next
+		offset = 0.5*(log_prev-log_next)/curvature
+		parabola_a = np.exp(log_max-0.25*(log_prev-log_next)*offset)
+		parabola_u = center+offset
+		parabola_sig = np.sqrt(-1./curvature)
+
+	use_parabola = (peak_max_pos == center) & (y_prev > 0) & (y_max > 0) & (y_next > 0) & (curvature < 0) & np.isfinite(parabola_a) & np.isfinite(parabola_sig)
+	guess_a[use_parabola] = parabola_a[use_parabola]
+	guess_u[use_parabola] = parabola_u[use_parabola]
+	guess_sig[use_parabola] = parabola_sig[use_parabola]
+
+	return guess_a, guess_u, guess_sig
+
+
+def gaussJacobian(x_vals,a,u,sig):
+	"""
+	Get the partial derivatives of the Gaussian baseline+a*exp(-(x-u)**2/(2*sig**2)) with respect to a, u and sig, as an array with shape x_vals.shape+(3,)
+	"""
+	gauss = np.exp((-(x_vals-u)**2)/(2*sig**2))
+	return np.stack([gauss,a*gauss*(x_vals-u)/sig**2,a*gauss*(x_vals-u)**2/sig**3],axis=-1)
+
+
+def _solve3x3(matrices,vectors):
+	"""
+	solve many 3x3 linear systems at once with the adjugate matrix, singular systems give non-finite solutions instead of raising an exception
+	"""
+	cofactors_0 = np.cross(matrices[:,1],matrices[:,2])
+	cofactors_1 = np.cross(matrices[:,2],matrices[:,0])
+	cofactors_2 = np.cross(matrices[:,0],matrices[:,1])
+	determinant = np.sum(matrices[:,0]*cofactors_0,axis=1)
+
+	with np.errstate(divide='ignore',invalid='ignore'):
+		return (cofactors_0*vectors[:,0:1]+cofactors_1*vectors[:,1:2]+cofactors_2*vectors[:,2:3])/determinant[:,np.newaxis]
+
+
+def fullGaussFit(scat_data,baseline,guess_a,guess_u,guess_sig,max_iterations=100,ftol=1.49012e-08,xtol=1.49012e-08):
+	"""
+	Fit a Gaussian function with a fixed baseline to the full high gain scattering signal of many particles at once (see ParticleRecord.fullGaussFit).
+	This is a Levenberg-Marquardt fit with the analytic Jacobian, where the 3x3 damped normal equations of all particles are solved together at each iteration.  
+	Each particle's damping is updated from the ratio of the actual to the predicted reduction in the sum of squares (Nielsen's method), and its convergence is checked separately.  
+	ftol and xtol have the same meaning as for scipy.optimize.leastsq.
+
+	Parameters
+	----------
+	scat_data : numpy array
+		High gain scattering signals with shape (number of records, number of samples)
+	baseline : numpy array
+		Scattering baseline of each record
+	guess_a, guess_u, guess_sig : numpy arrays
+		Initial amplitude, center and width of each record (eg. from gaussGuess)
+	max_iterations : int
+		Fits that have not converged after this many iterations are treated as failed
+
+	Returns
+	-------
+	FF_scattering_amp, FF_peak_pos, FF_width : numpy arrays with one value per record, these are NaN where the fit failed
+	"""
+	y_vals = np.asarray(scat_data,dtype=np.float64)-np.asarray(baseline,dtype=np.float64)[:,np.newaxis]
+	x_vals = np.arange(y_vals.shape[1],dtype=np.float64)
+	params = np.column_stack([guess_a,guess_u,guess_sig]).astype(np.float64)
+	number_of_records = len(params)
+	diagonal_index = [0,1,2],[0,1,2]
+
+	def residuals(y_vals,params):
+		with np.errstate(over='ignore',divide='ignore',invalid='ignore'):
+			return y_vals-params[:,0:1]*np.exp((-(x_vals-params[:,1:2])**2)/(2*params[:,2:3]**2))
+
+	damping = np.full(number_of_records,1e-3)
+	damping_increase = np.full(number_of_records,2.)
+	diagonal_scale = np.zeros((number_of_records,3))
+	converged = np.zeros(number_of_records,dtype=bool)
+	active = np.flatnonzero(np.all(np.isfinite(params),axis=1))
+	residual = residuals(y_vals[active],params[active])
+	sum_of_squares = np.sum(residual**2,axis=1)
+
+	for iteration in range(max_iterations):
+		if len(active) == 0:
+			break
+
+		with np.errstate(over='ignore',divide='ignore',invalid='ignore'):
+			jacobian = gaussJacobian(x_vals,params[active,0:1],params[active,1:2],params[active,2:3])
+			normal_matrices = np.einsum('nki,nkj->nij',jacobian,jacobian)
+			gradients = np.einsum('nki,nk->ni',jacobian,residual)
+			#the damping is scaled by the largest diagonal seen so far (as MINPACK does), so poorly determined parameters can't jump far
+			diagonal_scale[active] = np.fmax(diagonal_scale[active],normal_matrices[:,diagonal_index[0],diagonal_index[1]])
+			scaled_damping = damping[active,np.newaxis]*diagonal_scale[active]
+			normal_matrices[:,diagonal_index[0],diagonal_index[1]] += scaled_damping
+			steps = _solve3x3(normal_matrices,gradients)
+
+			trial_params = params[active]+steps
+			trial_residual = residuals(y_vals[active],trial_params)
+			trial_sum_of_squares = np.sum(trial_residual**2,axis=1)
+
+			#reduction in the sum of squares predicted by the linearized model
+			actual_reduction = sum_of_squares-trial_sum_of_squares
+			predicted_reduction = np.sum(steps*(gradients+scaled_damping*steps),axis=1)
+			gain_ratio = actual_reduction/predicted_reduction
+			improved = gain_ratio > 0
+
+			small_change = (np.abs(actual_reduction) <= ftol*sum_of_squares) & (predicted_reduction <= ftol*sum_of_squares) & (gain_ratio <= 2)
+			small_change |= improved & np.all(np.abs(steps) <= xtol*(np.abs(params[active])+xtol),axis=1)
+			small_change |= sum_of_squares == 0
+		converged[active[small_change]] = True
+
+		#accept the steps that reduce the sum of squares and move towards Gauss-Newton, otherwise move towards gradient descent
+		params[active[improved]] = trial_params[improved]
+		sum_of_squares[improved] = trial_sum_of_squares[improved]
+		residual[improved] = trial_residual[improved]
+		damping[active[improved]] *= np.maximum(1/3.,1-(2*gain_ratio[improved]-1)**3)
+		damping_increase[active[improved]] = 2.
+		damping[active[~improved]] *= damping_increase[active[~improved]]
+		damping_increase[active[~improved]] *= 2.
+
+		still_active = ~small_change & np.isfinite(sum_of_squares) & (damping[active] < 1e16)
+		active = active[still_active]
+		sum_of_squares = sum_of_squares[still_active]
+		residual = residual[still_active]
+
+	params[~converged] = np.nan
+
+	return params[:,0], params[:,1], params[:,2]
+
+
+def fullGaussCurves(baseline,FF_scattering_amp,FF_peak_pos,FF_width,number_of_samples):
+	"""
+	Evaluate the full Gaussian fits over the whole record (the FF_results of ParticleRecord.fullGaussFit) for many records at once.
+	Returns an array with shape (number of records, number of samples).
+	"""
+	x_vals = np.arange(number_of_samples,dtype=np.float64)
+	return np.asarray(baseline,dtype=np.float64)[:,np.newaxis]+np.asarray(FF_scattering_amp,dtype=np.float64)[:,np.newaxis]*np.exp((-(x_vals-np.asarray(FF_peak_pos,dtype=np.float64)[:,np.newaxis])**2)/(2*np.asarray(FF_width,dtype=np.float64)[:,np.newaxis]**2))
+
+class ParticleBatch(object):
+
+	"""
+
+	This class represents a block of particles detected by an SP2 (Droplet Measurement Technolgies Inc).
+	It wraps the structured array returned by SP2_raw_data.decodeRecords and has methods for analyzing all of the records at once.
+	Each channel is exposed as a 2-D array of shape (number of records, number of samples).
+
+	"""
+
+
+	def __init__(self, records, acq_rate, first_file_index=0):
+
+		"""
+		Parameters
+		----------
+		records : numpy structured array
+			Decoded .sp2b records, as returned by SP2_raw_data.decodeRecords
+		acq_rate : float
+			In samples/Sec.  This is how many A/D samples are taken every second.
+			Normally set to 5,000,000 for the 6110 board or 2,500,000 for the 6133 board.
+		first_file_index : int
+			Index of the first record in its .sp2b file (records[i] is record first_file_index+i of the file)
+		"""
+
+		self.records = records
+		self.acq_rate = acq_rate
+		self.first_file_index = first_file_index
+
+		self.number_of_records = len(records)
+		self.number_of_samples, self.number_of_channels = records.dtype['waveforms'].shape
+
+		#each channel is a (number_of_records, number_of_samples) view into the records, no data is copied
+		self.scatData = self.getChannelData(0)
+		self.wideBandIncandData = self.getChannelData(1)
+		self.narrowBandIncandData = self.getChannelData(2)
+		self.splitData = self.getChannelData(3)
+		self.lowGainScatData = self.getChannelData(4)
+		self.lowGainWideBandIncandData = self.getChannelData(5)
+		self.lowGainNarrowBandIncandData = self.getChannelData(6)
+		self.lowGainSplitData = self.getChannelData(7)
+
+		self.flag = records['flag']
+		self.event_index = records['event_index']
+		self.timestamp = self.getTimestamps()
+
+		self.scatteringBaseline = None
+		self.scatteringBaselineNoiseThresh = None
+		self.scatteringMax = None
+		self.scatteringMaxPos = None
+		self.scatteringBaselineLG = None
+		self.scatteringBaselineNoiseThreshLG = None
+		self.scatteringMax_LG = None
+		self.scatteringMaxPos_LG = None
+
+		self.incandBaseline = None
+		self.incandBaseline_LG = None
+		self.incandMax = None
+		self.incandMax_LG = None
+		self.incandMaxPos = None
+		self.incandMaxPos_LG = None
+
+		self.narrowIncandBaseline = None
+		self.narrowIncandBaseline_LG = None
+		self.narrowIncandMax = None
+		self.narrowIncandMax_LG = None
+		self.narrowIncandMaxPos = None
+		self.narrowIncandMaxPos_LG = None
+
+		self.splitBaseline = None
+		self.zeroCrossingPos = None
+		self.LF_scattering_amp = None
+		self.LF_max_index = None
+		self.LF_baseline = None
+		self.beam_center_pos = None
+
+		self.FF_scattering_amp = None
+		self.FF_peak_pos = None
+		self.FF_width = None
+
+
+	def getChannelData(self, channel_index):
+		"""
+		Get the signal from one channel for every record.  Returns None if the instrument does not have this channel (eg. low gain channels on a 4-channel instrument)
+		"""
+		if channel_index >= self.number_of_channels:
+			return None
+		return self.records['waveforms'][:,:,channel_index]
+
+
+	def getTimestamps(self):
+		"""
+		Get the UNIX UTC timestamp of every record (see ParticleRecord.importFromBinary for details)
+		"""
+		labview_timestamp = self.records['time_10000'].astype(np.float64)*10000+self.records['time_remainder'].astype(np.float64)
+		return labview_timestamp+self.records['event_index'].astype(np.float64)/self.acq_rate-2082844800 #LVts_to_UNIXts = -2082844800
+
+
+	def peakInfo(self):
+		"""
+		Get the baseline, maximum value, and position of the maximum for all channels in a single pass over the records.
+		This sets the same attributes as the individual channel methods below.
+		"""
+		baseline, baseline_noise_thresh, peak_max, peak_max_pos = peakInfo(self.records['waveforms'])
+
+		self.scatteringBaseline, self.scatteringBaselineNoiseThresh, self.scatteringMax, self.scatteringMaxPos = baseline[:,0], baseline_noise_thresh[:,0], peak_max[:,0], peak_max_pos[:,0]
+		self.incandBaseline, self.incandMax, self.incandMaxPos = baseline[:,1], peak_max[:,1], peak_max_pos[:,1]
+		self.narrowIncandBaseline, self.narrowIncandMax, self.narrowIncandMaxPos = baseline[:,2], peak_max[:,2], peak_max_pos[:,2]
+
+		if self.number_of_channels == 8:
+			self.scatteringBaselineLG, self.scatteringBaselineNoiseThreshLG, self.scatteringMax_LG, self.scatteringMaxPos_LG = baseline[:,4], baseline_noise_thresh[:,4], peak_max[:,4], peak_max_pos[:,4]
+			self.incandBaseline_LG, self.incandMax_LG, self.incandMaxPos_LG = baseline[:,5], peak_max[:,5], peak_max_pos[:,5]
+			self.narrowIncandBaseline_LG, self.narrowIncandMax_LG, self.narrowIncandMaxPos_LG = baseline[:,6], peak_max[:,6], peak_max_pos[:,6]
+
+
+	def _channelPeakInfo(self, channel_data):
+		"""
+		Get the baseline, baseline noise threshold, maximum value, and position of the maximum for each record in a single channel
+		"""
+		baseline, baseline_noise_thresh, peak_max, peak_max_pos = peakInfo(channel_data[:,:,np.newaxis])
+		return baseline[:,0], baseline_noise_thresh[:,0], peak_max[:,0], peak_max_pos[:,0]
+
+
+	#Scattering methods
+
+	def scatteringPeakInfo(self):
+		"""
+		Get the high gain scattering baseline, maximum value, and position of the maximum
+		"""
+		self.scatteringBaseline, self.scatteringBaselineNoiseThresh, self.scatteringMax, self.scatteringMaxPos = self._channelPeakInfo(self.scatData)
+
+	def scatteringPeakInfoLG(self):
+		"""
+		Get the low gain scattering baseline, maximum value, and position of the maximum
+		"""
+		self.scatteringBaselineLG, self.scatteringBaselineNoiseThreshLG, self.scatteringMax_LG, self.scatteringMaxPos_LG = self._channelPeakInfo(self.lowGainScatData)
+
+
+	#Incandesence methods
+
+	def incandPeakInfo(self):
+		"""
+		Get the high gain, wide band incandescence baseline, maximum value, and position of the maximum
+		"""
+		self.incandBaseline, noise_thresh, self.incandMax, self.incandMaxPos = self._channelPeakInfo(self.wideBandIncandData)
+
+	def incandPeakInfoLG(self):
+		"""
+		Get the low gain, wide band incandescence baseline, maximum value, and position of the maximum
+		"""
+		self.incandBaseline_LG, noise_thresh, self.incandMax_LG, self.incandMaxPos_LG = self._channelPeakInfo(self.lowGainWideBandIncandData)
+
+	def narrowIncandPeakInfo(self):
+		"""
+		Get the high gain, narrow band incandescence baseline, maximum value, and position of the maximum
+		"""
+		self.narrowIncandBaseline, noise_thresh, self.narrowIncandMax, self.narrowIncandMaxPos = self._channelPeakInfo(self.narrowBandIncandData)
+
+	def narrowIncandPeakInfoLG(self):
+		"""
+		Get the low gain, narrow band incandescence baseline, maximum value, and position of the maximum
+		"""
+		self.narrowIncandBaseline_LG, noise_thresh, self.narrowIncandMax_LG, self.narrowIncandMaxPos_LG = self._channelPeakInfo(self.lowGainNarrowBandIncandData)
+
+
+	def fullGaussFit(self, max_iterations=100):
+		"""
+		Fit a Gaussian function to the full high gain scattering signal of every record (see the module function fullGaussFit and ParticleRecord.fullGaussFit).  
+		All fit parameters are free to vary, the initial values come from a log-parabola around each scattering maximum.
+		"""
+		self.scatteringPeakInfo()
+		guess_a, guess_u, guess_sig = gaussGuess(self.scatData,self.scatteringBaseline,self.scatteringMax,self.scatteringMaxPos)
+		self.FF_scattering_amp, self.FF_peak_pos, self.FF_width = fullGaussFit(self.scatData,self.scatteringBaseline,guess_a,guess_u,guess_sig,max_iterations=max_iterations)
+
+	def getFullGaussCurves(self):
+		"""
+		Get the full Gaussian fit of every record evaluated over the whole record, as an array with shape (number of records, number of samples)
+		"""
+		return fullGaussCurves(self.scatteringBaseline,self.FF_scattering_amp,self.FF_peak_pos,self.FF_width,self.number_of_samples)
+
+
+	#Leading edge only (LEO) methods
+
+	def zeroCrossing(self, evap_threshold):
+		"""
+		Get the scattering split detector zero-crossing of every record (see the module function zeroCrossing and ParticleRecord.zeroCrossing)
+
+		Parameters
+		-------------
+		evap_thershold : float
+			Minumum difference between split detector baseline and peak values.  
+			If the peak values are lower than this threshold the particle likely evaporated before reaching the split detector gap.  
+		"""
+		self.splitBaseline, self.zeroCrossingPos = zeroCrossing(self.splitData,evap_threshold)
+		return self.zeroCrossingPos
+
+	def leoGaussFit(self, zeroX_to_LEO_limit, calib_zeroX_to_peak, calib_gauss_width, zero_crossings=None):
+		"""
+		Fit a Gaussian function to the leading edge of the high gain scattering signal of every record (see the module function leoGaussFit and ParticleRecord.leoGaussFit).
+		Only the amplitude and baseline are allowed to vary.
+
+		Parameters
+		----------
+		zeroX_to_LEO_limit : float 
+			Distance from the split detector zero-crossing at which the laser intensity reaches the leading edge maximum (typically 3-5% of peak intensity).
+		calib_zeroX_to_peak : float
+			Distance from the split detector zero-crossing to the peak laser intensity.
+		calib_gauss_width : float
+			Gauss width of the laser beam.
+		zero_crossings : numpy array
+			Split detector zero-crossing of each record, negative values mean no zero-crossing was found.  If None, the zero-crossings from the zeroCrossing method are used.
+		"""
+		if zero_crossings is None:
+			zero_crossings = self.zeroCrossingPos
+		self.zeroCrossingPos = zero_crossings
+		self.LF_scattering_amp, self.LF_baseline, self.LF_max_index, self.beam_center_pos = leoGaussFit(self.scatData,zero_crossings,zeroX_to_LEO_limit,calib_zeroX_to_peak,calib_gauss_width)
+
+	def getLeoGaussCurves(self, calib_gauss_width):
+		"""
+		Get the leading edge Gaussian fit of every record evaluated over the whole record, as an array with shape (number of records, number of samples)
+		"""
+		return leoGaussCurves(self.LF_scattering_amp,self.LF_baseline,self.beam_center_pos,calib_gauss_width,self.number_of_samples)
@@ -4,35 +4,41 @@ import numpy as np
 from struct import *
 import sys
 from scipy.optimize import curve_fit
+from SP2_particle_batch import gaussGuess, gaussJacobian
 import scipy.special
 import math
 
-class ParticleRecord(object):
 
+def _channelProperty(channel_index, description):
+	"""
+	make a property for the signal from one channel.  The signal is a big-endian int16 view into the raw record, which is only created the first time the channel is used.
+	Instruments with 4 channels get an empty array for the low gain channels.
 	"""
+	def getChannelData(self):
+		if self._channel_data[channel_index] is None:
+			if channel_index < self._waveforms.shape[1]:
+				self._channel_data[channel_index] = self._waveforms[:,channel_index]
+			else:
+				self._channel_data[channel_index] = np.array([],dtype='>i2')
+		return self._channel_data[channel_index]
 
-	This class represents a single particle detected by an SP2 (Droplet Measurement Technolgies Inc).
-	It has methods for importing and anlyzing the raw binary data collected for a single particle.
+	def setChannelData(self, channel_data):
+		self._channel_data[channel_index] = channel_data
+
+	return property(getChannelData,setChannelData,doc=description)
+
+
+class ParticleAnalysisResults(object):
 
 	"""
 
+	This class holds the peak information and fit results of a ParticleRecord.  
+	It is only created when one of these values is first used, so records that are never analyzed don't carry them.
 
-	def __init__(self, record, acq_rate):
+	"""
 
+	def __init__(self):
 
-		self.timestamp = np.nan
-		
-		self.acqPoints = []
-		self.scatData = []
-		self.wideBandIncandData = []
-		self.narrowBandIncandData = []
-		self.splitData = []
-		self.lowGainScatData = []
-		self.lowGainWideBandIncandData = []
-		self.lowGainNarrowBandIncandData = []
-		self.lowGainSplitData = []
-		
-		self.flag = np.nan
 		self.scatteringIsSat = False
 		self.scatteringSatFlag = False
 		self.scatteringBaseline = np.nan
@@ -73,15 +79,91 @@ class ParticleRecord(object):
 		self.beam_center_pos = np.nan
 		self.LF_x_vals_to_use = []
 		self.LF_y_vals_to_use = []
+
+
+class ParticleRecord(object):
+
+	"""
+
+	This class represents a single particle detected by an SP2 (Droplet Measurement Technolgies Inc).
+	It has methods for importing and anlyzing the raw binary data collected for a single particle.
+	The raw record is kept, and the signal from each channel is only decoded when it is first used, so records that are rejected after looking at one channel are cheap.
+	To keep records small, the peak information and fit results (eg. scatteringMax or LF_scattering_amp) are attributes of a ParticleAnalysisResults that is created when they are first used, 
+	they are read and set as attributes of the record as before.
+
+	"""
+
+	__slots__ = ('timestamp','flag','_waveforms','_channel_data','_analysis_results')
+
+	scatData = _channelProperty(0,'High gain scattering signal')
+	wideBandIncandData = _channelProperty(1,'High gain, wide band incandescence signal')
+	narrowBandIncandData = _channelProperty(2,'High gain, narrow band incandescence signal')
+	splitData = _channelProperty(3,'High gain split detector signal')
+	lowGainScatData = _channelProperty(4,'Low gain scattering signal')
+	lowGainWideBandIncandData = _channelProperty(5,'Low gain, wide band incandescence signal')
+	lowGainNarrowBandIncandData = _channelProperty(6,'Low gain, narrow band incandescence signal')
+	lowGainSplitData = _channelProperty(7,'Low gain split detector signal')
+
+
+	def __init__(self, record, acq_rate):
+
+
+		self.timestamp = np.nan
+		self.flag = np.nan
+		
+		self._waveforms = np.zeros((0,0),dtype='>i2')
+		self._channel_data = [None]*8
+		self._analysis_results = None
 		
 		self.importFromBinary(record, acq_rate)
 		
 	
+	def __getattr__(self, name):
+		#only called for names that aren't slots or properties, ie. the analysis results
+		if name.startswith('_'):
+			raise AttributeError(name)
+		return getattr(self.getAnalysisResults(),name)
+
+
+	def __setattr__(self, name, value):
+		if hasattr(type(self),name):
+			object.__setattr__(self,name,value)
+		elif name.startswith('_'):
+			#as for __getattr__, private names are never analysis results
+			raise AttributeError("'ParticleRecord' object has no attribute '" + name + "'")
+		else:
+			setattr(self.getAnalysisResults(),name,value)
+
+
+	def __getstate__(self):
+		#classes with __slots__ need this to be pickled with protocols 0 and 1.  The raw signals are saved as bytes, along with any channel data that was set to something other than the raw signal
+		set_channel_data = [channel_data if (channel_data is not None and not np.may_share_memory(channel_data,self._waveforms)) else None for channel_data in self._channel_data]
+		return (self.timestamp,self.flag,self._waveforms.tobytes(),self._waveforms.shape,set_channel_data,self._analysis_results)
+
+
+	def __setstate__(self, state):
+		timestamp,flag,waveform_bytes,waveform_shape,set_channel_data,analysis_results = state
+		self.timestamp = timestamp
+		self.flag = flag
+		self._waveforms = np.frombuffer(waveform_bytes,dtype='>i2').reshape(waveform_shape)
+		self._channel_data = list(set_channel_data)
+		self._analysis_results = analysis_results
+
+
+	def getAnalysisResults(self):
+		"""
+		Get the ParticleAnalysisResults for this record, creating it if no results have been set yet
+		"""
+		if self._analysis_results is None:
+			self._analysis_results = ParticleAnalysisResults()
+		return self._analysis_results
+
+	
 	def importFromBinary(self, record, acq_rate):
 
 		"""
-		Import a binary record and create an array for the signal from each channel.  
-		Set each array as a property and set the record timestamp property.
+		Import a binary record and set the record timestamp property.  
+		The signals are kept as a (number of samples, number of channels) big-endian int16 view into the record, and each channel property is a column of it.
 
 		Parameters
 		----------
@@ -105,25 +187,10 @@ class ParticleRecord(object):
 		start_byte += 4
 		
 		
-		#loop through the data, unpack it, and dump it into particle_data array
-		for row_index in range(data_length[0]):
-			new_line = [row_index]
-			for col_index in range(channels[0]):
-				value = unpack('>h',record[start_byte:start_byte+2])	
-				new_line.append(value[0])
-				start_byte += 2
-			
-			self.acqPoints.append(new_line[0])
-			self.scatData.append(new_line[1])
-			self.wideBandIncandData.append(new_line[2])
-			self.narrowBandIncandData.append(new_line[3])
-			self.splitData.append(new_line[4])	
-
-			if channels[0] == 8:
-				self.lowGainScatData.append(new_line[5])
-				self.lowGainWideBandIncandData.append(new_line[6])
-				self.lowGainNarrowBandIncandData.append(new_line[7])
-				self.lowGainSplitData.append(new_line[8])
+		#the data are interleaved by channel, view them as one row per sample without copying or decoding anything
+		self._waveforms = np.frombuffer(record,dtype='>i2',count=data_length[0]*channels[0],offset=start_byte).reshape(data_length[0],channels[0])
+		self._channel_data = [None]*8
+		start_byte += data_length[0]*channels[0]*2
 		
 		
 		#get the flag data (gives saturation and trigger info)
@@ -183,6 +250,14 @@ class ParticleRecord(object):
 		#self.flag = flag[0]
 
 
+	@property
+	def acqPoints(self):
+		"""
+		Acquisition points (sample numbers) of the record
+		"""
+		return np.arange(self._waveforms.shape[0])
+
+
 	def getAcqPoints(self):
 		"""
 		Get the acquistion points (these are the time dimension).  This method is here for legacy purposes.
@@ -199,11 +274,11 @@ class ParticleRecord(object):
 		index_of_maximum = np.argmax(self.scatData)  #get the peak position
 		run = 55. #define the run to use
 		
-		left_rise = self.scatData[index_of_maximum]-self.scatData[index_of_maximum-int(run)] #get the rise from posn 10 to the peak
+		left_rise = int(self.scatData[index_of_maximum])-int(self.scatData[index_of_maximum-int(run)]) #get the rise from posn 10 to the peak (as Python ints, int16 differences can overflow)
 		left_slope = left_rise/run
 		
 		try:
-			right_rise = self.scatData[index_of_maximum]-self.scatData[index_of_maximum+int(run)] #get the rise from a point the same distance away from teh peak as position 10, but on the other side
+			right_rise = int(self.scatData[index_of_maximum])-int(self.scatData[index_of_maximum+int(run)]) #get the rise from a point the same distance away from teh peak as position 10, but on the other side
 			right_slope = right_rise/run
 		except:
 			return
@@ -465,10 +540,16 @@ class ParticleRecord(object):
 		
 
 		
-	def fullGaussFit(self):
+	def fullGaussFit(self, fast=False):
 		"""
 		Fit a Gaussian function to the full high gain scattering signal.  
 		All fit parameters are free to vary
+
+		Parameters
+		-------------
+		fast : bool
+			If True, the initial values come from a three point log-parabola around the scattering maximum (see SP2_particle_batch.gaussGuess) instead of a fixed width of 10, 
+			and the fit uses the analytic Jacobian instead of numerical derivatives.  To fit many particles at once see SP2_particle_batch.ParticleBatch.fullGaussFit.
 		"""
 
 		#run the scatteringPeakInfo method to retrieve various peak attributes 
@@ -484,6 +565,9 @@ class ParticleRecord(object):
 		guess_u = self.scatteringMaxPos
 		guess_sig = 10
 		p_guess = [guess_a,guess_u,guess_sig]
+		if fast:
+			guess_a, guess_u, guess_sig = gaussGuess([y_vals],[baseline],[self.scatteringMax],[self.scatteringMaxPos])
+			p_guess = [guess_a[0],guess_u[0],guess_sig[0]]
 		
 		def fullGauss(x, a, u, sig):
 			return baseline+a*np.exp((-(x-u)**2)/(2*sig**2))  #Gaussian
@@ -491,17 +575,17 @@ class ParticleRecord(object):
 			
 		#run the fitting
 		try:
-			popt, pcov = curve_fit(fullGauss, x_vals, y_vals, p0=p_guess)
+			if fast:
+				popt, pcov = curve_fit(fullGauss, x_vals, y_vals, p0=p_guess, jac=gaussJacobian)
+			else:
+				popt, pcov = curve_fit(fullGauss, x_vals, y_vals, p0=p_guess)
 		except:
 			popt, pcov = [np.nan, np.nan, np.nan], [np.nan, np.nan, np.nan]   
 		
 		self.FF_scattering_amp = popt[0]
 		self.FF_peak_pos = popt[1]   
 		self.FF_width = popt[2]
-		fit_result = []
-		for x in x_vals:
-			fit_result.append(fullGauss(x,popt[0],popt[1],popt[2]))
-		self.FF_results = fit_result
+		self.FF_results = list(fullGauss(np.asarray(x_vals),popt[0],popt[1],popt[2]))
 
 		
 	def leoGaussFit(self,zeroX_to_LEO_limit,calib_zeroX_to_peak,calib_gauss_width,evap_threshold):
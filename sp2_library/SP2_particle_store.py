@@ -0,0 +1,311 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+import os
+import glob
+import math
+import numpy as np
+from datetime import datetime
+
+#the columnar file formats are optional, at least one of h5py or pyarrow is needed to use a ParticleStore
+try:
+	import h5py
+except ImportError:
+	h5py = None
+
+try:
+	import pyarrow
+	import pyarrow.parquet
+except ImportError:
+	pyarrow = None
+
+"""
+This module contains a columnar file store for single particle data, as an alternative to the MySQL single particle tables
+"""
+
+
+#the stored type of each column is fixed, so it does not depend on the values in a given write.
+#Columns not listed here are stored as strings if they hold strings, otherwise as float64, so nullable numeric columns (eg. hk_id, mob_dia) can hold NaNs
+COLUMN_DTYPES = {
+	'instr_ID':np.int64,
+	'instr_location_ID':np.int64,
+	'file_index':np.int64,
+	'sp2b_file':object,
+	}
+
+
+def _recordsToColumns(multiple_records):
+	"""
+	convert a list of particle records (dictionaries) to a dictionary of column arrays, using the column types in COLUMN_DTYPES.  None values in numeric columns become NaNs.
+	"""
+	columns = {}
+	for column in multiple_records[0]:
+		values = [single_record[column] for single_record in multiple_records]
+		dtype = COLUMN_DTYPES.get(column)
+		if dtype is None:
+			if any(isinstance(value,basestring) for value in values):
+				dtype = object
+			else:
+				dtype = np.float64
+		if dtype == np.int64 and None in values:
+			raise ValueError('the ' + column + ' column can not hold null values')
+		columns[column] = np.array(values,dtype=dtype)
+
+	return columns
+
+
+def _arrowColumnToArray(arrow_column):
+	"""
+	convert a pyarrow column to a numpy array (older pyarrow versions can only convert the individual chunks)
+	"""
+	if hasattr(arrow_column,'to_numpy'):
+		return arrow_column.to_numpy()
+	chunks = [chunk.to_numpy(zero_copy_only=False) for chunk in arrow_column.chunks]
+	if chunks == []:
+		return np.array([],dtype=arrow_column.type.to_pandas_dtype())
+	return np.concatenate(chunks)
+
+
+class ParticleStore(object):
+
+	"""
+
+	This class represents a columnar store of single particle data on disk, written as either HDF5 (with h5py) or Parquet (with pyarrow) files.
+	Particles are partitioned by instrument and by the UTC day of UNIX_UTC_ts_int_end, and each partition holds one array per column.
+	A ParticleStore can be passed as the sink of the SP2_raw_data particle writers, and read by TimeInterval.retrieveSingleParticleData.
+
+	"""
+
+	def __init__(self, store_path, table_name, file_format=None):
+
+		"""
+		Parameters
+		----------
+		store_path : string
+			Root directory of the store
+		table_name : string
+			Name of the particle table (eg. the name of the database table this replaces).  Each table is a subdirectory of the store.
+		file_format : string
+			'hdf5' or 'parquet'.  If None, parquet is used if pyarrow is available, otherwise hdf5.
+		"""
+
+		if file_format is None:
+			if pyarrow is not None:
+				file_format = 'parquet'
+			else:
+				file_format = 'hdf5'
+
+		if file_format == 'hdf5' and h5py is None:
+			raise ImportError('h5py is needed for hdf5 particle stores')
+		if file_format == 'parquet' and pyarrow is None:
+			raise ImportError('pyarrow is needed for parquet particle stores')
+		if file_format not in ['hdf5','parquet']:
+			raise ValueError('unknown file format: ' + str(file_format))
+
+		self.store_path = store_path
+		self.table_name = table_name
+		self.file_format = file_format
+		self.table_path = os.path.join(store_path,table_name)
+
+
+	def _getPartitionPath(self, instr_ID, day):
+		"""
+		Get the path of the partition for an instrument and a day (in days since the UNIX epoch).
+		HDF5 partitions are single files, Parquet partitions are directories holding one file per write.
+		"""
+		date = datetime.utcfromtimestamp(day*86400).strftime('%Y-%m-%d')
+		partition_path = os.path.join(self.table_path,'instr_ID=' + str(instr_ID),'date=' + date)
+		if self.file_format == 'hdf5':
+			partition_path += '.h5'
+
+		return partition_path
+
+
+	def write(self, multiple_records):
+		"""
+		Write a list of particle records to the store.  The records are dictionaries with the same keys as those written to the database by SP2_raw_data.
+
+		Parameters
+		----------
+		multiple_records : list of dictionaries
+			Particle records, these must have at least the instr_ID and UNIX_UTC_ts_int_end keys
+		"""
+		if multiple_records == []:
+			return
+
+		columns = _recordsToColumns(multiple_records)
+		instr_IDs = columns['instr_ID']
+		days = np.floor(columns['UNIX_UTC_ts_int_end']/86400.)
+
+		for instr_ID in np.unique(instr_IDs):
+			for day in np.unique(days[instr_IDs == instr_ID]):
+				in_partition = (instr_IDs == instr_ID) & (days == day)
+				partition_columns = {}
+				for column in columns:
+					partition_columns[column] = columns[column][in_partition]
+
+				partition_path = self._getPartitionPath(instr_ID,int(day))
+				if not os.path.isdir(os.path.dirname(partition_path)):
+					os.makedirs(os.path.dirname(partition_path))
+
+				if self.file_format == 'hdf5':
+					self._writeHDF5Partition(partition_path,partition_columns)
+				else:
+					self._writeParquetPartition(partition_path,partition_columns)
+
+
+	def _writeHDF5Partition(self, partition_path, partition_columns):
+		"""
+		append columns to an HDF5 partition, each column is a resizable dataset
+		"""
+		with h5py.File(partition_path,'a') as h5_file:
+			if len(h5_file.keys()) > 0 and set(h5_file.keys()) != set(partition_columns.keys()):
+				raise ValueError('columns written to ' + partition_path + ' do not match the columns already stored')
+
+			for column in partition_columns:
+				values = partition_columns[column]
+				if column not in h5_file:
+					if values.dtype == object:
+						h5_file.create_dataset(column,data=values,dtype=h5py.special_dtype(vlen=str),maxshape=(None,),chunks=True)
+					else:
+						h5_file.create_dataset(column,data=values,maxshape=(None,),chunks=True)
+				else:
+					dataset = h5_file[column]
+					if values.dtype != object and not np.can_cast(values.dtype,dataset.dtype,casting='safe'):
+						raise ValueError('the ' + column + ' values (' + str(values.dtype) + ') can not be stored in ' + partition_path + ' (' + str(dataset.dtype) + ') without losing data')
+					number_stored = dataset.shape[0]
+					dataset.resize((number_stored+len(values),))
+					dataset[number_stored:] = values
+
+
+	def _writeParquetPartition(self, partition_path, partition_columns):
+		"""
+		write columns to a new file in a Parquet partition
+		"""
+		if not os.path.isdir(partition_path):
+			os.makedirs(partition_path)
+
+		part_number = len(glob.glob(os.path.join(partition_path,'part-*.parquet')))
+		column_names = sorted(partition_columns.keys())
+		table = pyarrow.Table.from_arrays([pyarrow.array(partition_columns[column]) for column in column_names],column_names)
+		pyarrow.parquet.write_table(table,os.path.join(partition_path,'part-%05d.parquet' % part_number))
+
+
+	def read(self, instr_ID, UNIX_start, UNIX_end, columns=None):
+		"""
+		Read the particles from one instrument with UNIX_start <= UNIX_UTC_ts_int_end <= UNIX_end.
+		Only the day partitions that overlap the time range are opened.  Within a partition, HDF5 reads are limited to the matching rows when the partition is in time order,
+		and Parquet row groups are skipped using their UNIX_UTC_ts_int_end statistics.
+
+		Parameters
+		----------
+		instr_ID : int
+			Instrument ID
+		UNIX_start : float
+			Start of the time range (UNIX UTC timestamp)
+		UNIX_end : float
+			End of the time range (UNIX UTC timestamp)
+		columns : list of strings
+			Columns to read.  If None, all columns are read.  Requested columns that were not stored (eg. low gain channels from a 4-channel instrument) are filled with NaNs.
+
+		Returns
+		-------
+		dictionary of column arrays, sorted by UNIX_UTC_ts_int_end
+		"""
+		partition_data = []
+		for day in range(int(math.floor(UNIX_start/86400.)),int(math.floor(UNIX_end/86400.))+1):
+			partition_path = self._getPartitionPath(instr_ID,day)
+			if not os.path.exists(partition_path):
+				continue
+			if self.file_format == 'hdf5':
+				partition_data.append(self._readHDF5Partition(partition_path,UNIX_start,UNIX_end,columns))
+			else:
+				partition_data.extend(self._readParquetPartition(partition_path,UNIX_start,UNIX_end,columns))
+
+		if columns is None:
+			columns = []
+			for partition_columns in partition_data:
+				columns.extend([column for column in partition_columns if column not in columns])
+
+		particle_data = {}
+		if partition_data == []:
+			for column in columns:
+				particle_data[column] = np.array([],dtype=np.float64)
+			return particle_data
+
+		#the time column is always read, so it can be used to put the partitions in time order
+		time_order = np.argsort(np.concatenate([partition_columns['UNIX_UTC_ts_int_end'] for partition_columns in partition_data]),kind='mergesort')
+		for column in columns:
+			column_parts = [self._getStoredColumn(partition_columns,column) for partition_columns in partition_data]
+			particle_data[column] = np.concatenate(column_parts)[time_order]
+
+		return particle_data
+
+
+	def _getStoredColumn(self, partition_columns, column):
+		"""
+		get a column read from a partition, or NaNs if the column is not stored in that partition
+		"""
+		if column in partition_columns:
+			return partition_columns[column]
+		return np.full(len(partition_columns['UNIX_UTC_ts_int_end']),np.nan)
+
+
+	def _readHDF5Partition(self, partition_path, UNIX_start, UNIX_end, columns):
+		"""
+		read the rows of an HDF5 partition within the time range
+		"""
+		partition_columns = {}
+		with h5py.File(partition_path,'r') as h5_file:
+			event_times = h5_file['UNIX_UTC_ts_int_end'][...]
+
+			#partitions written in time order can be sliced, otherwise select rows with a mask
+			if np.all(np.diff(event_times) >= 0):
+				rows = slice(np.searchsorted(event_times,UNIX_start,side='left'),np.searchsorted(event_times,UNIX_end,side='right'))
+			else:
+				rows = (event_times >= UNIX_start) & (event_times <= UNIX_end)
+
+			columns_to_read = set(h5_file.keys())
+			if columns is not None:
+				columns_to_read = columns_to_read & set(columns)
+			columns_to_read.add('UNIX_UTC_ts_int_end')
+
+			for column in columns_to_read:
+				if isinstance(rows,slice):
+					partition_columns[column] = h5_file[column][rows]
+				else:
+					partition_columns[column] = h5_file[column][...][rows]
+
+		return partition_columns
+
+
+	def _readParquetPartition(self, partition_path, UNIX_start, UNIX_end, columns):
+		"""
+		read the rows of a Parquet partition within the time range, one dictionary of columns per row group that overlaps it
+		"""
+		partition_data = []
+		for part_path in sorted(glob.glob(os.path.join(partition_path,'part-*.parquet'))):
+			parquet_file = pyarrow.parquet.ParquetFile(part_path)
+			stored_columns = parquet_file.schema.names
+			time_column = stored_columns.index('UNIX_UTC_ts_int_end')
+
+			columns_to_read = stored_columns
+			if columns is not None:
+				columns_to_read = [column for column in stored_columns if column in columns or column == 'UNIX_UTC_ts_int_end']
+
+			for row_group in range(parquet_file.num_row_groups):
+				statistics = parquet_file.metadata.row_group(row_group).column(time_column).statistics
+				if statistics is not None and statistics.has_min_max and (statistics.max < UNIX_start or statistics.min > UNIX_end):
+					continue
+
+				table = parquet_file.read_row_group(row_group,columns=columns_to_read)
+				row_group_columns = {}
+				for column in columns_to_read:
+					row_group_columns[column] = _arrowColumnToArray(table.column(column))
+
+				rows = (row_group_columns['UNIX_UTC_ts_int_end'] >= UNIX_start) & (row_group_columns['UNIX_UTC_ts_int_end'] <= UNIX_end)
+				for column in row_group_columns:
+					row_group_columns[column] = row_group_columns[column][rows]
+
+				partition_data.append(row_group_columns)
+
+		return partition_data
@@ -10,12 +10,136 @@ import math
 import mysql.connector
 from datetime import datetime
 import calendar
+import glob
+import multiprocessing
+import time
 from SP2_particle_record import ParticleRecord
+from SP2_particle_batch import ParticleBatch
+from SP2_time_interval import MassCalibration
 
 """
 This module contains methods for dealing with raw .sp2b files
 """
 
+#files are decoded and classified in blocks of this many records, so memory use does not grow with the file size.  It can be changed for a file with parameters['records_per_batch'].
+RECORDS_PER_BATCH = 10000
+
+
+def defineRecordDtype(number_of_channels,number_of_samples,spare_array_size=0):
+	"""
+	define the numpy dtype of a single .sp2b record (all values are big-endian, see ParticleRecord.importFromBinary for the record layout)
+	"""
+	record_fields = [
+		('data_length','>u4'),
+		('number_of_channels','>u4'),
+		('waveforms','>i2',(number_of_samples,number_of_channels)),
+		('flag','>u2'),
+		('short_timestamp','>f4'),
+		('reserved_0','>f4'),
+		('event_index','>f4'),
+		('time_10000','>f4'),
+		('time_remainder','>f4'),
+		('reserved_1','>f4',(2,)),
+		('reserved_2','>f8',(2,)),
+		('spare_array_size','>u4'),
+		]
+
+	if spare_array_size > 0:
+		record_fields.append(('spare_array','>f4',(spare_array_size,)))
+
+	return np.dtype(record_fields)
+
+
+def getRecordDtype(sp2b_file):
+	"""
+	read the header of the record at the current file position and return the matching record dtype.  The file position is left unchanged.
+	"""
+	start_position = sp2b_file.tell()
+
+	header = sp2b_file.read(8)
+	if len(header) < 8:
+		sp2b_file.seek(start_position)
+		raise ValueError('no complete .sp2b record found at byte ' + str(start_position))
+	number_of_samples,number_of_channels = unpack('>II',header)
+
+	#skip the waveforms, flag, timestamps and reserved fields to get to the size of the spare array
+	sp2b_file.seek(number_of_samples*number_of_channels*2+46,1)
+	spare_array_size = sp2b_file.read(4)
+	sp2b_file.seek(start_position)
+	if len(spare_array_size) < 4:
+		raise ValueError('no complete .sp2b record found at byte ' + str(start_position))
+
+	return defineRecordDtype(number_of_channels,number_of_samples,unpack('>I',spare_array_size)[0])
+
+
+def decodeRecords(sp2b_file,number_of_records=-1,record_dtype=None):
+	"""
+	Decode a block of records from an open .sp2b file with a single read.
+
+	Parameters
+	----------
+	sp2b_file : file object
+		Open .sp2b file, positioned at the start of a record
+	number_of_records : int
+		Number of records to read.  If negative, read to the end of the file.  Incomplete records at the end of the file are ignored.
+	record_dtype : numpy dtype
+		Record layout as returned by defineRecordDtype.  If None, it is determined from the header of the first record.
+
+	Returns
+	-------
+	numpy structured array with one element per record.  Wrap it in a ParticleBatch to get the per-channel waveform arrays and timestamps.
+	"""
+	if record_dtype is None:
+		record_dtype = getRecordDtype(sp2b_file)
+
+	if number_of_records < 0:
+		raw_data = sp2b_file.read()
+	else:
+		raw_data = sp2b_file.read(number_of_records*record_dtype.itemsize)
+
+	number_of_complete_records = len(raw_data)//record_dtype.itemsize
+
+	return np.frombuffer(raw_data,dtype=record_dtype,count=number_of_complete_records)
+
+
+def memmapRecords(sp2b_file_path,bytes_per_record,record_dtype=None):
+	"""
+	Map a .sp2b file into memory as a read-only array of records.
+	Nothing is read until a record is accessed, so records[file_index] is a constant time lookup for any file_index and slices are views, not copies.
+
+	Parameters
+	----------
+	sp2b_file_path : string
+		Path to the .sp2b file
+	bytes_per_record : int
+		Length of a single record in bytes, as returned by SP2_utilities.getInstrInfo
+	record_dtype : numpy dtype
+		Record layout as returned by defineRecordDtype.  If None, it is determined from the header of the first record.
+
+	Returns
+	-------
+	numpy.memmap structured array with one element per complete record.
+	Wrap it (or a slice of it) in a ParticleBatch to get the per-channel waveform arrays, or use getParticleRecord to get a single record.
+	"""
+	if record_dtype is None:
+		with open(sp2b_file_path,'rb') as sp2b_file:
+			record_dtype = getRecordDtype(sp2b_file)
+
+	if record_dtype.itemsize != bytes_per_record:
+		raise ValueError('record length in ' + str(sp2b_file_path) + ' (' + str(record_dtype.itemsize) + ' bytes) does not match bytes_per_record (' + str(bytes_per_record) + ' bytes)')
+
+	number_of_records = os.path.getsize(sp2b_file_path)//bytes_per_record
+
+	return np.memmap(sp2b_file_path,dtype=record_dtype,mode='r',shape=(number_of_records,))
+
+
+def getParticleRecord(records,file_index,acq_rate):
+	"""
+	Get a ParticleRecord for a single record (eg. for plotting with make_plot or for re-fitting) from an array returned by memmapRecords or decodeRecords
+	"""
+	return ParticleRecord(records[file_index].tobytes(),acq_rate)
+
+
 
 def make_plot(particle_record):
 	"""
@@ -33,9 +157,9 @@ def make_plot(particle_record):
 	ax1.plot(x_vals_all, y_vals_scat_HG,'o', markerfacecolor='None', label = 'HG scattering signal')  
 	ax1.plot(x_vals_all, y_vals_incand_HG, color ='red',marker = 'o', linestyle = 'None', label = 'HG incandescent signal')
 	
-	if y_vals_scat_LG != []:
+	if len(y_vals_scat_LG) > 0:
 		ax1.plot(x_vals_all, y_vals_scat_LG,'s', markerfacecolor='None', label = 'LG scattering signal')  
-	if y_vals_incand_LG != []:
+	if len(y_vals_incand_LG) > 0:
 		ax1.plot(x_vals_all, y_vals_incand_LG, color ='red',marker = 's', linestyle = 'None', label = 'LG incandescent signal')
 	
 	ax1.set_xlabel('data point #')
@@ -47,9 +171,19 @@ def make_plot(particle_record):
 
 
 	
-def defineIncandInsertStatement(number_of_channels,table_name):
+def _addHKIDToInsertStatement(insert_statement):
+	"""
+	add the hk_id column to a particle insert statement
+	"""
+	insert_statement = insert_statement.replace('(instr_ID,','(hk_id,\n				  instr_ID,',1)
+	insert_statement = insert_statement.replace('%(instr_ID)s,','%(hk_id)s,\n				  %(instr_ID)s,',1)
+	return insert_statement
+
+	
+def defineIncandInsertStatement(number_of_channels,table_name,include_hk_id=False):
 	"""
-	define the datbase insert statement for incandescent particles
+	define the datbase insert statement for incandescent particles.  
+	Set include_hk_id to True when the particles are written with an hk_index parameter (see SP2_housekeeping.HKIntervalIndex).
 	"""
 	if number_of_channels == 8:
 		insert_statement = ('''INSERT INTO  ''' + table_name + '''							  
@@ -103,11 +237,15 @@ def defineIncandInsertStatement(number_of_channels,table_name):
 				  %(NB_incand_HG_pkht)s
 				  )''')
 
+	if include_hk_id:
+		insert_statement = _addHKIDToInsertStatement(insert_statement)
+
 	return insert_statement
 
-def defineNonincandInsertStatement(number_of_channels,table_name):
+def defineNonincandInsertStatement(number_of_channels,table_name,include_hk_id=False):
 	"""
-	define the database insert statement for non-incandescent particles
+	define the database insert statement for non-incandescent particles.
+	Set include_hk_id to True when the particles are written with an hk_index parameter (see SP2_housekeeping.HKIntervalIndex).
 	"""
 	if number_of_channels == 8:
 		insert_statement = ('''INSERT INTO  ''' + table_name + '''							  
@@ -155,175 +293,585 @@ def defineNonincandInsertStatement(number_of_channels,table_name):
 				  %(BB_scat_HG_pkpos)s
 				  )''')
 
+	if include_hk_id:
+		insert_statement = _addHKIDToInsertStatement(insert_statement)
+
 	return insert_statement
 
+def _readParticleBatch(sp2b_file,parameters,start_file_index=0,number_of_records=None):
+	"""
+	decode number_of_records records from start_file_index (or all of them up to parameters['number_of_records'] if number_of_records is None) from the .sp2b file into a ParticleBatch.
+	If start_file_index is not 0, the file is read from byte start_file_index*bytes_per_record.
+	"""
+	records_to_read = parameters['number_of_records']-start_file_index
+	if number_of_records is not None:
+		records_to_read = min(records_to_read,number_of_records)
+	if records_to_read <= 0:
+		return None
+
+	if start_file_index > 0:
+		sp2b_file.seek(start_file_index*parameters['bytes_per_record'])
+
+	records = decodeRecords(sp2b_file,records_to_read)
+	if records.dtype.itemsize != parameters['bytes_per_record']:
+		raise ValueError('record length in ' + str(parameters['file_name']) + ' (' + str(records.dtype.itemsize) + ' bytes) does not match bytes_per_record (' + str(parameters['bytes_per_record']) + ' bytes)')
+
+	return ParticleBatch(records,parameters['acq_rate'],start_file_index)
+
+
+def _readParticleBatches(sp2b_file,parameters,start_file_index=0):
+	"""
+	decode the records from start_file_index to parameters['number_of_records'] from the .sp2b file, yielding a ParticleBatch for each block of 
+	parameters['records_per_batch'] records (RECORDS_PER_BATCH if not set), so only one block of the file is decoded at a time
+	"""
+	records_per_batch = parameters.get('records_per_batch',RECORDS_PER_BATCH)
+	for first_file_index in range(start_file_index,parameters['number_of_records'],records_per_batch):
+		particle_batch = _readParticleBatch(sp2b_file,parameters,first_file_index,records_per_batch)
+		if particle_batch is None or particle_batch.number_of_records == 0:
+			return
+		yield particle_batch
+		if particle_batch.number_of_records < records_per_batch:
+			return
+
+
+def _classifyIncandParticles(particle_batch,parameters):
+	"""
+	find the incandescent particles that we can detect with the HG channel and return their file indexes, timestamps, and peak attributes as arrays
+	"""
+	#get the peak attributes of all channels, the broadband high gain incandescence peak height is used to determine if this is an incandescent particle
+	if particle_batch.incandMax is None:
+		particle_batch.peakInfo()
+	detected = np.flatnonzero(particle_batch.incandMax >= parameters['min_detectable_signal'])
+
+	particle_data = {
+	'file_index':detected+particle_batch.first_file_index,
+	'UNIX_UTC_ts_int_end':particle_batch.timestamp[detected],
+	'BB_incand_HG_pkht':particle_batch.incandMax[detected],
+	'BB_incand_HG_pkpos':particle_batch.incandMaxPos[detected].astype(np.float64),
+	'NB_incand_HG_pkht':particle_batch.narrowIncandMax[detected],
+	}
+
+	#get low gain signals if this is an 8-channel instrument
+	if parameters['number_of_channels'] == 8:
+		particle_data['BB_incand_LG_pkht'] 	= particle_batch.incandMax_LG[detected]
+		particle_data['BB_incand_LG_pkpos'] = particle_batch.incandMaxPos_LG[detected].astype(np.float64)
+		particle_data['NB_incand_LG_pkht'] 	= particle_batch.narrowIncandMax_LG[detected]
+
+	return particle_data
 
-def writeIncandParticleData(sp2b_file,parameters,prev_particle_ts,count,insert_statement,cnx,cursor):
+
+def _classifyNonincandParticles(particle_batch,parameters):
 	"""
-	Parse the raw data records and write information from incandescent particles to the database
+	find the non-incandescent particles that we can detect with the HG scattering channel and return their file indexes, timestamps, and peak attributes as arrays
 	"""
-	record_index = 0      
+	#get the peak attributes of all channels, the broadband high gain incandescence and scattering peak heights are used to determine if this is a non-incandescent particle
+	if particle_batch.incandMax is None:
+		particle_batch.peakInfo()
+	detected = np.flatnonzero((particle_batch.incandMax < parameters['min_detectable_incand_signal']) & (particle_batch.scatteringMax > parameters['min_detectable_scat_signal']))
+
+	particle_data = {
+	'file_index':detected+particle_batch.first_file_index,
+	'UNIX_UTC_ts_int_end':particle_batch.timestamp[detected],
+	'BB_scat_HG_pkht':particle_batch.scatteringMax[detected],
+	'BB_scat_HG_pkpos':particle_batch.scatteringMaxPos[detected].astype(np.float64),
+	}
+
+	#get low gain signals if this is an 8-channel instrument
+	if parameters['number_of_channels'] == 8:
+		particle_data['BB_scat_LG_pkht'] 	= particle_batch.scatteringMax_LG[detected]
+		particle_data['BB_scat_LG_pkpos'] 	= particle_batch.scatteringMaxPos_LG[detected].astype(np.float64)
+
+	return particle_data
+
+
+def _makeParticleRows(particle_data,parameters,prev_particle_ts,extra_values={}):
+	"""
+	turn the particle arrays into database rows, chaining UNIX_UTC_ts_int_start to the timestamp of the previous particle.
+	If there is an hk_index parameter, the hk_id of each particle is set from it.
+	"""
+	hk_ids = None
+	if 'hk_index' in parameters:
+		hk_ids = parameters['hk_index'].getHKIDs(particle_data['UNIX_UTC_ts_int_end'])
+
+	signal_columns = [column for column in particle_data if column not in ['file_index','UNIX_UTC_ts_int_end']]
+	file_indexes = particle_data['file_index'].tolist()
+	event_times = particle_data['UNIX_UTC_ts_int_end'].tolist()
+	signal_values = [particle_data[column].tolist() for column in signal_columns]
+
 	multiple_records = []
-	i=1
-	while record_index < parameters['number_of_records']:
-		#read the binary for a particle
-		record = sp2b_file.read(parameters['bytes_per_record'])	
-		particle_record = ParticleRecord(record, parameters['acq_rate'])
-
-		#run the broadband high gain incandPeakInfo method to retrieve the BBHG incandescence peak attributes, this will be used to determine if this is an incandescent particle	
-		particle_record.incandPeakInfo() 			
-		bbhg_incand_pk_amp = float(particle_record.incandMax)
-		bbhg_incand_pk_pos = float(particle_record.incandMaxPos)
-
-		#if this is an incandescent particle that we can detect with the HG channel then continue 
-		if bbhg_incand_pk_amp >= parameters['min_detectable_signal']:
-			event_time = particle_record.timestamp  #UTC
-			
-			#get the remaining high gain signal information
-			particle_record.narrowIncandPeakInfo()
-			nbhg_incand_pk_amp = float(particle_record.narrowIncandMax)
-			
-			#get low gain signals if this is an 8-channel instrument
-			if parameters['number_of_channels'] == 8:
-				particle_record.incandPeakInfoLG()
-				bblg_incand_pk_amp = float(particle_record.incandMax_LG)
-				bblg_incand_pk_pos = float(particle_record.incandMaxPos_LG)
-				particle_record.narrowIncandPeakInfoLG()
-				nblg_incand_pk_amp = float(particle_record.narrowIncandMax_LG)
-
-				single_record ={
-				'instr_ID':parameters['instr_id'],
-				'instr_location_ID':parameters['instr_locn_ID'],
-				'sp2b_file':parameters['file_name'], 
-				'file_index':record_index, 
-				'UNIX_UTC_ts_int_start':prev_particle_ts,
-				'UNIX_UTC_ts_int_end':event_time,
-				'BB_incand_HG_pkht':bbhg_incand_pk_amp,
-				'BB_incand_HG_pkpos':bbhg_incand_pk_pos,
-				'BB_incand_LG_pkht':bblg_incand_pk_amp,
-				'BB_incand_LG_pkpos':bblg_incand_pk_pos,
-				'NB_incand_HG_pkht':nbhg_incand_pk_amp,
-				'NB_incand_LG_pkht':nblg_incand_pk_amp,	
-				}
-
-			
-			else:
-				single_record ={
-				'instr_ID':parameters['instr_id'],
-				'instr_location_ID':parameters['instr_locn_ID'],
-				'sp2b_file':parameters['file_name'], 
-				'file_index':record_index, 
-				'UNIX_UTC_ts_int_start':prev_particle_ts,
-				'UNIX_UTC_ts_int_end':event_time,
-				'BB_incand_HG_pkht':bbhg_incand_pk_amp,
-				'BB_incand_HG_pkpos':bbhg_incand_pk_pos,
-				'NB_incand_HG_pkht':nbhg_incand_pk_amp,
-				}
-
-			if 'mob_dia' in parameters:
-				single_record['mob_dia'] = parameters['mob_dia']
-
-			multiple_records.append((single_record))
-			#bulk insert to db table
-			if i%2000 == 0:
-				cursor.executemany(insert_statement, multiple_records)
-				cnx.commit()
-				multiple_records = []
-
-
-			prev_particle_ts = event_time
-
-			#increment count of detectable incandescent particles
-			i+= 1
-			
-		record_index+=1   
-
-	#bulk insert of remaining records to db
-	if multiple_records != []:
-		cursor.executemany(insert_statement, multiple_records)
+	for i in range(len(file_indexes)):
+		event_time = event_times[i]  #UTC
+		single_record ={
+		'instr_ID':parameters['instr_id'],
+		'instr_location_ID':parameters['instr_locn_ID'],
+		'sp2b_file':parameters['file_name'], 
+		'file_index':file_indexes[i], 
+		'UNIX_UTC_ts_int_start':prev_particle_ts,
+		'UNIX_UTC_ts_int_end':event_time,
+		}
+		for column,values in zip(signal_columns,signal_values):
+			single_record[column] = values[i]
+		single_record.update(extra_values)
+		if hk_ids is not None:
+			single_record['hk_id'] = hk_ids[i]
+
+		multiple_records.append((single_record))
+		prev_particle_ts = event_time
+
+	return multiple_records,prev_particle_ts
+
+
+def _insertParticleRows(multiple_records,insert_statement,cnx,cursor,sink=None,committed=None):
+	"""
+	bulk insert rows to the db table, committing every 2000 rows, or hand them to the sink if there is one.
+	If given, committed(last_record,number_committed) is called after each commit.
+	"""
+	if sink is not None:
+		sink.write(multiple_records)
+		if committed is not None and multiple_records != []:
+			committed(multiple_records[-1],len(multiple_records))
+		return
+
+	for start in range(0,len(multiple_records),2000):
+		cursor.executemany(insert_statement, multiple_records[start:start+2000])
 		cnx.commit()
-		multiple_records = []
-	count+=i
+		if committed is not None:
+			number_committed = min(start+2000,len(multiple_records))
+			committed(multiple_records[number_committed-1],number_committed)
+
+
+def _writeParticleRows(particle_data,parameters,prev_particle_ts,count,insert_statement,cnx,cursor,extra_values={},sink=None,particle_type=None):
+	"""
+	write classified particles to the database and update the timestamp chaining and particle count.
+	If there is a checkpoint parameter, it is updated after each commit.  Call _finishFile once all the particles of the file have been written.
+	"""
+	multiple_records,prev_particle_ts = _makeParticleRows(particle_data,parameters,prev_particle_ts,extra_values)
+
+	committed = None
+	checkpoint = parameters.get('checkpoint')
+	if checkpoint is not None:
+		start_count = count
+		def committed(last_record,number_committed):
+			checkpoint.update(particle_type,parameters['file_name'],last_record['file_index'],last_record['UNIX_UTC_ts_int_end'],start_count+number_committed)
+
+	_insertParticleRows(multiple_records,insert_statement,cnx,cursor,sink,committed)
+
+	return prev_particle_ts,count+len(multiple_records)
+
+
+def _getResumePoint(parameters,particle_type,prev_particle_ts,count):
+	"""
+	get the record to start reading from and the starting prev_particle_ts and count for a particle type, from the checkpoint parameter if there is one.
+	Returns start_file_index, prev_particle_ts, count, complete
+	"""
+	checkpoint = parameters.get('checkpoint')
+	if checkpoint is None:
+		return 0,prev_particle_ts,count,False
+
+	if checkpoint.isComplete(particle_type,parameters['file_name']):
+		file_state = checkpoint.getFileState(particle_type,parameters['file_name'])
+		return parameters['number_of_records'],file_state['prev_particle_ts'],file_state['count'],True
+
+	start_file_index,prev_particle_ts,count = checkpoint.getResumePoint(particle_type,parameters['file_name'],prev_particle_ts,count)
+	return start_file_index,prev_particle_ts,count,False
+
+
+def _finishFile(parameters,particle_type,prev_particle_ts,count):
+	"""
+	mark a file as complete for a particle type in the checkpoint parameter, if there is one.  The count passed in includes the increment made for each file.
+	"""
+	checkpoint = parameters.get('checkpoint')
+	if checkpoint is not None:
+		checkpoint.update(particle_type,parameters['file_name'],parameters['number_of_records']-1,prev_particle_ts,count,complete=True)
 
 	return prev_particle_ts,count
 
 
-def writeNonincandParticleData(sp2b_file,parameters,prev_particle_ts,count,insert_statement,cnx,cursor):
+def _selectParticles(particle_data,start_file_index):
+	"""
+	select the classified particles at or after start_file_index
+	"""
+	selected = particle_data['file_index'] >= start_file_index
+	return dict((column,values[selected]) for column,values in particle_data.items())
+
+
+def _concatenateParticles(batch_particle_data):
 	"""
-	Parse the raw data records and write information from non-incandescent particles to the database
+	join the classified particles from consecutive batches of a file, returns None if there are no batches
+	"""
+	if batch_particle_data == []:
+		return None
+	return dict((column,np.concatenate([particle_data[column] for particle_data in batch_particle_data])) for column in batch_particle_data[0])
+
+
+def _getIncandExtraValues(parameters):
+	"""
+	get the values that are written with every incandescent particle but are not measured (eg. the mobility diameter during calibrations)
+	"""
+	extra_values = {}
+	if 'mob_dia' in parameters:
+		extra_values['mob_dia'] = parameters['mob_dia']
+	return extra_values
+
+
+def writeIncandParticleData(sp2b_file,parameters,prev_particle_ts,count,insert_statement,cnx,cursor,sink=None):
+	"""
+	Parse the raw data records and write information from incandescent particles to the database.
+	If a sink is given (eg. an SP2_particle_store.ParticleStore) the particles are written to it instead, and insert_statement, cnx and cursor are not used.
+	If parameters['checkpoint'] is an SP2_checkpoint.IngestCheckpoint, a file that is already complete is skipped, and a partly written file is read from the record after the last one committed.
+	The file is read and written in blocks of parameters['records_per_batch'] records (RECORDS_PER_BATCH if not set).
+	"""
+	start_file_index,prev_particle_ts,count,complete = _getResumePoint(parameters,'incand',prev_particle_ts,count)
+	if complete:
+		return prev_particle_ts,count
+
+	extra_values = _getIncandExtraValues(parameters)
+	for particle_batch in _readParticleBatches(sp2b_file,parameters,start_file_index):
+		particle_data = _classifyIncandParticles(particle_batch,parameters)
+		prev_particle_ts,count = _writeParticleRows(particle_data,parameters,prev_particle_ts,count,insert_statement,cnx,cursor,extra_values,sink,'incand')
+
+	return _finishFile(parameters,'incand',prev_particle_ts,count+1)
+
+
+def writeNonincandParticleData(sp2b_file,parameters,prev_particle_ts,count,insert_statement,cnx,cursor,sink=None):
+	"""
+	Parse the raw data records and write information from non-incandescent particles to the database.
+	If a sink is given (eg. an SP2_particle_store.ParticleStore) the particles are written to it instead, and insert_statement, cnx and cursor are not used.
+	If parameters['checkpoint'] is an SP2_checkpoint.IngestCheckpoint, a file that is already complete is skipped, and a partly written file is read from the record after the last one committed.
+	The file is read and written in blocks of parameters['records_per_batch'] records (RECORDS_PER_BATCH if not set).
 	"""	
-	record_index = 0      
-	multiple_records = []
-	i=1
-	while record_index < parameters['number_of_records']:
-		#read the binary for a particle
-		record = sp2b_file.read(parameters['bytes_per_record'])	
-		particle_record = ParticleRecord(record, parameters['acq_rate'])
-
-		#run the broadband high gain incandPeakInfo method to retrieve the BBHG incandescence peak attributes, this will be used to determine if this is an incandescent particle	
-		particle_record.incandPeakInfo() 
-		particle_record.scatteringPeakInfo()			
-		bbhg_incand_pk_amp = float(particle_record.incandMax)
-		bbhg_scat_pk_amp = float(particle_record.scatteringMax)
-		bbhg_scat_pk_pos = float(particle_record.scatteringMaxPos)
-
-		#if this is an incandescent particle that we can detect with the HG channel then continue 
-		if bbhg_incand_pk_amp < parameters['min_detectable_incand_signal'] and bbhg_scat_pk_amp > parameters['min_detectable_scat_signal']:
-			event_time = particle_record.timestamp  #UTC
-
-			#get low gain signals if this is an 8-channel instrument
-			if parameters['number_of_channels'] == 8:
-				particle_record.scatteringPeakInfoLG()
-				bblg_scat_pk_amp = float(particle_record.scatteringMax_LG)
-				bblg_scat_pk_pos = float(particle_record.scatteringMaxPos_LG)
-
-				single_record ={
-				'instr_ID':parameters['instr_id'],
-				'instr_location_ID':parameters['instr_locn_ID'],
-				'sp2b_file':parameters['file_name'], 
-				'file_index':record_index, 
-				'UNIX_UTC_ts_int_start':prev_particle_ts,
-				'UNIX_UTC_ts_int_end':event_time,
-				'BB_scat_HG_pkht':bbhg_scat_pk_amp,
-				'BB_scat_HG_pkpos':bbhg_scat_pk_pos,
-				'BB_scat_LG_pkht':bblg_scat_pk_amp,
-				'BB_scat_LG_pkpos':bblg_scat_pk_pos,
-				}
-
-			
+	start_file_index,prev_particle_ts,count,complete = _getResumePoint(parameters,'nonincand',prev_particle_ts,count)
+	if complete:
+		return prev_particle_ts,count
+
+	for particle_batch in _readParticleBatches(sp2b_file,parameters,start_file_index):
+		particle_data = _classifyNonincandParticles(particle_batch,parameters)
+		prev_particle_ts,count = _writeParticleRows(particle_data,parameters,prev_particle_ts,count,insert_statement,cnx,cursor,sink=sink,particle_type='nonincand')
+
+	return _finishFile(parameters,'nonincand',prev_particle_ts,count+1)
+
+
+def writeParticleData(sp2b_file,parameters,prev_incand_ts,incand_count,prev_nonincand_ts,nonincand_count,incand_insert_statement,nonincand_insert_statement,cnx,cursor,incand_sink=None,nonincand_sink=None):
+	"""
+	Parse the raw data records once and write information from both incandescent and non-incandescent particles to the database.
+	Each record is decoded and its peaks are found a single time, then it goes to the incandescent table, the non-incandescent table, or is dropped.
+	The parameters are the union of those for writeIncandParticleData and writeNonincandParticleData, and the results are the same as running both of them on the file.
+	incand_sink and nonincand_sink replace the database inserts for each particle type, as the sink does for writeIncandParticleData and writeNonincandParticleData.
+	A checkpoint parameter is used for both particle types, and the file is read from the first record that either type still needs.
+	The file is read and written in blocks of parameters['records_per_batch'] records (RECORDS_PER_BATCH if not set).
+
+	Returns
+	-------
+	prev_incand_ts, incand_count, prev_nonincand_ts, nonincand_count
+	"""
+	incand_start,prev_incand_ts,incand_count,incand_complete = _getResumePoint(parameters,'incand',prev_incand_ts,incand_count)
+	nonincand_start,prev_nonincand_ts,nonincand_count,nonincand_complete = _getResumePoint(parameters,'nonincand',prev_nonincand_ts,nonincand_count)
+	if incand_complete and nonincand_complete:
+		return prev_incand_ts,incand_count,prev_nonincand_ts,nonincand_count
+
+	extra_values = _getIncandExtraValues(parameters)
+	for particle_batch in _readParticleBatches(sp2b_file,parameters,min(incand_start,nonincand_start)):
+		if not incand_complete:
+			incand_data = _selectParticles(_classifyIncandParticles(particle_batch,parameters),incand_start)
+			prev_incand_ts,incand_count = _writeParticleRows(incand_data,parameters,prev_incand_ts,incand_count,incand_insert_statement,cnx,cursor,extra_values,incand_sink,'incand')
+		if not nonincand_complete:
+			nonincand_data = _selectParticles(_classifyNonincandParticles(particle_batch,parameters),nonincand_start)
+			prev_nonincand_ts,nonincand_count = _writeParticleRows(nonincand_data,parameters,prev_nonincand_ts,nonincand_count,nonincand_insert_statement,cnx,cursor,sink=nonincand_sink,particle_type='nonincand')
+
+	if not incand_complete:
+		prev_incand_ts,incand_count = _finishFile(parameters,'incand',prev_incand_ts,incand_count+1)
+	if not nonincand_complete:
+		prev_nonincand_ts,nonincand_count = _finishFile(parameters,'nonincand',prev_nonincand_ts,nonincand_count+1)
+
+	return prev_incand_ts,incand_count,prev_nonincand_ts,nonincand_count
+
+
+def _getSp2bFileList(sp2b_files):
+	"""
+	get the list of .sp2b files to process from either a directory or a list of file paths
+	"""
+	if isinstance(sp2b_files,basestring):
+		#SP2 file names start with the date and end with a sequence number, so sorting by name puts the files in time order
+		return sorted(glob.glob(os.path.join(sp2b_files,'*.sp2b')))
+	return list(sp2b_files)
+
+
+def _decodeAndClassifyFile(task):
+	"""
+	decode a complete .sp2b file and classify its particles, one block of records at a time.  This runs in the worker processes of ingestSp2bFiles.
+	"""
+	sp2b_file_path,parameters,particle_type,start_file_index = task
+
+	file_parameters = dict(parameters)
+	file_parameters['file_name'] = os.path.basename(sp2b_file_path)
+	file_parameters['number_of_records'] = os.path.getsize(sp2b_file_path)//parameters['bytes_per_record']
+
+	#files that are already complete are not read (see ingestSp2bFiles)
+	if start_file_index is None:
+		return file_parameters,None
+
+	if particle_type == 'incand':
+		classifyParticles = _classifyIncandParticles
+	elif particle_type == 'nonincand':
+		classifyParticles = _classifyNonincandParticles
+	else:
+		raise ValueError('unknown particle type: ' + str(particle_type))
+
+	#only the classified particles are kept from each block, these are much smaller than the records
+	batch_particle_data = []
+	with open(sp2b_file_path,'rb') as sp2b_file:
+		for particle_batch in _readParticleBatches(sp2b_file,file_parameters,start_file_index):
+			batch_particle_data.append(classifyParticles(particle_batch,file_parameters))
+
+	return file_parameters,_concatenateParticles(batch_particle_data)
+
+
+def ingestSp2bFiles(sp2b_files,parameters,prev_particle_ts,count,insert_statement,cnx,cursor,particle_type='incand',processes=None,sink=None):
+	"""
+	Decode and classify many .sp2b files in a pool of worker processes and write the particles to the database from this process.
+	The files are written in order, one at a time, so the UNIX_UTC_ts_int_start chaining and the returned values are the same as 
+	calling writeIncandParticleData or writeNonincandParticleData on each file in turn.
+
+	Parameters
+	----------
+	sp2b_files : string or list of strings
+		Either a directory, in which case all .sp2b files in it are processed in file name (ie. time) order, or a list of .sp2b file paths, which are processed in the order given
+	parameters : dict
+		The same parameters as for writeIncandParticleData or writeNonincandParticleData.  
+		'file_name' and 'number_of_records' are determined for each file and don't need to be set.
+	particle_type : string
+		'incand' to write incandescent particles or 'nonincand' to write non-incandescent particles
+	processes : int
+		Number of worker processes.  If None, one per CPU is used.
+	sink : object with a write method
+		If given (eg. an SP2_particle_store.ParticleStore), the particles are written to it instead of the database
+
+	If parameters['checkpoint'] is an SP2_checkpoint.IngestCheckpoint, complete files are skipped without being read and a partly written file is read from the record after the last one committed.
+	"""
+	#the housekeeping index and checkpoint are only needed by the writer, so they are not sent to the workers
+	worker_parameters = dict(parameters)
+	worker_parameters.pop('hk_index',None)
+	worker_parameters.pop('checkpoint',None)
+	checkpoint = parameters.get('checkpoint')
+
+	tasks = []
+	for sp2b_file_path in _getSp2bFileList(sp2b_files):
+		start_file_index = 0
+		if checkpoint is not None:
+			file_name = os.path.basename(sp2b_file_path)
+			if checkpoint.isComplete(particle_type,file_name):
+				start_file_index = None
 			else:
-				single_record ={
-				'instr_ID':parameters['instr_id'],
-				'instr_location_ID':parameters['instr_locn_ID'],
-				'sp2b_file':parameters['file_name'], 
-				'file_index':record_index, 
-				'UNIX_UTC_ts_int_start':prev_particle_ts,
-				'UNIX_UTC_ts_int_end':event_time,
-				'BB_scat_HG_pkht':bbhg_scat_pk_amp,
-				'BB_scat_HG_pkpos':bbhg_scat_pk_pos,
-				}
-
-
-			multiple_records.append((single_record))
-			#bulk insert to db table
-			if i%2000 == 0:
-				cursor.executemany(insert_statement, multiple_records)
-				cnx.commit()
-				multiple_records = []
-
-
-			prev_particle_ts = event_time
-
-			#increment count of detectable incandescent particles
-			i+= 1
-			
-		record_index+=1   
-
-	#bulk insert of remaining records to db
-	if multiple_records != []:
-		cursor.executemany(insert_statement, multiple_records)
-		cnx.commit()
-		multiple_records = []
-	count+=i
+				start_file_index = checkpoint.getResumePoint(particle_type,file_name,prev_particle_ts,count)[0]
+		tasks.append((sp2b_file_path,worker_parameters,particle_type,start_file_index))
+
+	extra_values = {}
+	if particle_type == 'incand':
+		extra_values = _getIncandExtraValues(parameters)
+
+	pool = multiprocessing.Pool(processes)
+	try:
+		#imap returns the results in task order while the workers keep decoding the files that follow
+		for file_parameters,particle_data in pool.imap(_decodeAndClassifyFile,tasks):
+			for parameter in ['hk_index','checkpoint']:
+				if parameter in parameters:
+					file_parameters[parameter] = parameters[parameter]
+
+			start_file_index,prev_particle_ts,count,complete = _getResumePoint(file_parameters,particle_type,prev_particle_ts,count)
+			if complete:
+				continue
+			if particle_data is not None:
+				prev_particle_ts,count = _writeParticleRows(particle_data,file_parameters,prev_particle_ts,count,insert_statement,cnx,cursor,extra_values,sink,particle_type)
+			prev_particle_ts,count = _finishFile(file_parameters,particle_type,prev_particle_ts,count+1)
+		pool.close()
+	except:
+		pool.terminate()
+		raise
+	finally:
+		pool.join()
+
+	return prev_particle_ts,count
+
+
+class Sp2bFileFollower(object):
+
+	"""
+
+	This class follows a .sp2b file while the SP2 is still writing it.
+	Each poll decodes only the complete records appended since the last poll, writes the incandescent particles among them to the database (or a sink), 
+	and updates a rolling summary of the rBC mass and number detected in the most recent summary_interval seconds.
+	The summary only has totals, not concentrations: the sampled volume needs the sample flow and chamber conditions from the housekeeping data, which are not available while the file is being written.
+	Non-incandescent particles are not written, they can be ingested from the file once it is closed.
+
+	"""
 
-	return prev_particle_ts,count	
+	def __init__(self, sp2b_file_path, parameters, prev_particle_ts, count, insert_statement, cnx, cursor, calibration_info=None, summary_interval=60., sink=None):
+
+		"""
+		Parameters
+		----------
+		sp2b_file_path : string
+			Path of the .sp2b file to follow, it does not need to exist yet
+		parameters : dict
+			The same parameters as for writeIncandParticleData, except 'file_name' and 'number_of_records' which are set from the file
+		prev_particle_ts : float
+			Timestamp of the previous particle, for the UNIX_UTC_ts_int_start of the first particle
+		count : int
+			Particle count
+		calibration_info : dictionary
+			Calibration limits and coefficients, as TimeInterval.calibration_info.  A MassCalibration with lookup tables is made from these.  If None, the summaries only give particle numbers.
+		summary_interval : float
+			Length of the rolling summary window in seconds (of particle time, not wall clock time)
+		sink : object with a write method
+			If given (eg. an SP2_particle_store.ParticleStore), the particles are written to it instead of the database
+		"""
+
+		self.sp2b_file_path = sp2b_file_path
+		self.parameters = dict(parameters)
+		self.parameters['file_name'] = os.path.basename(sp2b_file_path)
+		self.parameters['number_of_records'] = 0
+		self.parameters.pop('checkpoint',None)
+		self.prev_particle_ts = prev_particle_ts
+		self.count = count
+		self.insert_statement = insert_statement
+		self.cnx = cnx
+		self.cursor = cursor
+		self.calibration_info = calibration_info
+		self.mass_calibration = None
+		if calibration_info is not None:
+			self.mass_calibration = MassCalibration(calibration_info,parameters['number_of_channels'],lookup_table=True)
+		self.summary_interval = summary_interval
+		self.sink = sink
+
+		self.records_read = 0
+		self.particles_written = 0
+		self.summary = None
+
+		#particle times, masses, and mass uncertainties in the rolling summary window
+		self.window_particle_ts = np.array([],dtype=np.float64)
+		self.window_mass = np.array([],dtype=np.float64)
+		self.window_mass_uncertainty = np.array([],dtype=np.float64)
+
+
+	def readNewRecords(self):
+		"""
+		Decode the complete records appended to the file since the last read, up to parameters['records_per_batch'] records (RECORDS_PER_BATCH if not set).  
+		A record that is still being written, or any records past the batch size, are left for the next read.
+		Returns a ParticleBatch, or None if there are no new complete records.
+		"""
+		if not os.path.exists(self.sp2b_file_path):
+			return None
+
+		number_of_records = os.path.getsize(self.sp2b_file_path)//self.parameters['bytes_per_record']
+		if number_of_records <= self.records_read:
+			return None
+
+		number_of_records = min(number_of_records,self.records_read+self.parameters.get('records_per_batch',RECORDS_PER_BATCH))
+		self.parameters['number_of_records'] = number_of_records
+		with open(self.sp2b_file_path,'rb') as sp2b_file:
+			particle_batch = _readParticleBatch(sp2b_file,self.parameters,self.records_read)
+		self.records_read = number_of_records
+
+		return particle_batch
+
+
+	def poll(self):
+		"""
+		Write the incandescent particles from any new records, one batch of records at a time (see readNewRecords), and update the rolling summary.
+		Returns the summary (see getSummary), or None if there were no new records.
+		"""
+		particle_batch = self.readNewRecords()
+		if particle_batch is None:
+			return None
+
+		new_particles = 0
+		while particle_batch is not None:
+			particle_data = _classifyIncandParticles(particle_batch,self.parameters)
+			multiple_records,self.prev_particle_ts = _makeParticleRows(particle_data,self.parameters,self.prev_particle_ts,_getIncandExtraValues(self.parameters))
+			_insertParticleRows(multiple_records,self.insert_statement,self.cnx,self.cursor,self.sink)
+			self.count += len(multiple_records)
+			self.particles_written += len(multiple_records)
+			new_particles += len(multiple_records)
+
+			self._updateSummaryWindow(particle_data)
+			particle_batch = self.readNewRecords()
+
+		self.summary = self.getSummary(new_particles)
+
+		return self.summary
+
+
+	def _updateSummaryWindow(self, particle_data):
+		"""
+		add new particles to the rolling summary window and drop those that are now older than summary_interval
+		"""
+		if self.mass_calibration is not None:
+			rBC_mass,rBC_mass_uncertainty = self.mass_calibration.calculateMass(particle_data['BB_incand_HG_pkht'],particle_data.get('BB_incand_LG_pkht',np.full(len(particle_data['file_index']),np.nan)))
+		else:
+			rBC_mass = np.full(len(particle_data['file_index']),np.nan)
+			rBC_mass_uncertainty = np.full(len(particle_data['file_index']),np.nan)
+
+		self.window_particle_ts = np.concatenate([self.window_particle_ts,particle_data['UNIX_UTC_ts_int_end']])
+		self.window_mass = np.concatenate([self.window_mass,rBC_mass])
+		self.window_mass_uncertainty = np.concatenate([self.window_mass_uncertainty,rBC_mass_uncertainty])
+
+		if len(self.window_particle_ts) > 0:
+			in_window = self.window_particle_ts > (np.max(self.window_particle_ts)-self.summary_interval)
+			self.window_particle_ts = self.window_particle_ts[in_window]
+			self.window_mass = self.window_mass[in_window]
+			self.window_mass_uncertainty = self.window_mass_uncertainty[in_window]
+
+
+	def getSummary(self, new_particles=0):
+		"""
+		Get the rolling summary of the particles detected in the last summary_interval seconds.
+		This is a dictionary with: the start and end of the window (UNIX UTC timestamps), the number of incandescent particles detected, 
+		the total rBC mass, mass uncertainty and number of particles within the calibration limits, the number of new particles written and the number of records read from the file.
+		These are totals over the window, not concentrations (no sampled volume is calculated).  For concentrations, process the interval with a TimeInterval once the housekeeping data has been written.
+		"""
+		window_end = self.prev_particle_ts
+		if len(self.window_particle_ts) > 0:
+			window_end = np.max(self.window_particle_ts)
+		has_mass = ~np.isnan(self.window_mass)
+
+		return {
+			'UNIX_UTC_ts_int_start':window_end-self.summary_interval,
+			'UNIX_UTC_ts_int_end':window_end,
+			'detected number':len(self.window_particle_ts),
+			'total number':int(np.sum(has_mass)),
+			'total mass':np.sum(self.window_mass[has_mass]),
+			'total mass uncertainty':np.sum(self.window_mass_uncertainty[has_mass]),
+			'new particles':new_particles,
+			'records read':self.records_read,
+			}
+
+
+	def follow(self, poll_interval=1., idle_timeout=60., max_polls=None):
+		"""
+		Poll the file until no new records have been written for idle_timeout seconds (eg. because the SP2 has moved on to the next file) or until max_polls polls.
+		This is a generator, the summary is returned after each poll that found new records.  
+		When it stops, the particle count is incremented once for the file, as when writeIncandParticleData writes a complete file.
+
+		Parameters
+		----------
+		poll_interval : float
+			Time to wait between polls in seconds when there are no new records
+		idle_timeout : float
+			Time in seconds without new records after which to stop
+		max_polls : int
+			Maximum number of polls.  If None, there is no maximum.
+		"""
+		polls = 0
+		idle_time = 0.
+		try:
+			while idle_time < idle_timeout and (max_polls is None or polls < max_polls):
+				polls += 1
+				summary = self.poll()
+				if summary is not None:
+					idle_time = 0.
+					yield summary
+				else:
+					time.sleep(poll_interval)
+					idle_time += poll_interval
+		finally:
+			self.count += 1
@@ -16,6 +16,250 @@ from scipy.optimize import curve_fit
 import SP2_utilities
 from mysql_db_connection import dbConnection
 
+#column layout of the single particle data retrieved for an interval (None values from the database become NaNs)
+single_particle_dtype = np.dtype([
+	('UNIX_UTC_ts_int_start','f8'),
+	('UNIX_UTC_ts_int_end','f8'),
+	('BB_incand_HG_pkht','f8'),
+	('BB_incand_LG_pkht','f8'),
+	('sample_flow','f8'),
+	('NB_incand_HG_pkht','f8'),
+	('chamber_temp','f8'),
+	('chamber_pressure','f8'),
+	])
+
+
+def _calibrationArrays(channel_calibration_info):
+	"""
+	get the signal limits, calibration coefficients, and coefficients plus their errors for one channel as float64 values (the limits may be Decimals from the database)
+	"""
+	pkht_ll, pkht_ul, calib_0, calib_1, calib_2, calib_0_err, calib_1_err, calib_2_err = channel_calibration_info
+	
+	#the coefficients and their errors are added before conversion, as in TimeInterval.calculateMass
+	calib = np.array([calib_0,calib_1,calib_2],dtype=np.float64)
+	calib_max = np.array([(calib_0+calib_0_err),(calib_1+calib_1_err),(calib_2+calib_2_err)],dtype=np.float64)
+
+	return np.float64(pkht_ll), np.float64(pkht_ul), calib, calib_max
+
+
+def _calibrationPolynomial(calib,signal):
+	"""
+	evaluate the quadratic calibration for an array of signals, missing (NaN) terms are ignored as with np.nansum
+	"""
+	terms = [np.full(signal.shape,calib[0]),calib[1]*signal,calib[2]*signal*signal]
+	total = np.zeros(signal.shape)
+	for term in terms:
+		total += np.where(np.isnan(term),0.,term)
+	return total
+
+
+def calculateMassArray(calibration_info,number_of_channels,BB_incand_HG,BB_incand_LG):
+	"""
+	Calculate the rBC mass and uncertainty for arrays of particles.  This gives the same results as TimeInterval.calculateMass applied to each particle.
+	To convert many arrays with the same calibration, make a MassCalibration once and use its calculateMass method.
+	
+	Parameters
+	----------
+	calibration_info : dictionary
+		Calibration limits and coefficients for the 'BBHG_incand' and 'BBLG_incand' channels, as set by TimeInterval.retrieveCalibrationData
+	number_of_channels : int
+		4 or 8
+	BB_incand_HG : numpy array
+		Broadband high-gain incandescence channel signal heights
+	BB_incand_LG : numpy array
+		Broadband low-gain incandescence channel signal heights
+
+	Returns
+	-------
+	rBC_mass, rBC_mass_uncertainty : numpy arrays, NaN for particles with signals outside the detection limits
+	"""
+	return MassCalibration(calibration_info,number_of_channels).calculateMass(BB_incand_HG,BB_incand_LG)
+
+
+class MassCalibration(object):
+
+	"""
+
+	This class converts broadband incandescence peak heights to rBC mass, mass uncertainty and VED with the calibration for an interval.
+	It is built once from the calibration limits and coefficients (eg. TimeInterval.calibration_info) and converts whole arrays of peak heights, 
+	choosing the high or low gain channel for each particle and giving NaN outside the detection limits, with the same results as TimeInterval.calculateMass.
+
+	Peak heights are 16-bit signals less a baseline averaged over 10 samples, so they fall on a 0.1 grid.  
+	makeLookupTables precomputes the mass for every grid point within the calibration limits, after which peak heights on the grid are converted by table lookups.
+	Peak heights off the grid or outside the tables are still calculated directly.
+
+	"""
+
+	def __init__(self, calibration_info, number_of_channels, lookup_table=False, lookup_resolution=0.1):
+
+		"""
+		Parameters
+		----------
+		calibration_info : dictionary
+			Calibration limits and coefficients for the 'BBHG_incand' and 'BBLG_incand' channels, as set by TimeInterval.retrieveCalibrationData
+		number_of_channels : int
+			4 or 8
+		lookup_table : bool
+			If True, make the lookup tables (see makeLookupTables)
+		lookup_resolution : float
+			Peak height spacing of the lookup tables
+		"""
+
+		self.number_of_channels = number_of_channels
+
+		#signal limits, calibration coefficients, and coefficients plus their errors for each channel
+		self.channel_calibrations = {}
+		for channel in ['BBHG_incand','BBLG_incand']:
+			self.channel_calibrations[channel] = _calibrationArrays(calibration_info[channel])
+
+		self.lookup_resolution = lookup_resolution
+		self.lookup_tables = None
+		self.VED_lookup_tables = {}
+		if lookup_table == True:
+			self.makeLookupTables(lookup_resolution)
+
+
+	def makeLookupTables(self, lookup_resolution=0.1):
+		"""
+		Precompute the mass and the mass with the calibration errors added for every peak height on a grid with spacing lookup_resolution between the lower and upper signal limits of each channel in use.
+		Channels with missing limits get no table.
+
+		Parameters
+		----------
+		lookup_resolution : float
+			Peak height spacing of the lookup tables
+		"""
+		self.lookup_resolution = lookup_resolution
+		self.lookup_tables = {}
+		self.VED_lookup_tables = {}
+
+		for channel in ['BBHG_incand','BBLG_incand']:
+			pkht_ll, pkht_ul, calib, calib_max = self.channel_calibrations[channel]
+			if channel == 'BBLG_incand' and self.number_of_channels != 8:
+				continue #4 channel instruments only use the high gain channel
+			if not (np.isfinite(pkht_ll) and np.isfinite(pkht_ul)):
+				continue
+
+			first_index = int(math.floor(pkht_ll/lookup_resolution))
+			last_index = int(math.ceil(pkht_ul/lookup_resolution))
+			signal = np.arange(first_index,last_index+1)*lookup_resolution
+			self.lookup_tables[channel] = (first_index,_calibrationPolynomial(calib,signal),_calibrationPolynomial(calib_max,signal))
+
+
+	def _getVEDLookupTable(self, channel, rBC_density):
+		"""
+		get the VED for every peak height in a channel's lookup table, these are calculated the first time they are needed for each density
+		"""
+		if (channel,rBC_density) not in self.VED_lookup_tables:
+			with np.errstate(invalid='ignore'):
+				self.VED_lookup_tables[(channel,rBC_density)] = SP2_utilities.calculateVED(rBC_density,self.lookup_tables[channel][1])
+		return self.VED_lookup_tables[(channel,rBC_density)]
+
+
+	def _channelMass(self, channel, signal, rBC_density=None):
+		"""
+		get the mass, the mass with the calibration errors added, and the VED (if rBC_density is given) from one channel's signals, using the lookup table where possible
+		"""
+		pkht_ll, pkht_ul, calib, calib_max = self.channel_calibrations[channel]
+		rBC_mass = np.empty(signal.shape)
+		rBC_mass_max = np.empty(signal.shape)
+		VED = np.full(signal.shape,np.nan)
+
+		from_table = np.zeros(signal.shape,dtype=bool)
+		if self.lookup_tables is not None and channel in self.lookup_tables:
+			first_index, table_mass, table_mass_max = self.lookup_tables[channel]
+			with np.errstate(invalid='ignore'):
+				table_index = np.rint(signal/self.lookup_resolution)
+				#peak heights calculated from 16-bit signals are within a few rounding errors of the grid
+				on_grid = np.abs(signal-table_index*self.lookup_resolution) <= 1e-9
+				from_table = on_grid & (table_index >= first_index) & (table_index < first_index+len(table_mass))
+			table_index = table_index[from_table].astype(np.int64)-first_index
+
+			rBC_mass[from_table] = table_mass[table_index]
+			rBC_mass_max[from_table] = table_mass_max[table_index]
+			if rBC_density is not None:
+				VED[from_table] = self._getVEDLookupTable(channel,rBC_density)[table_index]
+
+		calculated = ~from_table
+		rBC_mass[calculated] = _calibrationPolynomial(calib,signal[calculated])
+		rBC_mass_max[calculated] = _calibrationPolynomial(calib_max,signal[calculated])
+		if rBC_density is not None:
+			with np.errstate(invalid='ignore'):
+				VED[calculated] = SP2_utilities.calculateVED(rBC_density,rBC_mass[calculated])
+
+		return rBC_mass, rBC_mass_max, VED
+
+
+	def _convert(self, BB_incand_HG, BB_incand_LG, rBC_density=None):
+		"""
+		get the mass, mass uncertainty, and VED (if rBC_density is given) for arrays of high and low gain peak heights
+		"""
+		BB_incand_HG = np.asarray(BB_incand_HG,dtype=np.float64)
+		BB_incand_LG = np.asarray(BB_incand_LG,dtype=np.float64)
+		HG_pkht_ll, HG_pkht_ul, HG_calib, HG_calib_max = self.channel_calibrations['BBHG_incand']
+		LG_pkht_ll, LG_pkht_ul, LG_calib, LG_calib_max = self.channel_calibrations['BBLG_incand']
+
+		with np.errstate(invalid='ignore'):
+			#particles with signals outside the detection limits get NaN for the mass (missing HG signals are treated as outside the limits)
+			outside_limits = np.isnan(BB_incand_HG)
+			if self.number_of_channels == 4:
+				outside_limits |= (BB_incand_HG <= HG_pkht_ll) | (BB_incand_HG >= HG_pkht_ul)
+			if self.number_of_channels == 8:
+				outside_limits |= (BB_incand_HG <= HG_pkht_ll) | (BB_incand_LG >= LG_pkht_ul)
+
+			#use the high gain channel if possible, otherwise the low gain channel
+			use_HG = BB_incand_HG < HG_pkht_ul
+
+		rBC_mass = np.full(BB_incand_HG.shape,np.nan)
+		rBC_mass_max = np.full(BB_incand_HG.shape,np.nan)
+		VED = np.full(BB_incand_HG.shape,np.nan)
+		for channel,signal,selected in [('BBHG_incand',BB_incand_HG,use_HG & ~outside_limits),('BBLG_incand',BB_incand_LG,~use_HG & ~outside_limits)]:
+			rBC_mass[selected], rBC_mass_max[selected], VED[selected] = self._channelMass(channel,signal[selected],rBC_density)
+
+		rBC_mass_uncertainty = (rBC_mass_max - rBC_mass)*1.
+
+		return rBC_mass, rBC_mass_uncertainty, VED
+
+
+	def calculateMass(self, BB_incand_HG, BB_incand_LG):
+		"""
+		Calculate the rBC mass and uncertainty for arrays of particles
+		
+		Parameters
+		----------
+		BB_incand_HG : numpy array
+			Broadband high-gain incandescence channel signal heights
+		BB_incand_LG : numpy array
+			Broadband low-gain incandescence channel signal heights
+
+		Returns
+		-------
+		rBC_mass, rBC_mass_uncertainty : numpy arrays, NaN for particles with signals outside the detection limits
+		"""
+		rBC_mass, rBC_mass_uncertainty, VED = self._convert(BB_incand_HG,BB_incand_LG)
+		return rBC_mass, rBC_mass_uncertainty
+
+
+	def calculateMassAndVED(self, BB_incand_HG, BB_incand_LG, rBC_density):
+		"""
+		Calculate the rBC mass, mass uncertainty and VED for arrays of particles.  With lookup tables the VEDs are also looked up.
+		
+		Parameters
+		----------
+		BB_incand_HG : numpy array
+			Broadband high-gain incandescence channel signal heights
+		BB_incand_LG : numpy array
+			Broadband low-gain incandescence channel signal heights
+		rBC_density : float
+			Density of rBC used to calculate the VED (see SP2_utilities.calculateVED)
+
+		Returns
+		-------
+		rBC_mass, rBC_mass_uncertainty, VED : numpy arrays, NaN for particles with signals outside the detection limits
+		"""
+		return self._convert(BB_incand_HG,BB_incand_LG,rBC_density)
+
+
 class TimeInterval(object,dbConnection):
 
 	"""
@@ -28,7 +272,19 @@ class TimeInterval(object,dbConnection):
 	def __init__(self,database_name,instr_location_ID, instr_ID, interval_start, interval_end):
 		dbConnection.__init__(self, database_name)
 		
+		self._initializeAttributes(instr_location_ID, instr_ID, interval_start, interval_end)
+
+		self.retrieveInstrInfo()				#get basic instrument info
+		self.retrieveSampleFactors()			#get all sample factors for this interval
+		self.retrieveCalibrationData()			#get HG and LG calibration info for this interval
+		self.retrieveHousekeepingLimits()		#get values for QC based on housekeeping parameters
 
+
+
+	def _initializeAttributes(self,instr_location_ID, instr_ID, interval_start, interval_end):
+		"""
+		Set the interval settings to their defaults and clear the stored results (shared with SP2_time_series.CachedTimeInterval)
+		"""
 		self.instr_location_ID 			= instr_location_ID 
 		self.instr_ID     				= instr_ID
 		self.interval_start 			= interval_start
@@ -41,16 +297,14 @@ class TimeInterval(object,dbConnection):
 		self.extrapolate_calibration 	= False
 		
 		self.calibration_ID = None
+		self.mass_calibration = None
 		self.assembled_interval_data = None
 		self.binned_data = None
+		self.bin_edges = None
+		self.bin_counts = None
+		self.bin_masses = None
 		self.interval_db_id = None
 
-		self.retrieveInstrInfo()				#get basic instrument info
-		self.retrieveSampleFactors()			#get all sample factors for this interval
-		self.retrieveCalibrationData()			#get HG and LG calibration info for this interval
-		self.retrieveHousekeepingLimits()		#get values for QC based on housekeeping parameters
-
-
 
 	def retrieveHousekeepingLimits(self):
 		self.db_cur.execute('''
@@ -125,35 +379,34 @@ class TimeInterval(object,dbConnection):
 			sample_factors = sample_factor_results
 
 		self.sample_factors = sample_factors
+		self.indexSampleFactors()
+
+
+	def indexSampleFactors(self):
+		"""
+		Store the sample factor periods as sorted, non-overlapping start, end, and value arrays so particles can be matched to them with a binary search (see SP2_utilities.findIntervals).
+		The periods are split at every period start and end, and where periods overlap the one listed first in self.sample_factors is used.
+		"""
+		sample_factors = np.array(self.sample_factors,dtype=np.float64).reshape(-1,3)
+		breakpoints = np.unique(sample_factors[:,0:2])
+		segment_starts = breakpoints[:-1]
+		segment_ends = breakpoints[1:]
+
+		segment_values = np.full(len(segment_starts),np.nan)
+		for sf_start,sf_end,sample_factor in sample_factors[::-1]:
+			segment_values[(segment_starts >= sf_start) & (segment_ends <= sf_end)] = sample_factor
+
+		has_sample_factor = ~np.isnan(segment_values)
+		self.sample_factor_starts = segment_starts[has_sample_factor]
+		self.sample_factor_ends = segment_ends[has_sample_factor]
+		self.sample_factor_values = segment_values[has_sample_factor]
 
 	
 	def retrieveCalibrationData(self):
 		
 		calibration_data = {}
 		for channel in ['BBHG_incand','BBLG_incand']:
-			self.db_cur.execute('''
-			SELECT 
-				0_term,
-				1_term,
-				2_term,
-				0_term_err,
-				1_term_err,
-				2_term_err,
-				calibration_material,
-				id	
-			FROM
-				sp2_calibrations
-			WHERE
-				instr_ID = %s
-				AND instr_location_ID = %s
-				AND calibrated_channel = %s
-				AND calibration_date <= %s
-				ORDER BY calibration_date DESC LIMIT 1
-				
-			''',
-			(self.instr_ID,self.instr_location_ID,channel,self.interval_start))
-
-			calib_coeffs = self.db_cur.fetchall()
+			calib_coeffs = self._retrieveCalibrationCoefficients(channel)
 			if calib_coeffs == []:
 				calib_coeffs_np = [[np.nan,np.nan,np.nan,np.nan,np.nan,np.nan,'nan',np.nan]]
 			else:
@@ -187,6 +440,36 @@ class TimeInterval(object,dbConnection):
 			calibration_data[channel] = [pkht_ll, pkht_ul, calib_0, calib_1, calib_2, calib_0_err, calib_1_err, calib_2_err]
 
 		self.calibration_info = calibration_data
+		self.mass_calibration = MassCalibration(calibration_data,self.number_of_channels)
+
+
+	def _retrieveCalibrationCoefficients(self,channel):
+		"""
+		get the most recent calibration coefficients for a channel at the start of this interval
+		"""
+		self.db_cur.execute('''
+		SELECT 
+			0_term,
+			1_term,
+			2_term,
+			0_term_err,
+			1_term_err,
+			2_term_err,
+			calibration_material,
+			id	
+		FROM
+			sp2_calibrations
+		WHERE
+			instr_ID = %s
+			AND instr_location_ID = %s
+			AND calibrated_channel = %s
+			AND calibration_date <= %s
+			ORDER BY calibration_date DESC LIMIT 1
+			
+		''',
+		(self.instr_ID,self.instr_location_ID,channel,self.interval_start))
+
+		return self.db_cur.fetchall()
 
 
 	def _retrieveCalibrationLimits(self,calib_ID):
@@ -214,11 +497,28 @@ class TimeInterval(object,dbConnection):
 		return pkht_ll, pkht_ul		
 
 	
-	def retrieveSingleParticleData(self):
+	def retrieveSingleParticleData(self,particle_store=None):
 		"""
 		Get the single particle data for this interval. Use housekeeping information to exclude periods of poor instrument performance .
+
+		Parameters
+		----------
+		particle_store : SP2_particle_store.ParticleStore
+			If given, the single particle data is read from this store instead of the database.  Housekeeping data is still read from the database.
 		"""
-		self.db_cur.execute('''
+		if particle_store is not None:
+			self.single_particle_data = self._retrieveStoredParticleData(particle_store)
+			return
+
+		self._executeSingleParticleQuery(self.db_cur)
+		self.single_particle_data = self.db_cur.fetchall()
+
+
+	def _executeSingleParticleQuery(self,cursor):
+		"""
+		run the query for the single particle data in this interval, excluding periods of poor instrument performance
+		"""
+		cursor.execute('''
 		SELECT 
 			sp.UNIX_UTC_ts_int_start,
 			sp.UNIX_UTC_ts_int_end,
@@ -238,8 +538,82 @@ class TimeInterval(object,dbConnection):
 			AND hk.sample_flow BETWEEN %s AND %s
 		''',
 		(self.interval_start,self.interval_end,self.yag_min,self.yag_max,self.sample_flow_min,self.sample_flow_max))
-		
-		self.single_particle_data = self.db_cur.fetchall()
+
+
+	def retrieveSingleParticleBatches(self,batch_size=100000):
+		"""
+		Get the single particle data for this interval in batches, without holding all of the data in memory.  
+		The rows are streamed from the server with an unbuffered cursor.  This is a generator.
+
+		Parameters
+		----------
+		batch_size : int
+			Number of particles in each batch
+
+		Returns
+		-------
+		NumPy structured arrays with the single_particle_dtype columns and up to batch_size rows
+		"""
+		cursor = self.db_connection.cursor(buffered=False)
+		rows = []
+		try:
+			self._executeSingleParticleQuery(cursor)
+			rows = cursor.fetchmany(batch_size)
+			while rows != []:
+				yield np.array(rows,dtype=single_particle_dtype)
+				rows = cursor.fetchmany(batch_size)
+		finally:
+			#any unread rows must be read before the connection can be used again
+			while rows != []:
+				rows = cursor.fetchmany(batch_size)
+			cursor.close()
+
+
+	def _retrieveStoredParticleData(self,particle_store):
+		"""
+		Get the single particle data for this interval from a ParticleStore and match each particle to its housekeeping interval.
+		Only the store partitions covering the interval are read, and the rows are returned in the same form as the database query.
+		"""
+		particle_data = particle_store.read(self.instr_ID,self.interval_start,self.interval_end,
+			['UNIX_UTC_ts_int_start','UNIX_UTC_ts_int_end','BB_incand_HG_pkht','BB_incand_LG_pkht','NB_incand_HG_pkht'])
+
+		self.db_cur.execute('''
+		SELECT 
+			UNIX_UTC_ts_int_start,
+			UNIX_UTC_ts_int_end,
+			sample_flow,
+			chamber_temp,
+			chamber_pressure
+		FROM
+			sp2_hk_data
+		WHERE
+			instr_ID = %s
+			AND UNIX_UTC_ts_int_end > %s
+			AND UNIX_UTC_ts_int_start <= %s
+			AND yag_power BETWEEN %s AND %s
+			AND sample_flow BETWEEN %s AND %s
+		ORDER BY UNIX_UTC_ts_int_start
+		''',
+		(self.instr_ID,self.interval_start,self.interval_end,self.yag_min,self.yag_max,self.sample_flow_min,self.sample_flow_max))
+		hk_data = np.array(self.db_cur.fetchall(),dtype=np.float64).reshape(-1,5)
+
+		#each particle belongs to the housekeeping interval containing its end time (as for the hk_id key set by SP2_housekeeping.addHKKeysToRawDataTable)
+		hk_index = SP2_utilities.findIntervals(hk_data[:,0],hk_data[:,1],particle_data['UNIX_UTC_ts_int_end'])
+		in_hk_interval = hk_index >= 0
+		hk_data = hk_data[hk_index[in_hk_interval]]
+
+		single_particle_data = zip(
+			particle_data['UNIX_UTC_ts_int_start'][in_hk_interval].tolist(),
+			particle_data['UNIX_UTC_ts_int_end'][in_hk_interval].tolist(),
+			particle_data['BB_incand_HG_pkht'][in_hk_interval].tolist(),
+			particle_data['BB_incand_LG_pkht'][in_hk_interval].tolist(),
+			hk_data[:,2].tolist(),
+			particle_data['NB_incand_HG_pkht'][in_hk_interval].tolist(),
+			hk_data[:,3].tolist(),
+			hk_data[:,4].tolist(),
+			)
+
+		return single_particle_data
 		
 	
 	def getParticleSampleFactor(self,ind_end_time):
@@ -252,98 +626,198 @@ class TimeInterval(object,dbConnection):
 			Time at which the particle record was written to file
 		"""
 		if len(self.sample_factors) == 1:
-			sample_factor = self.sample_factors[0][2]
-		else:
-			for row in self.sample_factors:
-				sf_start = row[0]
-				sf_end   = row[1]
-				if sf_start <= ind_end_time < sf_end:
-					sample_factor = row[2]
-					break
+			return self.sample_factors[0][2]
+
+		return self.getParticleSampleFactors(np.array([ind_end_time],dtype=np.float64))[0]
+
+
+	def getParticleSampleFactors(self,ind_end_times):
+		"""
+		Get the sample factor for an array of particles (see getParticleSampleFactor).  Particles outside all of the sample factor periods get NaN.
+		
+		Parameters
+		----------
+		ind_end_times : numpy array 
+			Times at which the particle records were written to file
+		"""
+		if len(self.sample_factors) == 1:
+			return np.full(len(ind_end_times),self.sample_factors[0][2],dtype=np.float64)
+
+		period_index = SP2_utilities.findIntervals(self.sample_factor_starts,self.sample_factor_ends,ind_end_times)
+		sample_factors = np.full(len(period_index),np.nan)
+		in_period = period_index >= 0
+		sample_factors[in_period] = self.sample_factor_values[period_index[in_period]]
 
-		return sample_factor
+		return sample_factors
 
 
+	def getSingleParticleArray(self):
+		"""
+		Get the single particle data for this interval as a NumPy structured array with the single_particle_dtype columns
+		"""
+		if isinstance(self.single_particle_data,np.ndarray):
+			return self.single_particle_data
+		return np.array(list(self.single_particle_data),dtype=single_particle_dtype)
+
+
+	def _assembleParticleArrays(self,particle_data):
+		"""
+		Calculate the sampled volume and the rBC mass, mass uncertainty, and VED of the particles within the VED limits for an array of single particle data.
+		Particles without the housekeeping data needed for a volume are ignored, as are particles outside all of the sample factor periods (the number of these is also returned).
+		"""
+		ind_start_time 	= particle_data['UNIX_UTC_ts_int_start'] 	#UNIX UTC timestamp
+		ind_end_time 	= particle_data['UNIX_UTC_ts_int_end']		#UNIX UTC timestamp
+		sample_flow 	= particle_data['sample_flow']  			#in vccm
+		chamber_temp 	= particle_data['chamber_temp']+273.15 		#in deg C -> K
+		chamber_pressure= particle_data['chamber_pressure']  		#in Pa
+		particle_interval = ind_end_time-ind_start_time
+
+		#ignore particles if we can't calculate a volume, and particles with a huge sample interval (this arises when the SP2 was set to sample only from 1 of every x minutes)
+		keep = ~np.isnan(sample_flow) & ~np.isnan(chamber_temp) & ~np.isnan(chamber_pressure) & ~(particle_interval > self.interval_max) & ~(particle_interval < 0)
+
+		#particles outside all of the sample factor periods have no sample factor, so these are ignored too and counted
+		all_sample_factors = np.full(len(keep),np.nan)
+		all_sample_factors[keep] = self.getParticleSampleFactors(ind_end_time[keep])
+		no_sample_factor = keep & np.isnan(all_sample_factors)
+		keep &= ~no_sample_factor
+
+		sample_factor = all_sample_factors[keep]
+		STP_correction_factor = (chamber_pressure[keep]/101325)*(273.15/chamber_temp[keep])
+		particle_sample_vol = sample_flow[keep]*particle_interval[keep]*STP_correction_factor/(60*sample_factor)   #factor of 60 needed because flow is in sccm and time is in seconds
+
+		rBC_mass,rBC_mass_uncertainty,VED = self.getMassCalibration().calculateMassAndVED(particle_data['BB_incand_HG_pkht'][keep],particle_data['BB_incand_LG_pkht'][keep],self.rBC_density)
+		with np.errstate(invalid='ignore'):
+			#we limit mass and number concentrations to within the set size limits
+			in_VED_limits = (self.min_VED <= VED) & (VED <= self.max_VED)
+
+		return np.sum(particle_sample_vol),rBC_mass[in_VED_limits],rBC_mass_uncertainty[in_VED_limits],VED[in_VED_limits],np.count_nonzero(no_sample_factor)
+
 
 	#Interval methods	
 	def assembleIntervalData(self):
 		"""
 		Assemble the interval data.  
-		This is stored as a dictionary with: the total interval rBC mass, the uncertainty in total rBC mass, rBC particle number, total sampled volume, and a list of the diameters of detected particles.
+		This is stored as a dictionary with: the total interval rBC mass, the uncertainty in total rBC mass, rBC particle number, total sampled volume, a list of the diameters of detected particles, 
+		and the number of particles ignored because they are outside all of the sample factor periods.
 		"""
 		interval_data_dict = {}
-		interval_sampled_volume = 0
-		interval_mass = 0
-		interval_mass_uncertainty = 0
-		ved_list = []
-
-		for row in self.single_particle_data:
-			ind_start_time 	= row[0] 	#UNIX UTC timestamp
-			ind_end_time 	= row[1]	#UNIX UTC timestamp
-			BB_incand_HG 	= row[2]  	#in arbitrary units
-			BB_incand_LG 	= row[3]  	#in arbitrary units
-			sample_flow 	= row[4]  	#in vccm
-			chamber_temp 	= row[6]+273.15 	#in deg C -> K
-			chamber_pressure= row[7]  			#in Pa
-			
-			if sample_flow == None: #ignore particles if we can't calculate a volume
-				continue
-			if (ind_end_time-ind_start_time) > self.interval_max  or (ind_end_time-ind_start_time) < 0:  #ignore particles with a huge sample interval (this arises when the SP2 was set to sample only from 1 of every x minutes)
-				continue
-			
-			#get appropriate sample factor
-			sample_factor = self.getParticleSampleFactor(ind_end_time)
-			STP_correction_factor = (chamber_pressure/101325)*(273.15/chamber_temp) 
-
-			particle_sample_vol =  sample_flow*(ind_end_time-ind_start_time)*STP_correction_factor/(60*sample_factor)   #factor of 60 needed because flow is in sccm and time is in seconds
-			interval_sampled_volume += particle_sample_vol
 
-			rBC_mass,rBC_mass_uncertainty = self.calculateMass(BB_incand_HG,BB_incand_LG,ind_end_time)
-			VED = SP2_utilities.calculateVED(self.rBC_density,rBC_mass)
+		interval_sampled_volume,rBC_mass,rBC_mass_uncertainty,VED,no_sample_factor_number = self._assembleParticleArrays(self.getSingleParticleArray())
 
-			if self.min_VED <= VED <= self.max_VED:  #we limit mass and number concentrations to within the set size limits
-				interval_mass += rBC_mass
-				interval_mass_uncertainty += rBC_mass_uncertainty
-				ved_list.append(VED)
-				
-		interval_data_dict['VED list'] = ved_list
-		interval_data_dict['total mass'] = interval_mass
-		interval_data_dict['total number'] = len(ved_list)
-		interval_data_dict['total mass uncertainty'] = interval_mass_uncertainty
+		interval_data_dict['VED list'] = VED.tolist()
+		interval_data_dict['total mass'] = np.sum(rBC_mass)
+		interval_data_dict['total number'] = len(VED)
+		interval_data_dict['total mass uncertainty'] = np.sum(rBC_mass_uncertainty)
 		interval_data_dict['sampled volume'] = interval_sampled_volume
+		interval_data_dict['particles without sample factor'] = no_sample_factor_number
 
 		self.assembled_interval_data = interval_data_dict
 
 
+	def assembleIntervalDataInBatches(self,binning_increment,batch_size=100000):
+		"""
+		Assemble and bin the interval data from batches of single particle data streamed from the database (see retrieveSingleParticleBatches), so memory use does not depend on the length of the interval.
+		The totals, sampled volume and VED histogram are accumulated batch by batch.  
+		The results are stored as by assembleIntervalData and binAssembledData, except that assembled_interval_data has no list of particle diameters.
+		
+		Parameters
+		----------
+		binning_increment : int 
+			bin width
+		batch_size : int
+			Number of particles in each batch
+
+		Returns
+		-------
+		bin_edges, bin_counts, bin_masses : numpy arrays, as returned by binAssembledData
+		"""
+		self.binning_increment = binning_increment
+		bin_edges = self._getBinEdges()
+		bin_counts = np.zeros(len(bin_edges)-1,dtype=np.int64)
+		bin_masses = np.zeros(len(bin_edges)-1)
+
+		interval_data_dict = {
+			'total mass': 0.,
+			'total number': 0,
+			'total mass uncertainty': 0.,
+			'sampled volume': 0.,
+			'particles without sample factor': 0,
+			}
+
+		for particle_data in self.retrieveSingleParticleBatches(batch_size):
+			batch_sampled_volume,rBC_mass,rBC_mass_uncertainty,VED,no_sample_factor_number = self._assembleParticleArrays(particle_data)
+			interval_data_dict['total mass'] += np.sum(rBC_mass)
+			interval_data_dict['total number'] += len(VED)
+			interval_data_dict['total mass uncertainty'] += np.sum(rBC_mass_uncertainty)
+			interval_data_dict['sampled volume'] += batch_sampled_volume
+			interval_data_dict['particles without sample factor'] += no_sample_factor_number
+
+			batch_counts,batch_masses = self._binVEDs(VED,bin_edges)
+			bin_counts += batch_counts
+			bin_masses += batch_masses
+
+		self.assembled_interval_data = interval_data_dict
+		self.bin_edges = bin_edges
+		self.bin_counts = bin_counts
+		self.bin_masses = bin_masses
+		self.binned_data = self.makeBinDict(bin_edges,bin_counts,bin_masses)
+
+		return bin_edges,bin_counts,bin_masses
+
+
 	#Binned data methods
 	def binAssembledData(self,binning_increment):
 		"""
 		Bin the assembled interval data.
+		The binned data is also stored as a dictionary (see makeBinDict) in self.binned_data.
 		
 		Parameters
 		----------
 		binning_increment : int 
 			bin width
+
+		Returns
+		-------
+		bin_edges, bin_counts, bin_masses : numpy arrays of the bin edges (one more than the number of bins), the number of particles in each bin, and the total rBC mass in each bin
 		"""
-		raw_dia_list = self.assembled_interval_data['VED list']
-		total_vol_sccm = self.assembled_interval_data['sampled volume']
+		VED = np.asarray(self.assembled_interval_data['VED list'],dtype=np.float64)
 		self.binning_increment = binning_increment
-		
-		bin_dict = self.makeBinDict()
 
-		for dia in raw_dia_list:
-			for point in bin_dict:
-				LL_bin = bin_dict[point][0]
-				UL_bin = bin_dict[point][1]
+		bin_edges = self._getBinEdges()
+		bin_counts,bin_masses = self._binVEDs(VED,bin_edges)
 
-				if (LL_bin <= dia < UL_bin):
-					mass = SP2_utilities.calculateMass(self.rBC_density,dia)	
-					bin_dict[point][2] += mass
-					bin_dict[point][3] += 1
-	
-		self.binned_data = bin_dict
+		self.bin_edges = bin_edges
+		self.bin_counts = bin_counts
+		self.bin_masses = bin_masses
+		self.binned_data = self.makeBinDict(bin_edges,bin_counts,bin_masses)
+
+		return bin_edges,bin_counts,bin_masses
 	
 
+	def _getBinEdges(self):
+		"""
+		get the bin edges for the VED limits and binning increment (the bins of makeBinDict, plus the upper limit of the last bin)
+		"""
+		return np.arange(self.min_VED,(self.max_VED+2*self.binning_increment),self.binning_increment)
+
+
+	def _binVEDs(self,VED,bin_edges):
+		"""
+		get the number and total rBC mass of particles in each bin
+		"""
+		number_of_bins = len(bin_edges)-1
+
+		#each particle goes in the bin with LL_bin <= VED < UL_bin, particles outside all bins are dropped
+		bin_index = np.digitize(VED,bin_edges)-1
+		in_bins = (bin_index >= 0) & (bin_index < number_of_bins)
+		bin_index = bin_index[in_bins]
+
+		bin_counts = np.bincount(bin_index,minlength=number_of_bins)
+		bin_masses = np.bincount(bin_index,weights=SP2_utilities.calculateMass(self.rBC_density,VED[in_bins]),minlength=number_of_bins)
+
+		return bin_counts,bin_masses
+
+
 	def lognormFit(self,bin_midpoints,bin_values):
 		"""
 		Fit a single lognormal function to the binned data.
@@ -387,13 +861,20 @@ class TimeInterval(object,dbConnection):
 
 
 
-	def makeBinDict(self):
+	def makeBinDict(self,bin_edges=None,bin_counts=None,bin_masses=None):
 		"""
-		Make the binning dictionary
+		Make the binning dictionary.  Each bin is keyed by its lower limit and holds [lower limit, upper limit, mass, number].
+		If no binned arrays are given the bins are empty.
 		"""
 		new_dict = {}
-		for bin in range(self.min_VED,(self.max_VED+self.binning_increment),self.binning_increment):
-			new_dict[bin] = [bin,(bin+self.binning_increment),0,0]
+		if bin_edges is None:
+			for bin in range(self.min_VED,(self.max_VED+self.binning_increment),self.binning_increment):
+				new_dict[bin] = [bin,(bin+self.binning_increment),0,0]
+			return new_dict
+
+		bin_edges, bin_counts, bin_masses = np.asarray(bin_edges).tolist(), np.asarray(bin_counts).tolist(), np.asarray(bin_masses).tolist()
+		for i in range(len(bin_edges)-1):
+			new_dict[bin_edges[i]] = [bin_edges[i],bin_edges[i+1],bin_masses[i],bin_counts[i]]
 		return new_dict
 
 
@@ -443,5 +924,18 @@ class TimeInterval(object,dbConnection):
 		return rBC_mass,rBC_mass_uncertainty
 
 
+	def calculateMassArray(self,BB_incand_HG,BB_incand_LG):
+		"""
+		Calculate the mass and uncertainty for rBC in arrays of particles (see calculateMass and MassCalibration)
+		"""
+		return self.getMassCalibration().calculateMass(BB_incand_HG,BB_incand_LG)
 
 
+	def getMassCalibration(self):
+		"""
+		Get the MassCalibration for this interval.  This is made by retrieveCalibrationData, or from calibration_info the first time it is needed if calibration_info was set directly.
+		Call makeLookupTables on it to convert peak heights with lookup tables.
+		"""
+		if self.mass_calibration is None:
+			self.mass_calibration = MassCalibration(self.calibration_info,self.number_of_channels)
+		return self.mass_calibration
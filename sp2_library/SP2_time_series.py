@@ -0,0 +1,449 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+import numpy as np
+from datetime import datetime
+from datetime import date
+from SP2_time_interval import TimeInterval, single_particle_dtype
+from mysql_db_connection import dbConnection, getConnection
+
+"""
+This module has classes for producing a time series of SP2 interval data from a single database connection
+"""
+
+#single particle data for a time series, with the housekeeping yag power used to filter the particles in each interval
+series_particle_dtype = np.dtype(single_particle_dtype.descr + [('yag_power','f8')])
+
+
+def _isOnOrBefore(calibration_date,UNIX_ts):
+	"""
+	compare a calibration date from the database (a date, datetime or UNIX timestamp) to a UNIX UTC timestamp
+	"""
+	if isinstance(calibration_date,datetime):
+		return calibration_date <= datetime.utcfromtimestamp(UNIX_ts)
+	if isinstance(calibration_date,date):
+		return calibration_date <= datetime.utcfromtimestamp(UNIX_ts).date()
+	return calibration_date <= UNIX_ts
+
+
+class TimeSeriesProcessor(object,dbConnection):
+
+	"""
+
+	This class produces the interval data for a series of consecutive time intervals.
+	It retrieves the single particle data for the whole series with one query, and the instrument, sample factor, calibration, and housekeeping limit information once.
+	The single particle rows are streamed in time order on a second connection, and each interval takes the rows up to its end as it is processed, 
+	so only about one interval of particles is held in memory.  The intervals must be processed in time order (as processIntervals does).
+	Each interval is a CachedTimeInterval built from this information, so it makes no database queries of its own.
+
+	"""
+
+	def __init__(self,database_name,instr_location_ID,instr_ID,series_start,series_end,step):
+
+		"""
+		Parameters
+		----------
+		database_name : string
+			Name of the database
+		instr_location_ID : int
+			Instrument location ID
+		instr_ID : int
+			Instrument ID
+		series_start : float
+			Start of the first interval (UNIX UTC timestamp)
+		series_end : float
+			End of the last interval (UNIX UTC timestamp)
+		step : float
+			Interval length in seconds
+		"""
+
+		dbConnection.__init__(self, database_name)
+
+		self.database_name 				= database_name
+		self.instr_location_ID 			= instr_location_ID
+		self.instr_ID 					= instr_ID
+		self.series_start 				= series_start
+		self.series_end 				= series_end
+		self.step 						= step
+		self.rBC_density 				= 1.8 		#g/mol - Bond and Bergstrom 2006
+		self.interval_max				= 500.   	#maximum time between particles (in sec)
+		self.extrapolate_calibration 	= False
+		self.particle_fetch_size 		= 100000 	#number of single particle rows fetched from the server at a time
+
+		self.calibration_limits = {}
+
+		self.retrieveInstrInfo()
+		self.retrieveSampleFactors()
+		self.retrieveCalibrations()
+		self.retrieveHousekeepingLimits()
+		self.retrieveSingleParticleData()
+
+
+	def retrieveInstrInfo(self):
+		self.db_cur.execute('''
+		SELECT
+			number_of_channels,
+			min_detectable_signal,
+			saturation_limit
+		FROM
+			sp2_instrument_info
+		WHERE
+			id = %s
+			AND id > %s
+		LIMIT 1
+		''',
+		(self.instr_ID,0))
+
+		self.instr_info = self.db_cur.fetchall()
+
+
+	def retrieveSampleFactors(self):
+		"""
+		Get all the sample factor periods that overlap the series
+		"""
+		self.db_cur.execute('''
+		SELECT
+			UNIX_UTC_ts_int_start,
+			UNIX_UTC_ts_int_end,
+			1_in_x_particles
+		FROM
+			sp2_config_parameters
+		WHERE
+			UNIX_UTC_ts_int_start <= %s
+			AND UNIX_UTC_ts_int_end > %s
+			AND instr_location_ID = %s
+			AND instr_ID = %s
+		''',
+		(self.series_end,self.series_start,self.instr_location_ID,self.instr_ID))
+
+		self.sample_factor_rows = self.db_cur.fetchall()
+
+
+	def retrieveCalibrations(self):
+		"""
+		Get all the calibrations that may apply to an interval in the series, newest first
+		"""
+		self.calibration_rows = {}
+		for channel in ['BBHG_incand','BBLG_incand']:
+			self.db_cur.execute('''
+			SELECT
+				0_term,
+				1_term,
+				2_term,
+				0_term_err,
+				1_term_err,
+				2_term_err,
+				calibration_material,
+				id,
+				calibration_date
+			FROM
+				sp2_calibrations
+			WHERE
+				instr_ID = %s
+				AND instr_location_ID = %s
+				AND calibrated_channel = %s
+				AND calibration_date <= %s
+				ORDER BY calibration_date DESC
+			''',
+			(self.instr_ID,self.instr_location_ID,channel,self.series_end))
+
+			self.calibration_rows[channel] = self.db_cur.fetchall()
+
+
+	def retrieveHousekeepingLimits(self):
+		"""
+		Get all the housekeeping limit periods that overlap the series
+		"""
+		self.db_cur.execute('''
+		SELECT
+			UNIX_UTC_ts_int_start,
+			UNIX_UTC_ts_int_end,
+			yag_min,
+			yag_max,
+			sample_flow_min,
+			sample_flow_max
+		FROM
+			sp2_hk_limits
+		WHERE
+			instr_ID = %s
+			AND instr_location_ID = %s
+			AND UNIX_UTC_ts_int_start <= %s
+			AND UNIX_UTC_ts_int_end > %s
+		''',
+		(self.instr_ID, self.instr_location_ID,self.series_end,self.series_start))
+
+		self.hk_limit_rows = self.db_cur.fetchall()
+
+
+	def retrieveSingleParticleData(self):
+		"""
+		Start streaming the single particle data for the whole series, in time order, with an unbuffered cursor on its own connection 
+		(so the other queries can still be made while rows are unread).  The rows are read by getSingleParticleData.  
+		The housekeeping limits are applied to each interval separately.
+		"""
+		self.closeSingleParticleStream()
+		self.particle_connection = getConnection(self.database_name)
+		self.particle_cursor = self.particle_connection.cursor(buffered=False)
+		self.particle_cursor.execute('''
+		SELECT
+			sp.UNIX_UTC_ts_int_start,
+			sp.UNIX_UTC_ts_int_end,
+			sp.BB_incand_HG_pkht,
+			sp.BB_incand_LG_pkht,
+			hk.sample_flow,
+			sp.NB_incand_HG_pkht,
+			hk.chamber_temp,
+			hk.chamber_pressure,
+			hk.yag_power
+		FROM
+			sp2_single_particle_data sp
+				JOIN
+			sp2_hk_data hk ON sp.HK_id = hk.id
+		WHERE
+			sp.UNIX_UTC_ts_int_end BETWEEN %s AND %s
+		ORDER BY sp.UNIX_UTC_ts_int_end
+		''',
+		(self.series_start,self.series_end))
+
+		self.single_particle_data = np.array([],dtype=series_particle_dtype)
+		self.streamed_interval_start = self.series_start
+
+
+	def _fetchSingleParticleRows(self):
+		"""
+		read the next block of particle rows from the stream into single_particle_data.  Returns False once the stream is exhausted (and closed).
+		"""
+		if getattr(self,'particle_cursor',None) is None:
+			return False
+
+		rows = self.particle_cursor.fetchmany(self.particle_fetch_size)
+		if rows == []:
+			self.closeSingleParticleStream()
+			return False
+
+		self.single_particle_data = np.concatenate([self.single_particle_data,np.array(rows,dtype=series_particle_dtype)])
+		return True
+
+
+	def closeSingleParticleStream(self):
+		"""
+		Stop streaming the single particle data and return its connection to the pool.  Any unread rows are read first, as the connection can't be used again until they are.
+		"""
+		if getattr(self,'particle_cursor',None) is not None:
+			rows = self.particle_cursor.fetchmany(self.particle_fetch_size)
+			while rows != []:
+				rows = self.particle_cursor.fetchmany(self.particle_fetch_size)
+			self.particle_cursor.close()
+			self.particle_cursor = None
+		if getattr(self,'particle_connection',None) is not None:
+			self.particle_connection.close()
+			self.particle_connection = None
+
+
+	def close(self):
+		self.closeSingleParticleStream()
+		dbConnection.close(self)
+
+
+	def getSampleFactors(self,interval_start,interval_end):
+		"""
+		Get the sample factor periods for an interval (the rows TimeInterval.retrieveSampleFactors would retrieve)
+		"""
+		return [row for row in self.sample_factor_rows if row[0] <= interval_start and row[1] > interval_end]
+
+
+	def getCalibrationCoefficients(self,channel,interval_start):
+		"""
+		Get the most recent calibration for a channel at the start of an interval (the rows TimeInterval._retrieveCalibrationCoefficients would retrieve)
+		"""
+		for row in self.calibration_rows[channel]:
+			if _isOnOrBefore(row[8],interval_start):
+				return [row[0:8]]
+		return []
+
+
+	def getCalibrationLimits(self,calib_ID):
+		"""
+		Get the signal limits of a calibration, these are retrieved from the database once per calibration
+		"""
+		if np.isnan(calib_ID):
+			return np.nan, np.nan
+
+		if calib_ID not in self.calibration_limits:
+			self.db_cur.execute('''
+			SELECT
+				min(incand_pk_ht),
+				max(incand_pk_ht)
+			FROM
+				sp2_calibration_points
+			WHERE
+				calibration_ID = %s
+				and id >= %s
+			LIMIT 1
+			''',
+			(float(calib_ID),0))
+			calib_points = self.db_cur.fetchall()
+
+			self.calibration_limits[calib_ID] = (calib_points[0][0], calib_points[0][1])
+
+		return self.calibration_limits[calib_ID]
+
+
+	def getHousekeepingLimits(self,interval_start,interval_end):
+		"""
+		Get the housekeeping limits for an interval (the rows TimeInterval.retrieveHousekeepingLimits would retrieve)
+		"""
+		return [row[2:6] for row in self.hk_limit_rows if row[0] <= interval_start and row[1] > interval_end][0:1]
+
+
+	def getSingleParticleData(self,interval_start,interval_end,yag_min,yag_max,sample_flow_min,sample_flow_max):
+		"""
+		Get the single particle data for an interval, excluding particles from periods of poor instrument performance.  
+		Rows are read from the stream until one ends after interval_end, and rows that end before interval_start are dropped, 
+		so intervals must be requested in time order.
+		"""
+		if interval_start < self.streamed_interval_start:
+			raise ValueError('the single particle data before ' + str(self.streamed_interval_start) + ' has already been dropped, intervals must be requested in time order')
+		self.streamed_interval_start = interval_start
+
+		event_times = self.single_particle_data['UNIX_UTC_ts_int_end']
+		self.single_particle_data = self.single_particle_data[np.searchsorted(event_times,interval_start,side='left'):]
+		while (len(self.single_particle_data) == 0 or self.single_particle_data['UNIX_UTC_ts_int_end'][-1] <= interval_end) and self._fetchSingleParticleRows():
+			self.single_particle_data = self.single_particle_data[np.searchsorted(self.single_particle_data['UNIX_UTC_ts_int_end'],interval_start,side='left'):]
+
+		#the rows at interval_end are kept, they also belong to the next interval
+		particle_data = self.single_particle_data[:np.searchsorted(self.single_particle_data['UNIX_UTC_ts_int_end'],interval_end,side='right')]
+
+		#NULL housekeeping values and limits are NaNs here, and fail these comparisons as they do in the database query
+		yag_min, yag_max, sample_flow_min, sample_flow_max = [np.float64(limit) for limit in [yag_min,yag_max,sample_flow_min,sample_flow_max]]
+		with np.errstate(invalid='ignore'):
+			hk_limits_ok = ((particle_data['yag_power'] >= yag_min) & (particle_data['yag_power'] <= yag_max)
+				& (particle_data['sample_flow'] >= sample_flow_min) & (particle_data['sample_flow'] <= sample_flow_max))
+
+		return particle_data[hk_limits_ok]
+
+
+	def getIntervalLimits(self):
+		"""
+		Get the (start, end) of each interval in the series, the last interval ends at the end of the series
+		"""
+		interval_limits = []
+		interval_start = self.series_start
+		while interval_start < self.series_end:
+			interval_end = min(interval_start+self.step,self.series_end)
+			interval_limits.append((interval_start,interval_end))
+			interval_start = interval_end
+
+		return interval_limits
+
+
+	def processIntervals(self,binning_increment=None):
+		"""
+		Assemble the data for each interval in the series.  This is a generator, each interval is returned as soon as it has been assembled.
+
+		Parameters
+		----------
+		binning_increment : int
+			If given, the assembled data for each interval is also binned with this bin width
+
+		Returns
+		-------
+		CachedTimeInterval objects with their assembled_interval_data (and binned_data) set
+		"""
+		for interval_start,interval_end in self.getIntervalLimits():
+			interval = CachedTimeInterval(self,interval_start,interval_end)
+			interval.retrieveSingleParticleData()
+			interval.setBinningLimits()
+			interval.assembleIntervalData()
+			if binning_increment is not None:
+				interval.binAssembledData(binning_increment)
+
+			yield interval
+
+
+
+class CachedTimeInterval(TimeInterval):
+
+	"""
+
+	A TimeInterval that gets its instrument, sample factor, calibration, housekeeping, and single particle data from a TimeSeriesProcessor instead of the database.
+
+	"""
+
+	def __init__(self,time_series,interval_start,interval_end):
+		self.time_series = time_series
+		self.db_cur = time_series.db_cur
+
+		self._initializeAttributes(time_series.instr_location_ID, time_series.instr_ID, interval_start, interval_end)
+		self.rBC_density 				= time_series.rBC_density
+		self.interval_max				= time_series.interval_max
+		self.extrapolate_calibration 	= time_series.extrapolate_calibration
+
+		self.retrieveInstrInfo()
+		self.retrieveSampleFactors()
+		self.retrieveCalibrationData()
+		self.retrieveHousekeepingLimits()
+
+
+	def __del__(self):
+		#the connection and cursor belong to the TimeSeriesProcessor
+		pass
+
+
+	def retrieveHousekeepingLimits(self):
+		hk_limits = self.time_series.getHousekeepingLimits(self.interval_start,self.interval_end)
+
+		self.yag_min 		 = hk_limits[0][0]
+		self.yag_max 		 = hk_limits[0][1]
+		self.sample_flow_min = hk_limits[0][2]
+		self.sample_flow_max = hk_limits[0][3]
+
+
+	def retrieveInstrInfo(self):
+		instr_info = self.time_series.instr_info
+
+		self.number_of_channels 	= instr_info[0][0]
+		self.min_detectable_signal 	= instr_info[0][1]
+		self.saturation_limit 		= instr_info[0][2]
+
+
+	def retrieveSampleFactors(self):
+
+		#set default
+		sample_factors = [(self.interval_start,self.interval_end,1)]
+
+		sample_factor_results = self.time_series.getSampleFactors(self.interval_start,self.interval_end)
+
+		#if no results, then use the default value
+		if sample_factor_results != []:
+			sample_factors = sample_factor_results
+
+		self.sample_factors = sample_factors
+		self.indexSampleFactors()
+
+
+	def _retrieveCalibrationCoefficients(self,channel):
+		return self.time_series.getCalibrationCoefficients(channel,self.interval_start)
+
+
+	def _retrieveCalibrationLimits(self,calib_ID):
+		return self.time_series.getCalibrationLimits(calib_ID)
+
+
+	def retrieveSingleParticleData(self,particle_store=None):
+		"""
+		Get the single particle data for this interval from the TimeSeriesProcessor (or from a ParticleStore, see TimeInterval.retrieveSingleParticleData)
+		"""
+		if particle_store is not None:
+			TimeInterval.retrieveSingleParticleData(self,particle_store)
+			return
+
+		self.single_particle_data = self.time_series.getSingleParticleData(self.interval_start,self.interval_end,self.yag_min,self.yag_max,self.sample_flow_min,self.sample_flow_max)
+
+
+	def retrieveSingleParticleBatches(self,batch_size=100000):
+		"""
+		Get the single particle data for this interval from the TimeSeriesProcessor in batches (see TimeInterval.retrieveSingleParticleBatches)
+		"""
+		particle_data = self.time_series.getSingleParticleData(self.interval_start,self.interval_end,self.yag_min,self.yag_max,self.sample_flow_min,self.sample_flow_max)
+		for batch_start in range(0,len(particle_data),batch_size):
+			yield particle_data[batch_start:batch_start+batch_size]
@@ -7,6 +7,7 @@ from pprint import pprint
 from datetime import datetime
 from datetime import timedelta
 import mysql.connector
+from mysql_db_connection import dbSession
 import math
 import calendar
 import os.path
@@ -58,7 +59,84 @@ def generateInitialValues(arg_number,initial_values):
 
 
 
+#the polynomial models are linear in their coefficients, so fitFunction fits them directly with fitPolynomial
+polynomial_degrees = {
+	linear:1,
+	quadratic:2,
+	polynomial3:3,
+	polynomial4:4,
+	polynomial5:5,
+	}
+
+
+def fitPolynomial(x_vals,y_vals,degree,sigma=None):
+	"""
+	Fit a polynomial by linear least squares on its Vandermonde matrix, with the columns scaled to unit length and solved by SVD to keep high degree fits well conditioned.
+	The covariance is calculated as by curve_fit (with absolute_sigma=False): inv(A^T A) scaled by the residual variance SSR/(n-p).
+
+	Parameters
+	----------
+	x_vals : list or numpy array
+		x values
+	y_vals : list or numpy array
+		y values
+	degree : int
+		Degree of the polynomial
+	sigma : list or numpy array
+		Uncertainty of each y value, used to weight the fit.  If None, all points have the same weight.
+
+	Returns
+	-------
+	popt, pcov : numpy arrays of the coefficients (lowest order first, as for linear, quadratic, etc.) and their covariance.  
+	With fewer points than coefficients everything is NaN, and with no degrees of freedom left (or a singular fit) the covariance is infinite.
+	"""
+	x_vals = np.asarray(x_vals,dtype=np.float64)
+	y_vals = np.asarray(y_vals,dtype=np.float64)
+	number_of_points = len(x_vals)
+	number_of_coefficients = degree+1
+
+	if number_of_points < number_of_coefficients:
+		return np.full(number_of_coefficients,np.nan),np.full((number_of_coefficients,number_of_coefficients),np.nan)
+
+	vandermonde = np.vander(x_vals,number_of_coefficients,increasing=True)
+	if sigma is not None:
+		weights = 1./np.asarray(sigma,dtype=np.float64)
+		vandermonde = vandermonde*weights[:,np.newaxis]
+		y_vals = y_vals*weights
+
+	column_scale = np.sqrt(np.sum(vandermonde*vandermonde,axis=0))
+	column_scale[column_scale == 0] = 1.
+	U,singular_values,Vt = np.linalg.svd(vandermonde/column_scale,full_matrices=False)
+
+	singular = singular_values <= np.finfo(np.float64).eps*max(vandermonde.shape)*singular_values[0]
+	inverse_singular_values = np.where(singular,0.,1./np.where(singular,1.,singular_values))
+	popt = np.dot(Vt.T,inverse_singular_values*np.dot(U.T,y_vals))/column_scale
+
+	if number_of_points == number_of_coefficients or np.any(singular):
+		return popt,np.full((number_of_coefficients,number_of_coefficients),np.inf)
+
+	residuals = y_vals-np.dot(vandermonde,popt)
+	residual_variance = np.sum(residuals*residuals)/(number_of_points-number_of_coefficients)
+	pcov = np.dot(Vt.T*inverse_singular_values**2,Vt)/np.outer(column_scale,column_scale)*residual_variance
+
+	return popt,pcov
+
+
 def fitFunction(function,x_vals,y_vals,**initial_values):
+	"""
+	Fit a function to data.  The polynomial models (linear, quadratic, polynomial3, polynomial4 and polynomial5) are fit directly by linear least squares (see fitPolynomial), 
+	other models are fit with curve_fit.  Initial values can be given as p0=(...) and point uncertainties as sigma=[...].
+
+	Returns
+	-------
+	popt, perr : the fit parameters and their standard errors
+	"""
+	sigma = initial_values.pop('sigma',None)
+
+	if function in polynomial_degrees:
+		popt, pcov = fitPolynomial(x_vals,y_vals,polynomial_degrees[function],sigma)
+		return popt,np.sqrt(np.diag(pcov))
+
 	arg_specs = inspect.getargspec(function)
 	arg_number =  len(arg_specs[0]) - 1
 
@@ -66,7 +144,7 @@ def fitFunction(function,x_vals,y_vals,**initial_values):
 	p0_val = generateInitialValues(arg_number,initial_values)
 
 	try:
-		popt, pcov = curve_fit(function, np.array(x_vals), np.array(y_vals),p0=p0_val)	
+		popt, pcov = curve_fit(function, np.array(x_vals), np.array(y_vals),p0=p0_val,sigma=sigma)	
 	except Exception,e: 
 		popt = []
 		pcov = []
@@ -100,26 +178,53 @@ def valid_date(s):
 	return parser.parse(s)
 
 
-def getInstrID(instr_owner,instr_number,database_name):
+def findIntervals(interval_starts,interval_ends,timestamps):
+	"""
+	Find the interval containing each timestamp with a binary search on the interval start times.
+	Intervals include their start and exclude their end (ie. start <= timestamp < end), and must be sorted by start time and not overlap.
 
-	cnx = mysql.connector.connect(user='root', password='', host='localhost', database=database_name)
-	cursor = cnx.cursor()
+	Parameters
+	----------
+	interval_starts : numpy array
+		Sorted interval start times
+	interval_ends : numpy array
+		Interval end times, in the same order as interval_starts
+	timestamps : numpy array
+		Times to look up
 
-	cursor.execute('''
-		SELECT 
-			id
-		FROM
-			sp2_instrument_info 
-		WHERE
-			instr_owner = %s
-			AND instr_number = %s
-		''',
-		(instr_owner,instr_number))
+	Returns
+	-------
+	numpy array with the index of the interval containing each timestamp, or -1 if the timestamp is not in any interval
+	"""
+	interval_starts = np.asarray(interval_starts,dtype=np.float64)
+	interval_ends = np.asarray(interval_ends,dtype=np.float64)
+	timestamps = np.asarray(timestamps,dtype=np.float64)
 
-	instr_info = cursor.fetchall()
-	instr_id   = instr_info[0][0]
+	interval_index = np.searchsorted(interval_starts,timestamps,side='right') - 1
+	in_interval = interval_index >= 0
+	in_interval[in_interval] = timestamps[in_interval] < interval_ends[interval_index[in_interval]]
+	interval_index[~in_interval] = -1
+
+	return interval_index
+
+
+def getInstrID(instr_owner,instr_number,database_name):
+
+	with dbSession(database_name) as (cnx,cursor):
+		cursor.execute('''
+			SELECT 
+				id
+			FROM
+				sp2_instrument_info 
+			WHERE
+				instr_owner = %s
+				AND instr_number = %s
+			''',
+			(instr_owner,instr_number))
+
+		instr_info = cursor.fetchall()
 	
-	cnx.close()
+	instr_id   = instr_info[0][0]
 
 	return instr_id
 
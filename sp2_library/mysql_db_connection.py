@@ -1,20 +1,280 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
+import os
+import re
+import math
+import time
+import tempfile
+import numpy as np
 import mysql.connector
+from mysql.connector import pooling
+
+#connection settings, the defaults can be set with the SP2_DB_USER, SP2_DB_PASSWORD, SP2_DB_HOST and SP2_DB_PORT environment variables or changed (or extended with other mysql.connector arguments) with setConnectionConfig
+connection_config = {
+	'user':     os.environ.get('SP2_DB_USER','root'),
+	'password': os.environ.get('SP2_DB_PASSWORD',''),
+	'host':     os.environ.get('SP2_DB_HOST','localhost'),
+	'port':     int(os.environ.get('SP2_DB_PORT',3306)),
+	}
+pool_size = 5
+
+#one pool per process and database, connections can't be shared with processes started by multiprocessing
+_connection_pools = {}
+
+
+def setConnectionConfig(user=None,password=None,host=None,port=None,size=None,**connector_args):
+	"""
+	Change the database connection settings.  Connections made after this use the new settings.
+	Any other keyword arguments are passed on to mysql.connector, eg. allow_local_infile=True to let a BulkLoader use LOAD DATA LOCAL INFILE.
+
+	Parameters
+	----------
+	user : string
+		MySQL user name
+	password : string
+		MySQL password
+	host : string
+		MySQL server host name
+	port : int
+		MySQL server port
+	size : int
+		Number of connections kept in each pool.  When all of them are in use, further connections are made directly and closed when they are released.
+	connector_args : 
+		Other mysql.connector connection arguments
+	"""
+	global pool_size
+
+	for key,value in [('user',user),('password',password),('host',host),('port',port)]:
+		if value is not None:
+			connection_config[key] = value
+	connection_config.update(connector_args)
+	if size is not None:
+		pool_size = size
+
+	#pools made with the old settings are not reused
+	_connection_pools.clear()
+
+
+def getConnectionPool(database_name):
+	"""
+	Get the connection pool for a database, the pool is created on first use
+	"""
+	pool_key = (os.getpid(),database_name)
+	if pool_key not in _connection_pools:
+		#pool names are limited to 64 characters
+		pool_name = ('sp2_%d_%s' % (os.getpid(),database_name))[0:64]
+		_connection_pools[pool_key] = pooling.MySQLConnectionPool(pool_name=pool_name,pool_size=pool_size,database=database_name,**connection_config)
+
+	return _connection_pools[pool_key]
+
+
+def getConnection(database_name):
+	"""
+	Get a connection to a database from its pool.  Closing the connection returns it to the pool.
+	If the pool is exhausted (eg. many TimeIntervals are alive at once), a direct connection is made instead, so the pool size is not a hard limit.
+	"""
+	try:
+		return getConnectionPool(database_name).get_connection()
+	except mysql.connector.errors.PoolError:
+		return mysql.connector.connect(database=database_name,**connection_config)
+
+
+class dbSession(object):
+
+	"""
+
+	Context manager for a pooled connection and cursor.  Changes are rolled back if an exception is raised, and the connection is returned to the pool on exit.
+
+		with dbSession(database_name) as (cnx,cursor):
+			cursor.execute(...)
+
+	"""
+
+	def __init__(self, database_name):
+		self.database_name = database_name
+		self.db_connection = None
+		self.db_cur = None
+
+	def __enter__(self):
+		self.db_connection = getConnection(self.database_name)
+		self.db_cur = self.db_connection.cursor()
+		return self.db_connection, self.db_cur
+
+	def __exit__(self, exc_type, exc_value, traceback):
+		if exc_type is not None:
+			self.db_connection.rollback()
+		self.db_cur.close()
+		self.db_connection.close()
+		self.db_connection = None
+		self.db_cur = None
+		return False
+
 
 class dbConnection():
 
 	"""
 
-	Creates and manages a mysql database connection and cursor
+	Creates and manages a mysql database connection and cursor.  The connection comes from the pool for the database, and is returned to the pool by close(), on exit when used as a context manager, or when the object is deleted.
 
 	"""
 
 	def __init__(self, schema):
-	    self.db_connection = mysql.connector.connect(user='root', password='', host='localhost', database=schema) 
+	    self.db_connection = getConnection(schema)
 	    self.db_cur = self.db_connection.cursor()
 
+	def close(self):
+	    if getattr(self,'db_connection',None) is not None:
+	        self.db_cur.close()
+	        self.db_connection.close()
+	        self.db_connection = None
+
+	def __enter__(self):
+	    return self
+
+	def __exit__(self, exc_type, exc_value, traceback):
+	    self.close()
+	    return False
+
 	def __del__(self):
-	    self.db_connection.close()
+	    self.close()
+
+
+def _formatLoadDataValue(value):
+	"""
+	format a single value for a LOAD DATA INFILE text file, None and NaN are written as NULL
+	"""
+	if value is None:
+		return '\\N'
+	if isinstance(value,float):
+		if math.isnan(value):
+			return '\\N'
+		return repr(value)
+	if isinstance(value,basestring):
+		return value.replace('\\','\\\\').replace('\t','\\t').replace('\n','\\n')
+	return str(value)
+
+
+class BulkLoader(object):
+
+	"""
+
+	Loads rows into a mysql table with a single LOAD DATA LOCAL INFILE statement per write.
+	It can be used as the sink of the SP2_raw_data particle writers and SP2_housekeeping.HKfileToDatabase.
+	If the server or connection does not allow LOCAL INFILE (the connection must be made with allow_local_infile=True), it falls back to multi-row INSERT statements.  
+	Only the errors that mean LOCAL INFILE is not allowed (error numbers in LOCAL_INFILE_ERRNOS) cause the fallback, any other error is raised.
+	The number of rows loaded and the time taken are kept, so throughput can be compared with the executemany path.
+
+	"""
+
+	#1148: ER_NOT_ALLOWED_COMMAND, 2068: CR_LOAD_DATA_LOCAL_INFILE_REJECTED, 3948: ER_CLIENT_LOCAL_FILES_DISABLED
+	LOCAL_INFILE_ERRNOS = (1148,2068,3948)
+
+	def __init__(self, insert_statement, cnx, cursor, use_load_data=True, rows_per_insert=1000, verbose=False):
+		"""
+		Parameters
+		----------
+		insert_statement : string
+			An INSERT statement as made by eg. SP2_raw_data.defineIncandInsertStatement or SP2_housekeeping.defineHKInsertStatement.  
+			The table and the columns to load are taken from it.
+		cnx : mysql connection
+		cursor : mysql cursor
+		use_load_data : bool
+			If False, always use multi-row INSERT statements
+		rows_per_insert : int
+			Number of rows in each multi-row INSERT statement
+		verbose : bool
+			If True, print the load rate of each write and a message when falling back to INSERT statements
+		"""
+		statement_match = re.search(r'INSERT\s+INTO\s+(\S+)\s*\(([^)]*)\)',insert_statement,flags=re.IGNORECASE)
+		if statement_match is None:
+			raise ValueError('could not find the table and columns in the insert statement')
+
+		self.table_name = statement_match.group(1)
+		self.columns = [column.strip() for column in statement_match.group(2).split(',')]
+		self.cnx = cnx
+		self.cursor = cursor
+		self.use_load_data = use_load_data
+		self.rows_per_insert = rows_per_insert
+		self.verbose = verbose
+
+		self.rows_loaded = 0
+		self.load_time = 0.
+
+
+	def write(self, multiple_records):
+		"""
+		Load a list of rows (dictionaries with a key for each column) into the table and commit
+		"""
+		if multiple_records == []:
+			return
+
+		start_time = time.time()
+
+		if self.use_load_data:
+			try:
+				self._loadDataInfile(multiple_records)
+			except mysql.connector.Error, e:
+				if e.errno not in self.LOCAL_INFILE_ERRNOS:
+					raise
+				if self.verbose:
+					print 'LOAD DATA LOCAL INFILE not available (' + str(e) + '), using multi-row INSERT instead'
+				self.cnx.rollback()
+				self.use_load_data = False
+
+		if not self.use_load_data:
+			self._insertMultipleRows(multiple_records)
+
+		self.cnx.commit()
+
+		elapsed_time = time.time() - start_time
+		self.rows_loaded += len(multiple_records)
+		self.load_time += elapsed_time
+		if self.verbose:
+			print 'loaded', len(multiple_records), 'rows into', self.table_name, 'at', int(len(multiple_records)/max(elapsed_time,1e-6)), 'rows/s'
+
+
+	def getRowsPerSecond(self):
+		"""
+		Get the average load rate over all writes
+		"""
+		if self.load_time == 0:
+			return np.nan
+		return self.rows_loaded/self.load_time
+
+
+	def _loadDataInfile(self, multiple_records):
+		"""
+		write the rows to a temporary tab separated file and load it with LOAD DATA LOCAL INFILE
+		"""
+		data_file = tempfile.NamedTemporaryFile(suffix='.tsv',delete=False)
+		try:
+			for single_record in multiple_records:
+				data_file.write('\t'.join([_formatLoadDataValue(single_record[column]) for column in self.columns]) + '\n')
+			data_file.close()
+
+			self.cursor.execute(('''LOAD DATA LOCAL INFILE %s 
+				INTO TABLE ''' + self.table_name + ''' 
+				FIELDS TERMINATED BY '\\t' 
+				LINES TERMINATED BY '\\n' 
+				(''' + ','.join(self.columns) + ''')'''),
+				(data_file.name,))
+		finally:
+			data_file.close()
+			os.remove(data_file.name)
 
 
+	def _insertMultipleRows(self, multiple_records):
+		"""
+		insert the rows with INSERT ... VALUES (...),(...) statements of rows_per_insert rows
+		"""
+		row_placeholder = '(' + ','.join(['%s']*len(self.columns)) + ')'
+		for start in range(0,len(multiple_records),self.rows_per_insert):
+			block = multiple_records[start:start+self.rows_per_insert]
+			values = []
+			for single_record in block:
+				for column in self.columns:
+					value = single_record[column]
+					if isinstance(value,float) and math.isnan(value):
+						value = None
+					values.append(value)
+			self.cursor.execute(('INSERT INTO ' + self.table_name + ' (' + ','.join(self.columns) + ') VALUES ' + ','.join([row_placeholder]*len(block))),values)
@@ -1,5 +1,7 @@
 from nose.tools import *
+import numpy as np
 import sp2_library
+import sp2b_test_data
 
 def setup():
     print "SETUP!"
@@ -8,4 +10,689 @@ def teardown():
     print "TEAR DOWN!"
 
 def test_basic():
-    print "I RAN!"
\ No newline at end of file
+    print "I RAN!"
+
+def test_hk_interval_index_empty():
+    from sp2_library.SP2_housekeeping import HKIntervalIndex
+    hk_index = HKIntervalIndex([],[],[])
+    assert_equal(hk_index.getHKIDs(np.array([1.,2.])),[None,None])
+
+
+def test_hk_interval_index_outside_intervals():
+    from sp2_library.SP2_housekeeping import HKIntervalIndex
+    #given out of order, with a gap between 12 and 13
+    hk_index = HKIntervalIndex([3,1,2],[13.,10.,11.],[14.,11.,12.])
+    timestamps = np.array([5.,10.,10.5,11.,12.,12.5,13.,14.,20.])
+    assert_equal(hk_index.getHKIDs(timestamps),[None,1,1,2,None,None,3,None,None])
+
+
+def _makeTestTimeInterval(sample_factors):
+    from sp2_library.SP2_time_interval import TimeInterval
+    time_interval = object.__new__(TimeInterval)
+    time_interval.db_connection = None
+    time_interval.mass_calibration = None
+    time_interval.number_of_channels = 8
+    time_interval.rBC_density = 1.8
+    time_interval.interval_max = 500.
+    time_interval.min_VED = 70.
+    time_interval.max_VED = 500.
+    time_interval.calibration_info = {
+        'BBHG_incand':[50.,30000.,0.,0.001,0.,0.,0.0001,0.],
+        'BBLG_incand':[200.,32000.,0.,0.01,0.,0.,0.001,0.],
+        }
+    time_interval.sample_factors = sample_factors
+    time_interval.indexSampleFactors()
+    return time_interval
+
+
+def test_assemble_interval_data_ignores_missing_hk_and_sample_factors():
+    time_interval = _makeTestTimeInterval([(0.,1100.,2),(1200.,2000.,2)])
+    #(start, end, BB_incand_HG, BB_incand_LG, sample_flow, NB_incand_HG, chamber_temp, chamber_pressure)
+    good_row = (1000.,1001.,20000.,2000.,120.,0.,26.85,101325.)
+    time_interval.single_particle_data = [
+        good_row,
+        (1000.,1001.,20000.,2000.,120.,0.,None,101325.),
+        (1000.,1001.,20000.,2000.,120.,0.,26.85,None),
+        (1000.,1001.,20000.,2000.,None,0.,26.85,101325.),
+        (1150.,1151.,20000.,2000.,120.,0.,26.85,101325.),
+        ]
+    time_interval.assembleIntervalData()
+    interval_data = time_interval.assembled_interval_data
+
+    expected_volume = 120.*1.*(273.15/300.)/(60*2)
+    assert_almost_equal(interval_data['sampled volume'],expected_volume)
+    assert_equal(interval_data['total number'],1)
+    assert_equal(interval_data['particles without sample factor'],1)
+
+
+def test_bin_assembled_data_matches_particle_loop():
+    from sp2_library import SP2_utilities
+    time_interval = _makeTestTimeInterval([(0.,2000.,1)])
+    time_interval.min_VED = 70
+    time_interval.max_VED = 500
+    random_state = np.random.RandomState(6)
+    VED_list = random_state.uniform(50.,530.,500).tolist() + [69.9,70.,80.,499.,500.,509.9,510.,520.]
+
+    for binning_increment in [5,10,30]:
+        time_interval.assembled_interval_data = {'VED list':VED_list,'sampled volume':1.}
+        time_interval.binAssembledData(binning_increment)
+
+        #the binning of each particle against each bin
+        expected_bins = time_interval.makeBinDict()
+        for VED in VED_list:
+            for point in expected_bins:
+                if expected_bins[point][0] <= VED < expected_bins[point][1]:
+                    expected_bins[point][2] += SP2_utilities.calculateMass(time_interval.rBC_density,VED)
+                    expected_bins[point][3] += 1
+
+        assert_equal(sorted(time_interval.binned_data.keys()),sorted(expected_bins.keys()))
+        for point in expected_bins:
+            assert_equal(time_interval.binned_data[point][0:2],expected_bins[point][0:2])
+            assert_almost_equal(time_interval.binned_data[point][2],expected_bins[point][2],places=9)
+            assert_equal(time_interval.binned_data[point][3],expected_bins[point][3])
+
+
+def test_assemble_interval_data_in_batches_matches_assemble_interval_data():
+    time_interval = _makeTestTimeInterval([(0.,1100.,2),(1200.,2000.,3)])
+    time_interval.min_VED = 70
+    time_interval.max_VED = 500
+    time_interval.interval_start,time_interval.interval_end = 1000.,1300.
+    time_interval.yag_min,time_interval.yag_max,time_interval.sample_flow_min,time_interval.sample_flow_max = 50.,150.,100.,140.
+    random_state = np.random.RandomState(7)
+    event_times = np.sort(random_state.uniform(1000.,1300.,300))
+    #(start, end, BB_incand_HG, BB_incand_LG, sample_flow, NB_incand_HG, chamber_temp, chamber_pressure)
+    particle_rows = [(event_time-random_state.uniform(0.,2.),event_time,random_state.uniform(10.,40000.),random_state.uniform(100.,40000.),random_state.uniform(110.,130.),0.,
+        26.85,101325.) for event_time in event_times]
+
+    time_interval.single_particle_data = particle_rows
+    time_interval.assembleIntervalData()
+    time_interval.binAssembledData(10)
+    expected_interval_data = time_interval.assembled_interval_data
+    expected_binned_data = time_interval.binned_data
+    assert expected_interval_data['total number'] > 0
+    assert expected_interval_data['particles without sample factor'] > 0
+
+    for batch_size in [1,7,1000]:
+        cursor = sp2b_test_data.FakeCursor(fetch_rows=particle_rows)
+        time_interval.db_connection = sp2b_test_data.FakeConnection(cursor)
+        time_interval.assembleIntervalDataInBatches(10,batch_size)
+
+        for key in ['total mass','total mass uncertainty','sampled volume']:
+            assert_almost_equal(time_interval.assembled_interval_data[key],expected_interval_data[key],places=6)
+        for key in ['total number','particles without sample factor']:
+            assert_equal(time_interval.assembled_interval_data[key],expected_interval_data[key])
+        assert_equal(sorted(time_interval.binned_data.keys()),sorted(expected_binned_data.keys()))
+        for point in expected_binned_data:
+            assert_almost_equal(time_interval.binned_data[point][2],expected_binned_data[point][2],places=6)
+            assert_equal(time_interval.binned_data[point][3],expected_binned_data[point][3])
+        assert cursor.closed
+    time_interval.db_connection = None
+
+
+def _getTestRecords(number_of_records, seed=0, number_of_channels=8):
+    import io
+    from sp2_library import SP2_raw_data
+    raw_data = sp2b_test_data.makeRecords(number_of_records,seed,number_of_channels=number_of_channels)
+    return raw_data,SP2_raw_data.decodeRecords(io.BytesIO(raw_data))
+
+
+def _particleRecordIncandRows(raw_data, parameters, prev_particle_ts):
+    #the rows written by the original record by record writer
+    from sp2_library.SP2_particle_record import ParticleRecord
+    bytes_per_record = parameters['bytes_per_record']
+    rows = []
+    for file_index in range(parameters['number_of_records']):
+        particle_record = ParticleRecord(raw_data[file_index*bytes_per_record:(file_index+1)*bytes_per_record],parameters['acq_rate'])
+        particle_record.incandPeakInfo()
+        if particle_record.incandMax < parameters['min_detectable_signal']:
+            continue
+        particle_record.narrowIncandPeakInfo()
+        row = {
+            'instr_ID':parameters['instr_id'],
+            'instr_location_ID':parameters['instr_locn_ID'],
+            'sp2b_file':parameters['file_name'],
+            'file_index':file_index,
+            'UNIX_UTC_ts_int_start':prev_particle_ts,
+            'UNIX_UTC_ts_int_end':particle_record.timestamp,
+            'BB_incand_HG_pkht':float(particle_record.incandMax),
+            'BB_incand_HG_pkpos':float(particle_record.incandMaxPos),
+            'NB_incand_HG_pkht':float(particle_record.narrowIncandMax),
+            }
+        if parameters['number_of_channels'] == 8:
+            particle_record.incandPeakInfoLG()
+            particle_record.narrowIncandPeakInfoLG()
+            row['BB_incand_LG_pkht'] = float(particle_record.incandMax_LG)
+            row['BB_incand_LG_pkpos'] = float(particle_record.incandMaxPos_LG)
+            row['NB_incand_LG_pkht'] = float(particle_record.narrowIncandMax_LG)
+        rows.append(row)
+        prev_particle_ts = particle_record.timestamp
+    return rows
+
+
+def _assertRowsEqual(rows, expected_rows):
+    assert_equal(len(rows),len(expected_rows))
+    for row,expected_row in zip(rows,expected_rows):
+        assert_equal(sorted(row.keys()),sorted(expected_row.keys()))
+        for column in expected_row:
+            assert_almost_equal(row[column],expected_row[column],places=9)
+
+
+def test_incand_writer_matches_particle_record():
+    import io
+    from sp2_library import SP2_raw_data
+    for number_of_channels in [4,8]:
+        raw_data,records = _getTestRecords(300,2,number_of_channels)
+        parameters = sp2b_test_data.makeParameters('test.sp2b',len(records),records.dtype.itemsize,number_of_channels)
+        cursor = sp2b_test_data.FakeCursor()
+        prev_particle_ts,count = SP2_raw_data.writeIncandParticleData(io.BytesIO(raw_data),parameters,123.,5,'incand',sp2b_test_data.FakeConnection(),cursor)
+
+        expected_rows = _particleRecordIncandRows(raw_data,parameters,123.)
+        assert len(expected_rows) > 0
+        _assertRowsEqual(cursor.rows,expected_rows)
+        #the count returned by the writers has always been one more than the number of particles written
+        assert_equal(count,5+len(expected_rows)+1)
+        assert_equal(prev_particle_ts,expected_rows[-1]['UNIX_UTC_ts_int_end'])
+
+
+def test_writers_read_files_in_blocks():
+    import io
+    from sp2_library import SP2_raw_data
+    raw_data,records = _getTestRecords(300,2)
+    parameters = sp2b_test_data.makeParameters('test.sp2b',len(records),records.dtype.itemsize)
+    cursor = sp2b_test_data.FakeCursor()
+    expected_result = SP2_raw_data.writeParticleData(io.BytesIO(raw_data),parameters,123.,5,456.,7,'incand','nonincand',sp2b_test_data.FakeConnection(),cursor)
+
+    for records_per_batch in [1,37,300]:
+        parameters['records_per_batch'] = records_per_batch
+        batch_sizes = [particle_batch.number_of_records for particle_batch in SP2_raw_data._readParticleBatches(io.BytesIO(raw_data),parameters,10)]
+        assert_equal(sum(batch_sizes),290)
+        assert_equal(max(batch_sizes),min(records_per_batch,290))
+
+        batch_cursor = sp2b_test_data.FakeCursor()
+        cnx = sp2b_test_data.FakeConnection()
+        result = SP2_raw_data.writeParticleData(io.BytesIO(raw_data),parameters,123.,5,456.,7,'incand','nonincand',cnx,batch_cursor)
+        assert_equal(result,expected_result)
+        assert_equal(batch_cursor.getRows('incand'),cursor.getRows('incand'))
+        assert_equal(batch_cursor.getRows('nonincand'),cursor.getRows('nonincand'))
+        if records_per_batch < 300:
+            assert cnx.commits > 2
+
+        incand_cursor = sp2b_test_data.FakeCursor()
+        incand_result = SP2_raw_data.writeIncandParticleData(io.BytesIO(raw_data),parameters,123.,5,'incand',sp2b_test_data.FakeConnection(),incand_cursor)
+        assert_equal(incand_result,expected_result[:2])
+        assert_equal(incand_cursor.rows,cursor.getRows('incand'))
+
+
+def test_particle_record_pickles():
+    import pickle
+    from sp2_library import SP2_raw_data
+    raw_data,records = _getTestRecords(2,9)
+    particle_record = SP2_raw_data.getParticleRecord(records,0,5e6)
+    particle_record.scatteringPeakInfo()
+    particle_record.splitData = np.arange(100)
+
+    for protocol in [0,1,2]:
+        unpickled_record = pickle.loads(pickle.dumps(particle_record,protocol))
+        assert_equal(unpickled_record.timestamp,particle_record.timestamp)
+        assert_equal(unpickled_record.scatteringMax,particle_record.scatteringMax)
+        assert np.array_equal(unpickled_record.scatData,particle_record.scatData)
+        assert np.array_equal(unpickled_record.lowGainSplitData,particle_record.lowGainSplitData)
+        assert np.array_equal(unpickled_record.splitData,np.arange(100))
+
+    unanalyzed_record = pickle.loads(pickle.dumps(SP2_raw_data.getParticleRecord(records,1,5e6)))
+    assert_equal(unanalyzed_record._analysis_results,None)
+
+
+@raises(AttributeError)
+def test_particle_record_private_attributes():
+    from sp2_library import SP2_raw_data
+    raw_data,records = _getTestRecords(1,9)
+    SP2_raw_data.getParticleRecord(records,0,5e6)._not_a_slot = 1
+
+
+def _makeTestTimeSeries(series_start, series_end, step):
+    from sp2_library import SP2_time_series
+    time_series = object.__new__(SP2_time_series.TimeSeriesProcessor)
+    time_series.database_name = 'test'
+    time_series.db_cur = None
+    time_series.instr_location_ID = 2
+    time_series.instr_ID = 1
+    time_series.series_start = series_start
+    time_series.series_end = series_end
+    time_series.step = step
+    time_series.rBC_density = 1.8
+    time_series.interval_max = 500.
+    time_series.extrapolate_calibration = False
+    time_series.particle_fetch_size = 7
+    time_series.instr_info = [(8,50.,32000.)]
+    time_series.sample_factor_rows = [(series_start-1.,series_end+1.,1)]
+    time_series.hk_limit_rows = [(series_start-1.,series_end+1.,50.,150.,100.,140.)]
+    time_series.calibration_rows = {
+        'BBHG_incand':[(0.,0.001,0.,0.,0.0001,0.,'Aquadag',1,0.)],
+        'BBLG_incand':[(0.,0.01,0.,0.,0.001,0.,'Aquadag',2,0.)],
+        }
+    time_series.calibration_limits = {1.:(50.,30000.),2.:(200.,32000.)}
+    return time_series
+
+
+def test_time_series_streams_particles_to_each_interval():
+    from sp2_library import SP2_time_series
+    random_state = np.random.RandomState(5)
+    event_times = np.sort(np.concatenate([random_state.uniform(1000.,1100.,200),[1000.,1010.,1020.,1050.,1100.]]))
+    #(start, end, BB_incand_HG, BB_incand_LG, sample_flow, NB_incand_HG, chamber_temp, chamber_pressure, yag_power)
+    particle_rows = [(event_time-0.1,event_time,random_state.uniform(100.,20000.),random_state.uniform(300.,2000.),120.,0.,26.85,101325.,random_state.choice([20.,100.]))
+        for event_time in event_times]
+    all_particle_data = np.array(particle_rows,dtype=SP2_time_series.series_particle_dtype)
+
+    particle_cursor = sp2b_test_data.FakeCursor(fetch_rows=particle_rows)
+    particle_connection = sp2b_test_data.FakeConnection(particle_cursor)
+    time_series = _makeTestTimeSeries(1000.,1100.,10.)
+    real_getConnection = SP2_time_series.getConnection
+    SP2_time_series.getConnection = lambda database_name: particle_connection
+    try:
+        time_series.retrieveSingleParticleData()
+    finally:
+        SP2_time_series.getConnection = real_getConnection
+
+    intervals = list(time_series.processIntervals())
+    assert_equal(len(intervals),10)
+    for interval in intervals:
+        in_interval = ((all_particle_data['UNIX_UTC_ts_int_end'] >= interval.interval_start) & (all_particle_data['UNIX_UTC_ts_int_end'] <= interval.interval_end)
+            & (all_particle_data['yag_power'] == 100.))
+        assert np.any(in_interval)
+        assert_equal(interval.single_particle_data.tolist(),all_particle_data[in_interval].tolist())
+        assert_equal(interval.assembled_interval_data['total number'],np.count_nonzero(in_interval))
+        #no more than one interval and one fetch of rows is held
+        interval_rows = np.count_nonzero((all_particle_data['UNIX_UTC_ts_int_end'] >= interval.interval_start) & (all_particle_data['UNIX_UTC_ts_int_end'] <= interval.interval_end))
+        assert len(time_series.single_particle_data) <= interval_rows + time_series.particle_fetch_size
+
+    assert particle_cursor.closed and particle_connection.closed
+    assert_raises(ValueError,time_series.getSingleParticleData,1000.,1010.,50.,150.,100.,140.)
+
+
+def test_checkpoint_resumes_partway_through_a_file():
+    import io
+    import os
+    import shutil
+    import tempfile
+    from sp2_library import SP2_raw_data, SP2_checkpoint
+    raw_data,records = _getTestRecords(300,4)
+    parameters = sp2b_test_data.makeParameters('test.sp2b',len(records),records.dtype.itemsize)
+
+    cursor = sp2b_test_data.FakeCursor()
+    expected_result = SP2_raw_data.writeParticleData(io.BytesIO(raw_data),parameters,1.,5,2.,7,'incand','nonincand',sp2b_test_data.FakeConnection(),cursor)
+    expected_incand_rows = cursor.getRows('incand')
+    expected_nonincand_rows = cursor.getRows('nonincand')
+    assert len(expected_incand_rows) > 10
+
+    checkpoint_dir = tempfile.mkdtemp()
+    try:
+        #the incandescent particles were committed up to the tenth one before an interruption, and no non-incandescent particles were
+        checkpoint_path = os.path.join(checkpoint_dir,'checkpoint.json')
+        last_committed = expected_incand_rows[9]
+        SP2_checkpoint.IngestCheckpoint(checkpoint_path).update('incand','test.sp2b',last_committed['file_index'],last_committed['UNIX_UTC_ts_int_end'],5+10)
+        assert not os.path.exists(checkpoint_path + '.tmp')
+
+        checkpoint = SP2_checkpoint.IngestCheckpoint(checkpoint_path)
+        parameters['checkpoint'] = checkpoint
+        cursor = sp2b_test_data.FakeCursor()
+        result = SP2_raw_data.writeParticleData(io.BytesIO(raw_data),parameters,1.,5,2.,7,'incand','nonincand',sp2b_test_data.FakeConnection(),cursor)
+
+        assert_equal(result,expected_result)
+        assert_equal(cursor.getRows('incand'),expected_incand_rows[10:])
+        assert_equal(cursor.getRows('nonincand'),expected_nonincand_rows)
+        assert checkpoint.isComplete('incand','test.sp2b') and checkpoint.isComplete('nonincand','test.sp2b')
+        assert_equal(SP2_checkpoint.IngestCheckpoint(checkpoint_path).getLastState('incand'),result[:2])
+
+        #a complete file is skipped
+        cursor = sp2b_test_data.FakeCursor()
+        assert_equal(SP2_raw_data.writeIncandParticleData(io.BytesIO(raw_data),parameters,1.,5,'incand',sp2b_test_data.FakeConnection(),cursor),result[:2])
+        assert_equal(cursor.rows,[])
+    finally:
+        shutil.rmtree(checkpoint_dir)
+
+
+def test_file_follower_matches_writer_on_finished_file():
+    import io
+    import os
+    import shutil
+    import tempfile
+    import threading
+    import time
+    from sp2_library import SP2_raw_data
+    raw_data,records = _getTestRecords(1000,10)
+    bytes_per_record = records.dtype.itemsize
+    parameters = sp2b_test_data.makeParameters('live.sp2b',len(records),bytes_per_record)
+
+    temporary_directory = tempfile.mkdtemp()
+    try:
+        sp2b_file_path = os.path.join(temporary_directory,'live.sp2b')
+
+        #append whole and partial records, as the SP2 does while it writes a file
+        def writeFile():
+            random_state = np.random.RandomState(10)
+            with open(sp2b_file_path,'wb') as sp2b_file:
+                position = 0
+                while position < len(raw_data):
+                    step = random_state.randint(0,150)*bytes_per_record+random_state.randint(0,bytes_per_record)
+                    sp2b_file.write(raw_data[position:position+step])
+                    sp2b_file.flush()
+                    position += step
+                    time.sleep(0.005)
+
+        writer = threading.Thread(target=writeFile)
+        writer.start()
+        cursor = sp2b_test_data.FakeCursor()
+        follower = SP2_raw_data.Sp2bFileFollower(sp2b_file_path,parameters,0.,0,'incand',sp2b_test_data.FakeConnection(),cursor)
+        summaries = list(follower.follow(poll_interval=0.01,idle_timeout=0.5))
+        writer.join()
+
+        expected_cursor = sp2b_test_data.FakeCursor()
+        expected_result = SP2_raw_data.writeIncandParticleData(io.BytesIO(raw_data),parameters,0.,0,'incand',sp2b_test_data.FakeConnection(),expected_cursor)
+    finally:
+        shutil.rmtree(temporary_directory)
+
+    assert len(summaries) > 1
+    assert_equal(follower.records_read,len(records))
+    assert_equal(cursor.rows,expected_cursor.rows)
+    assert_equal((follower.prev_particle_ts,follower.count),expected_result)
+
+
+def test_batch_peak_info_matches_particle_record():
+    from sp2_library import SP2_raw_data
+    from sp2_library.SP2_particle_batch import ParticleBatch
+    for number_of_channels in [4,8]:
+        raw_data,records = _getTestRecords(200,1,number_of_channels)
+        particle_batch = ParticleBatch(records,5e6)
+        particle_batch.peakInfo()
+
+        peak_methods = [('scatteringPeakInfo',['scatteringBaseline','scatteringBaselineNoiseThresh','scatteringMax','scatteringMaxPos']),
+            ('incandPeakInfo',['incandBaseline','incandMax','incandMaxPos']),
+            ('narrowIncandPeakInfo',['narrowIncandBaseline','narrowIncandMax','narrowIncandMaxPos'])]
+        if number_of_channels == 8:
+            peak_methods += [('scatteringPeakInfoLG',['scatteringBaselineLG','scatteringBaselineNoiseThreshLG','scatteringMax_LG','scatteringMaxPos_LG']),
+                ('incandPeakInfoLG',['incandBaseline_LG','incandMax_LG','incandMaxPos_LG']),
+                ('narrowIncandPeakInfoLG',['narrowIncandBaseline_LG','narrowIncandMax_LG','narrowIncandMaxPos_LG'])]
+
+        for file_index in range(len(records)):
+            particle_record = SP2_raw_data.getParticleRecord(records,file_index,5e6)
+            assert_equal(particle_batch.timestamp[file_index],particle_record.timestamp)
+            for method,attributes in peak_methods:
+                getattr(particle_record,method)()
+                for attribute in attributes:
+                    assert_almost_equal(getattr(particle_batch,attribute)[file_index],getattr(particle_record,attribute),places=9)
+
+
+def test_ingest_sp2b_files_matches_serial_writer():
+    import io
+    import os
+    import shutil
+    import tempfile
+    from sp2_library import SP2_raw_data
+    sp2b_dir = tempfile.mkdtemp()
+    try:
+        raw_files = []
+        for file_number in range(3):
+            raw_data,records = _getTestRecords(100+50*file_number,10+file_number)
+            raw_files.append(raw_data)
+            with open(os.path.join(sp2b_dir,'20170101x%03d.sp2b' % file_number),'wb') as sp2b_file:
+                sp2b_file.write(raw_data)
+        parameters = sp2b_test_data.makeParameters(None,None,records.dtype.itemsize)
+
+        for particle_type,writer in [('incand',SP2_raw_data.writeIncandParticleData),('nonincand',SP2_raw_data.writeNonincandParticleData)]:
+            serial_cursor = sp2b_test_data.FakeCursor()
+            prev_particle_ts,count = 1.,5
+            for file_number,raw_data in enumerate(raw_files):
+                file_parameters = dict(parameters,file_name='20170101x%03d.sp2b' % file_number,number_of_records=len(raw_data)//parameters['bytes_per_record'])
+                prev_particle_ts,count = writer(io.BytesIO(raw_data),file_parameters,prev_particle_ts,count,particle_type,sp2b_test_data.FakeConnection(),serial_cursor)
+
+            cursor = sp2b_test_data.FakeCursor()
+            result = SP2_raw_data.ingestSp2bFiles(sp2b_dir,parameters,1.,5,particle_type,sp2b_test_data.FakeConnection(),cursor,particle_type,processes=2)
+            assert len(serial_cursor.rows) > 0
+            assert_equal(result,(prev_particle_ts,count))
+            assert_equal(cursor.rows,serial_cursor.rows)
+    finally:
+        shutil.rmtree(sp2b_dir)
+
+
+def test_single_pass_writer_matches_separate_writers():
+    import io
+    from sp2_library import SP2_raw_data
+    for number_of_channels in [4,8]:
+        raw_data,records = _getTestRecords(300,3,number_of_channels)
+        parameters = sp2b_test_data.makeParameters('test.sp2b',len(records),records.dtype.itemsize,number_of_channels)
+        parameters['mob_dia'] = 200
+
+        incand_cursor = sp2b_test_data.FakeCursor()
+        nonincand_cursor = sp2b_test_data.FakeCursor()
+        incand_result = SP2_raw_data.writeIncandParticleData(io.BytesIO(raw_data),parameters,1.,5,'incand',sp2b_test_data.FakeConnection(),incand_cursor)
+        nonincand_result = SP2_raw_data.writeNonincandParticleData(io.BytesIO(raw_data),parameters,2.,7,'nonincand',sp2b_test_data.FakeConnection(),nonincand_cursor)
+
+        cursor = sp2b_test_data.FakeCursor()
+        result = SP2_raw_data.writeParticleData(io.BytesIO(raw_data),parameters,1.,5,2.,7,'incand','nonincand',sp2b_test_data.FakeConnection(),cursor)
+
+        assert_equal(result,incand_result+nonincand_result)
+        assert len(incand_cursor.rows) > 0 and len(nonincand_cursor.rows) > 0
+        assert_equal(cursor.getRows('incand'),incand_cursor.rows)
+        assert_equal(cursor.getRows('nonincand'),nonincand_cursor.rows)
+
+
+def _getParticleStoreRecords(hk_id, mob_dia, file_index, event_time):
+    return [{'instr_ID':1,'instr_location_ID':2,'sp2b_file':'test.sp2b','file_index':file_index,'UNIX_UTC_ts_int_start':event_time-1.,
+        'UNIX_UTC_ts_int_end':event_time,'BB_incand_HG_pkht':1000.,'hk_id':hk_id,'mob_dia':mob_dia}]
+
+
+def test_particle_store_round_trip():
+    import tempfile
+    import shutil
+    from sp2_library import SP2_particle_store
+    for file_format in ['hdf5','parquet']:
+        store_path = tempfile.mkdtemp()
+        try:
+            particle_store = SP2_particle_store.ParticleStore(store_path,'incand',file_format)
+            particle_store.write(_getParticleStoreRecords(7,200,0,1.5e9))
+            particle_store.write(_getParticleStoreRecords(None,None,1,1.5e9+1))
+            particle_data = particle_store.read(1,1.5e9-10,1.5e9+10)
+
+            assert_equal(particle_data['hk_id'].dtype,np.float64)
+            assert_equal(particle_data['hk_id'][0],7)
+            assert np.isnan(particle_data['hk_id'][1])
+            assert_equal(particle_data['mob_dia'][0],200)
+            assert np.isnan(particle_data['mob_dia'][1])
+            assert_equal(particle_data['file_index'].dtype,np.int64)
+            assert_equal(particle_data['file_index'].tolist(),[0,1])
+            assert_equal(particle_data['instr_location_ID'].tolist(),[2,2])
+            assert_equal(particle_data['sp2b_file'].tolist(),['test.sp2b','test.sp2b'])
+            assert_equal(particle_data['UNIX_UTC_ts_int_end'].tolist(),[1.5e9,1.5e9+1])
+            assert_equal(particle_data['BB_incand_HG_pkht'].tolist(),[1000.,1000.])
+        finally:
+            shutil.rmtree(store_path)
+
+
+def test_particle_store_refuses_lossy_casts():
+    import tempfile
+    import shutil
+    import h5py
+    from sp2_library import SP2_particle_store
+    store_path = tempfile.mkdtemp()
+    try:
+        particle_store = SP2_particle_store.ParticleStore(store_path,'incand','hdf5')
+        particle_store.write(_getParticleStoreRecords(7,200,0,1.5e9))
+        #a partition written with an integer hk_id column
+        with h5py.File(particle_store._getPartitionPath(1,int(1.5e9/86400)),'a') as h5_file:
+            del h5_file['hk_id']
+            h5_file.create_dataset('hk_id',data=np.array([7],dtype=np.int64),maxshape=(None,),chunks=True)
+        assert_raises(ValueError,particle_store.write,_getParticleStoreRecords(None,200,1,1.5e9+1))
+    finally:
+        shutil.rmtree(store_path)
+
+
+def _getBulkLoaderRows():
+    return [{'a':1,'b':2.5},{'a':2,'b':float('nan')},{'a':3,'b':None}]
+
+
+def test_bulk_loader_falls_back_when_local_infile_is_not_allowed():
+    import mysql.connector
+    from sp2_library import mysql_db_connection
+    for errno in mysql_db_connection.BulkLoader.LOCAL_INFILE_ERRNOS:
+        cnx = sp2b_test_data.FakeConnection()
+        cursor = sp2b_test_data.FakeCursor(mysql.connector.Error(errno=errno),'LOAD DATA')
+        bulk_loader = mysql_db_connection.BulkLoader('INSERT INTO test_table (a, b) VALUES (%(a)s,%(b)s)',cnx,cursor,rows_per_insert=2)
+        bulk_loader.write(_getBulkLoaderRows())
+
+        assert_equal(bulk_loader.use_load_data,False)
+        assert_equal(cnx.rollbacks,1)
+        assert_equal(cnx.commits,1)
+        assert_equal([params for statement,params in cursor.executed],[[1,2.5,2,None],[3,None]])
+        assert cursor.executed[0][0].startswith('INSERT INTO test_table (a,b) VALUES (%s,%s),(%s,%s)')
+        assert_equal(bulk_loader.rows_loaded,3)
+
+
+def test_bulk_loader_raises_other_errors():
+    import mysql.connector
+    from sp2_library import mysql_db_connection
+    cursor = sp2b_test_data.FakeCursor(mysql.connector.Error(errno=1146),'LOAD DATA')
+    bulk_loader = mysql_db_connection.BulkLoader('INSERT INTO test_table (a, b) VALUES (%(a)s,%(b)s)',sp2b_test_data.FakeConnection(),cursor)
+    assert_raises(mysql.connector.Error,bulk_loader.write,_getBulkLoaderRows())
+    assert_equal(bulk_loader.use_load_data,True)
+    assert_equal(cursor.executed,[])
+
+
+def test_batch_leo_gauss_fit_matches_particle_record():
+    from sp2_library import SP2_raw_data
+    from sp2_library.SP2_particle_batch import ParticleBatch
+    raw_data,records = _getTestRecords(300,5)
+    zeroX_to_LEO_limit,calib_zeroX_to_peak,calib_gauss_width,evap_threshold = 3.7,18.2,11.5,100.
+
+    particle_batch = ParticleBatch(records,5e6)
+    particle_batch.zeroCrossing(evap_threshold)
+    particle_batch.leoGaussFit(zeroX_to_LEO_limit,calib_zeroX_to_peak,calib_gauss_width)
+    LF_results = particle_batch.getLeoGaussCurves(calib_gauss_width)
+
+    number_fit = 0
+    for file_index in range(len(records)):
+        particle_record = SP2_raw_data.getParticleRecord(records,file_index,5e6)
+        particle_record.leoGaussFit(zeroX_to_LEO_limit,calib_zeroX_to_peak,calib_gauss_width,evap_threshold)
+        for attribute in ['LF_scattering_amp','LF_baseline','beam_center_pos']:
+            expected = getattr(particle_record,attribute)
+            #curve_fit stops within its tolerance of the least squares solution that the batch fit solves for directly
+            assert abs(getattr(particle_batch,attribute)[file_index]-expected) <= 1e-3+1e-5*abs(expected)
+        if particle_record.LF_results != []:
+            number_fit += 1
+            assert_equal(particle_batch.LF_max_index[file_index],particle_record.LF_max_index)
+            assert np.allclose(LF_results[file_index],particle_record.LF_results,rtol=1e-5,atol=1e-3)
+    assert number_fit > 0
+
+
+def test_batch_zero_crossing_matches_particle_record():
+    from sp2_library import SP2_raw_data
+    from sp2_library.SP2_particle_batch import ParticleBatch
+    raw_data,records = _getTestRecords(300,4)
+    for evap_threshold in [0.,40.,1000.]:
+        particle_batch = ParticleBatch(records,5e6)
+        particle_batch.zeroCrossing(evap_threshold)
+        for file_index in range(len(records)):
+            particle_record = SP2_raw_data.getParticleRecord(records,file_index,5e6)
+            try:
+                zero_crossing = particle_record.zeroCrossing(evap_threshold)
+            except ValueError:
+                zero_crossing = -3
+            assert_almost_equal(particle_batch.zeroCrossingPos[file_index],zero_crossing,places=9)
+            assert_almost_equal(particle_batch.splitBaseline[file_index],particle_record.splitBaseline,places=9)
+
+
+def test_batch_full_gauss_fit_matches_particle_record():
+    from sp2_library import SP2_raw_data
+    from sp2_library.SP2_particle_batch import ParticleBatch
+    raw_data,records = _getTestRecords(100,6)
+    records = records.copy()
+
+    #clean Gaussians on the scattering channel
+    random_state = np.random.RandomState(6)
+    x_vals = np.arange(records['waveforms'].shape[1])
+    for file_index in range(len(records)):
+        amplitude,center,width = random_state.uniform(200,20000),random_state.uniform(15,85),random_state.uniform(3,20)
+        scattering = 30+amplitude*np.exp(-(x_vals-center)**2/(2*width**2))+random_state.randn(len(x_vals))*5
+        records['waveforms'][file_index,:,0] = np.round(scattering)
+
+    particle_batch = ParticleBatch(records,5e6)
+    particle_batch.fullGaussFit()
+
+    def sumOfSquares(file_index, amplitude, center, width):
+        scattering = particle_batch.scatData[file_index].astype(np.float64)-particle_batch.scatteringBaseline[file_index]
+        return np.sum((scattering-amplitude*np.exp(-(x_vals-center)**2/(2*width**2)))**2)
+
+    #both fits stop within their tolerances of the same minimum, so the parameters agree closely and the batch fit is no worse
+    for file_index in range(len(records)):
+        particle_record = SP2_raw_data.getParticleRecord(records,file_index,5e6)
+        particle_record.fullGaussFit()
+        batch_fit = [particle_batch.FF_scattering_amp[file_index],particle_batch.FF_peak_pos[file_index],abs(particle_batch.FF_width[file_index])]
+        record_fit = [particle_record.FF_scattering_amp,particle_record.FF_peak_pos,abs(particle_record.FF_width)]
+        assert np.allclose(batch_fit,record_fit,rtol=1e-3)
+        assert sumOfSquares(file_index,*batch_fit) <= sumOfSquares(file_index,*record_fit)*(1+1e-6)
+
+
+def test_mass_calibration_matches_calculate_mass():
+    from sp2_library.SP2_time_interval import MassCalibration
+    random_state = np.random.RandomState(7)
+    #peak heights are integer signals less a baseline averaged over 10 samples
+    BB_incand_HG = random_state.randint(-200,40000,2000)-random_state.randint(-3000,3000,2000)/10.
+    BB_incand_LG = random_state.randint(-200,33000,2000)-random_state.randint(-3000,3000,2000)/10.
+    BB_incand_HG[::97] += 1e-3
+
+    for number_of_channels in [4,8]:
+        time_interval = _makeTestTimeInterval([(0.,1e10,1)])
+        time_interval.number_of_channels = number_of_channels
+        time_interval.calibration_info = {
+            'BBHG_incand':[35.2,32000.,0.13,0.0021,3.1e-8,0.01,1e-4,2e-9],
+            'BBLG_incand':[12.,31000.,0.4,0.019,1.2e-7,0.02,3e-4,4e-9],
+            }
+        expected = np.array([time_interval.calculateMass(HG,LG,0.) for HG,LG in zip(BB_incand_HG,BB_incand_LG)])
+
+        for lookup_table in [False,True]:
+            mass_calibration = MassCalibration(time_interval.calibration_info,number_of_channels,lookup_table=lookup_table)
+            rBC_mass,rBC_mass_uncertainty = mass_calibration.calculateMass(BB_incand_HG,BB_incand_LG)
+            assert np.allclose(rBC_mass,expected[:,0],rtol=1e-12,equal_nan=True)
+            assert np.allclose(rBC_mass_uncertainty,expected[:,1],rtol=1e-9,atol=1e-12,equal_nan=True)
+
+
+def test_refit_calibrations_writes_null_errors_and_skips_failed_fits():
+    from sp2_library import SP2_calibration, SP2_utilities
+    #calibration 1 has enough points for a linear fit, calibration 2 has no degrees of freedom left and calibration 3 is too short to fit
+    calibration_points = [(1,100.,1000.),(1,150.,2100.),(1,200.,3900.),(1,250.,6100.),(2,100.,1000.),(2,200.,4000.),(3,100.,1000.)]
+    cnx = sp2b_test_data.FakeConnection()
+    cursor = sp2b_test_data.FakeCursor(fetch_rows=calibration_points)
+    calibration_fits = SP2_calibration.refitCalibrations([1,2,3],SP2_utilities.linear,cnx,cursor)
+
+    assert np.all(np.isfinite(calibration_fits[1][1]))
+    assert np.all(np.isinf(calibration_fits[2][1]))
+    assert np.all(np.isnan(calibration_fits[3][0]))
+    assert_equal(cnx.commits,1)
+
+    update_rows = cursor.getRows(SP2_calibration.fit_update_statement)
+    assert_equal([row[-1] for row in update_rows],[1,2])
+    assert_equal(update_rows[0][:6],tuple(calibration_fits[1][0].tolist())+(None,)+tuple(calibration_fits[1][1].tolist())+(None,))
+    assert_equal(update_rows[1][:6],tuple(calibration_fits[2][0].tolist())+(None,None,None,None))
+    assert_equal(update_rows[1][6],'linear')
+
+    assert_equal(SP2_calibration.writeFitsToDatabase(calibration_fits,cnx,sp2b_test_data.FakeCursor()),([1,2],[3]))
+
+
+def test_fit_polynomial_matches_curve_fit():
+    from scipy.optimize import curve_fit
+    from sp2_library import SP2_utilities
+    random_state = np.random.RandomState(8)
+    x_vals = np.linspace(0,3,40)
+    for function,coefficients in [(SP2_utilities.linear,[0.5,2.]),(SP2_utilities.quadratic,[0.5,2.,-0.3]),(SP2_utilities.polynomial3,[0.5,2.,-0.3,0.05])]:
+        y_vals = function(x_vals,*coefficients)+random_state.randn(len(x_vals))*0.05
+        for sigma in [None,random_state.uniform(0.5,2.,len(x_vals))]:
+            if sigma is None:
+                popt,perr = SP2_utilities.fitFunction(function,x_vals,y_vals)
+            else:
+                popt,perr = SP2_utilities.fitFunction(function,x_vals,y_vals,sigma=sigma)
+            expected_popt,expected_pcov = curve_fit(function,x_vals,y_vals,p0=coefficients,sigma=sigma)
+            assert np.allclose(popt,expected_popt,rtol=1e-6,atol=1e-8)
+            assert np.allclose(perr,np.sqrt(np.diag(expected_pcov)),rtol=1e-4)
+
+    popt,perr = SP2_utilities.fitFunction(SP2_utilities.quadratic,[1.,2.],[3.,4.])
+    assert np.all(np.isnan(popt)) and np.all(np.isnan(perr))
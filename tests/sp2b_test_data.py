@@ -0,0 +1,131 @@
+import struct
+import numpy as np
+
+"""
+Synthetic .sp2b records and a stand-in database connection for the tests
+"""
+
+
+def makeRecord(random_state, number_of_samples=100, number_of_channels=8, labview_timestamp=3.5e9):
+    """
+    make one binary record with noise on every channel, Gaussian peaks on some of the scattering and incandescence channels, and a split detector signal that crosses its baseline
+    """
+    x_vals = np.arange(number_of_samples)
+    waveforms = random_state.randint(-50,50,size=(number_of_samples,number_of_channels)).astype(np.float64)
+
+    for channel in range(number_of_channels):
+        if channel in [3,7]:
+            continue
+        if random_state.rand() < 0.6:
+            amplitude = random_state.uniform(100,30000)
+            center = random_state.uniform(15,number_of_samples-15)
+            width = random_state.uniform(3,15)
+            waveforms[:,channel] += amplitude*np.exp(-(x_vals-center)**2/(2*width**2))
+
+    if random_state.rand() < 0.8:
+        notch = random_state.randint(20,80)
+        slope = random_state.choice([-1,1])
+        waveforms[:,3] = slope*3000*np.tanh((x_vals-notch)/5.)*np.exp(-(x_vals-notch)**2/400.) + random_state.randint(-20,20,number_of_samples)
+
+    waveforms = np.clip(np.round(waveforms),-32768,32767).astype('>i2')
+
+    record = struct.pack('>II',number_of_samples,number_of_channels) + waveforms.tobytes()
+    record += struct.pack('>H',random_state.randint(0,255))
+    record += struct.pack('>fff',1.0,0.0,float(random_state.randint(0,100000)))
+    record += struct.pack('>ff',float(int(labview_timestamp/10000)),float(labview_timestamp % 10000))
+    record += struct.pack('>ff',0,0) + struct.pack('>dd',0,0)
+    record += struct.pack('>I',0)
+
+    return record
+
+
+def makeRecords(number_of_records, seed=0, number_of_samples=100, number_of_channels=8):
+    """
+    make a block of records 0.01 s apart, as the contents of a .sp2b file
+    """
+    random_state = np.random.RandomState(seed)
+    return b''.join([makeRecord(random_state,number_of_samples,number_of_channels,3.5e9+i*0.01) for i in range(number_of_records)])
+
+
+def makeParameters(file_name, number_of_records, bytes_per_record, number_of_channels=8):
+    """
+    make the parameters used by the SP2_raw_data writers
+    """
+    return {
+        'file_name':file_name,
+        'number_of_records':number_of_records,
+        'bytes_per_record':bytes_per_record,
+        'acq_rate':5e6,
+        'number_of_channels':number_of_channels,
+        'min_detectable_signal':5000,
+        'min_detectable_incand_signal':5000,
+        'min_detectable_scat_signal':3000,
+        'instr_id':1,
+        'instr_locn_ID':2,
+        }
+
+
+class FakeCursor(object):
+
+    """
+    Records the rows given to executemany, with the statement they were given with, and the statements and parameters given to execute.  
+    If execute_error is given, execute raises it for statements starting with execute_error_prefix.  fetchall and fetchmany return the unread fetch_rows.
+    """
+
+    def __init__(self, execute_error=None, execute_error_prefix='', fetch_rows=None):
+        self.rows = []
+        self.statements = []
+        self.executed = []
+        self.execute_error = execute_error
+        self.execute_error_prefix = execute_error_prefix
+        self.fetch_rows = fetch_rows or []
+        self.fetch_position = 0
+        self.closed = False
+
+    def execute(self, statement, params=None):
+        if self.execute_error is not None and statement.startswith(self.execute_error_prefix):
+            raise self.execute_error
+        self.executed.append((statement,params))
+
+    def executemany(self, statement, rows):
+        self.rows.extend([dict(row) if isinstance(row,dict) else tuple(row) for row in rows])
+        self.statements.extend([statement]*len(rows))
+
+    def fetchall(self):
+        return self.fetchmany(len(self.fetch_rows))
+
+    def fetchmany(self, size):
+        rows = self.fetch_rows[self.fetch_position:self.fetch_position+size]
+        self.fetch_position += len(rows)
+        return list(rows)
+
+    def close(self):
+        self.closed = True
+
+    def getRows(self, statement):
+        return [row for row,row_statement in zip(self.rows,self.statements) if row_statement == statement]
+
+
+class FakeConnection(object):
+
+    """
+    Counts commits and rollbacks, cursor returns the cursor it was made with
+    """
+
+    def __init__(self, cursor=None):
+        self.commits = 0
+        self.rollbacks = 0
+        self.closed = False
+        self._cursor = cursor
+
+    def cursor(self, **cursor_args):
+        return self._cursor
+
+    def commit(self):
+        self.commits += 1
+
+    def rollback(self):
+        self.rollbacks += 1
+
+    def close(self):
+        self.closed = True